@@ -1,85 +1,236 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
-import pandas as pd
-import threading
+import atexit
 import time
 import os
 
 # --- Local imports ---
-from hardware import hardware_bp
+from hardware import hardware_bp, set_manual_pump
 from database import (
     init_db,
-    insert_data,
-    fetch_all,
+    fetch_latest,
+    fetch_sensor_page,
+    iter_sensor_rows,
+    iter_water_usage,
     log_water_usage,
-    fetch_water_usage,
-    fetch_water_usage_total,
     log_notification,
     fetch_notifications,
+    fetch_device_history,
+    fetch_changes,
     get_setting,
     set_setting,
 )
+from write_queue import writer, queue_sensor_row, queue_notification
+from events import events_bp, hub, publish
+from live_state import state
+from timeseries import recent
+import simulation
+import rollups
+import archive
+import ml_model
+import reports
+from cache import conditional, results as result_cache
+import instrumentation
+from instrumentation import instrumentation_bp
+from water_tracker import tracker, flow_rate, MANUAL_KEY
+import serial_bridge
+import cluster
+from cluster import shared
 
 app = Flask(__name__)
 CORS(app)  # allow frontend calls
 
 # Register blueprints (AFTER app is created)
 app.register_blueprint(hardware_bp)
+app.register_blueprint(events_bp)
+app.register_blueprint(instrumentation_bp)
 
 # --- Paths ---
 BASE_DIR = os.path.dirname(__file__)
-DATA_CSV = os.path.abspath(os.path.join(BASE_DIR, "..", "data", "sample_data.csv"))
 
 # --- Simulation State ---
-simulation_data = []
-simulation_running = False
-simulation_index = 0
-current_row = None  # last processed row
+# All simulations (the dashboard's "default" one and any zone sessions) are
+# simulation.SimulationSession objects stepped by one shared scheduler clock.
+# The scheduler runs in the leader process (cluster.py); other workers see the
+# sessions through the "simulation" shared value and start/stop them with
+# cluster.call().
+DEFAULT_SESSION = "default"
 
 # --- Mode State ---
-# 'simulation' or 'hardware'
-current_mode = "simulation"
-last_pump_status = "OFF"
+# Mode ('simulation' or 'hardware') and pump status are cluster.shared values,
+# so every worker process answers the same
 
 
-def run_simulation():
-    global simulation_running, simulation_index, current_row, last_pump_status
-    while simulation_running and simulation_index < len(simulation_data):
-        # Get current row and compute pump + persist, so it works even if no client is polling
-        row = simulation_data[simulation_index].copy()
+def _mode():
+    return shared.get("mode", "simulation")
 
-        # Compute pump status based on soil moisture
-        soil = float(row.get("soil_moisture", 500))
+
+def _pump_status():
+    return shared.get("pump_status", "OFF")
+
+
+def _set_pump_status(status, source):
+    """Update the pump state and push a 'pump' event when it actually changes."""
+    if _pump_status() == status:
+        return
+    if (shared.set("pump_status", status) or "OFF") != status:
+        publish("pump", {"pump_status": status, "source": source})
+
+
+def _notify(message, type_="info", timestamp=None, queued=False):
+    """Persist a notification (directly or via the write-behind queue) and push it."""
+    timestamp = timestamp or time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    try:
+        if queued:
+            queue_notification(message, type_, timestamp)
+        else:
+            log_notification(message, type_, timestamp)
+    except Exception:
+        return
+    publish("notification", {"timestamp": timestamp, "message": message, "type": type_})
+
+
+def _water_key(session):
+    return f"simulation:{session.id}"
+
+
+def process_simulation_row(session, row):
+    """Per-row work for a simulation session: pump decision, persistence, events."""
+    # Compute pump + persist for each row, so it works even if no client is polling
+    # Compute pump status based on soil moisture
+    soil = row.get("soil_moisture")
+    soil = 500.0 if soil is None else float(soil)
+    threshold = session.threshold
+    if threshold is None:
         try:
             threshold = float(get_setting("moisture_threshold", "500") or 500)
         except Exception:
             threshold = 500
-        row["pump_status"] = 1 if soil < threshold else 0
-
-        # Log water usage when pump is ON
-        if row["pump_status"] == 1:
-            liters_used = 2.0
-            log_water_usage(row.get("timestamp"), liters_used)
-            last_pump_status = "ON"
-            try:
-                log_notification("Pump turned ON by simulation", "info", row.get("timestamp"))
-            except Exception:
-                pass
-        else:
-            last_pump_status = "OFF"
+    # With use_forecast on, also water ahead of a predicted drop below threshold
+    forecast = row.get("forecast_moisture")
+    if forecast is not None and get_setting("use_forecast", "false") == "true":
+        soil = min(soil, forecast)
+    row["pump_status"] = 1 if soil < threshold else 0
+    if session.device_id is not None:
+        row["device_id"] = session.device_id
+    is_default = session.id == DEFAULT_SESSION
+
+    # Water is accounted per irrigation event: only ON/OFF transitions write
+    tracker.observe(_water_key(session), row["pump_status"] == 1, row.get("timestamp"), session.device_id)
+    if row["pump_status"] == 1:
+        if session.pump_status != "ON" and not is_default:
+            publish("pump", {"pump_status": "ON", "source": "simulation", "session": session.id})
+        session.pump_status = "ON"
+        if is_default:
+            _set_pump_status("ON", "simulation")
+            _notify("Pump turned ON by simulation", "info", row.get("timestamp"), queued=True)
+    else:
+        if session.pump_status != "OFF" and not is_default:
+            publish("pump", {"pump_status": "OFF", "source": "simulation", "session": session.id})
+        session.pump_status = "OFF"
+        if is_default:
+            _set_pump_status("OFF", "simulation")
+
+    # Persist sensor row (batched by the write-behind queue)
+    queue_sensor_row(row)
+    publish("sensor", row)
+
+
+def _simulation_finished(session):
+    tracker.close(_water_key(session))
+    publish("simulation", {"status": session.status, "session": session.id,
+                           "index": session.index, "total": session.total})
+
+
+def _forecast_simulation_rows(pairs):
+    """Scheduler prepare hook: one batched forecast for every session due this tick."""
+    predictions = ml_model.predict_batch([list(s.history) + [row] for s, row in pairs])
+    if predictions is None:
+        return
+    for (_, row), value in zip(pairs, predictions):
+        row["forecast_moisture"] = round(value, 1)
 
-        # Persist sensor row
-        insert_data(row)
 
-        # Expose latest row
-        current_row = row
+scheduler = simulation.SimulationScheduler(
+    process_simulation_row, _simulation_finished, prepare=_forecast_simulation_rows)
 
-        # Advance to next step
-        simulation_index += 1
-        time.sleep(1)   # simulate 1 second per row
+# Point-in-time values sampled on each /api/internal/metrics scrape
+instrumentation.register_gauge("write_queue_pending", "Rows waiting in the write-behind queue.", lambda: writer.pending)
+instrumentation.register_gauge("write_queue_errors", "Write-behind batches dropped after an error.", lambda: writer.errors)
+instrumentation.register_gauge("write_queue_rows_dropped", "Write-behind rows dropped after an error.",
+                               lambda: writer.rows_dropped)
+instrumentation.register_gauge("sse_subscribers", "Connected /api/events clients.", lambda: hub.subscriber_count)
+instrumentation.register_gauge("simulation_sessions_running", "Running simulation sessions.", scheduler.running_count)
+instrumentation.register_gauge("result_cache_hits", "Result cache hits since start.", lambda: result_cache.hits)
+instrumentation.register_gauge("result_cache_misses", "Result cache misses since start.", lambda: result_cache.misses)
+instrumentation.register_gauge("recent_buffer_rows", "Sensor rows held in memory by timeseries.recent.",
+                               lambda: recent.stats()["rows"])
 
-    simulation_running = False
 
+def _sessions():
+    """{session id: SimulationSession.to_dict()}, from whichever process runs the scheduler."""
+    if cluster.is_leader():
+        return {s.id: s.to_dict() for s in list(scheduler.sessions.values())}
+    return shared.get("simulation", {})
+
+
+@cluster.leader.every_tick
+def _share_sessions():
+    sessions = _sessions()
+    if sessions != _share_sessions.last:
+        shared.set("simulation", sessions)
+        _share_sessions.last = sessions
+
+
+_share_sessions.last = None
+
+
+# Leader-only work: the scheduler, and the jobs that must run in one process
+@cluster.leader.on_elected
+def _start_jobs():
+    rollups.start_compactor()
+    archive.start_retention()
+    if serial_link is not None:
+        serial_link.start()
+
+
+@cluster.leader.on_demoted
+def _stop_jobs():
+    scheduler.stop_all()
+    rollups.stop_compactor()
+    archive.stop_retention()
+    if serial_link is not None:
+        serial_link.stop()
+    _share_sessions.last = None
+
+
+def _simulation_running():
+    session = _sessions().get(DEFAULT_SESSION)
+    return session is not None and session["running"]
+
+
+def _reply(result):
+    body, status = result
+    return jsonify(body), status
+
+
+def _start_session(session_id, data, device_id=None):
+    """Create and start a session from a request body; returns (session, (error dict, status))."""
+    try:
+        path = simulation.resolve_source(data.get("source"))
+        session = simulation.SimulationSession(
+            session_id, path,
+            threshold=data.get("threshold"),
+            speed=float(data.get("speed", 1.0)),
+            device_id=device_id,
+        )
+        scheduler.start(session)
+    except FileNotFoundError as e:
+        return None, ({"error": str(e)}, 404)
+    except (TypeError, ValueError) as e:
+        return None, ({"error": str(e)}, 400)
+    publish("simulation", {"status": "started", "session": session_id, "index": 0, "total": session.total})
+    return session, None
 
 
 # --- Health check ---
@@ -90,47 +241,81 @@ def health_check():
 
 @app.route("/api/simulation/start", methods=["POST"])
 def start_simulation():
-    global simulation_running, simulation_thread, simulation_index, simulation_data
-
-    if current_mode == "hardware":
+    if _mode() == "hardware":
         return jsonify({"error": "Simulation disabled in hardware mode"}), 400
-    if simulation_running:
-        return jsonify({"status": "already_running"})
+    # Optional {"source": "<file>.csv"} picks another recording from data/;
+    # rows are streamed from the file in chunks, not loaded up front
+    data = request.get_json(silent=True) or {}
+    return _reply(cluster.call("simulation.start", data=data))
+
 
-    if not os.path.exists(DATA_CSV):
-        return jsonify({"error": f"CSV not found at {DATA_CSV}"}), 404
+@cluster.command("simulation.start")
+def _start_default_simulation(data):
+    if _simulation_running():
+        return {"status": "already_running"}, 200
+    session, error = _start_session(DEFAULT_SESSION, data)
+    if error:
+        return error
+    return {"status": "started", "total_rows": session.total}, 200
 
-    # Load CSV fresh
-    df = pd.read_csv(DATA_CSV)
-    simulation_data = df.to_dict(orient="records")
 
-    # reset index and state
-    simulation_index = 0
-    simulation_running = True
+@app.route("/api/simulation/fast-forward", methods=["POST"])
+def simulation_fast_forward():
+    """Replay a whole CSV at full speed (vectorized) and return a summary.
 
-    # start background simulation
-    simulation_thread = threading.Thread(target=run_simulation, daemon=True)
-    simulation_thread.start()
+    Body: {"source": "<file>.csv", "threshold": 450, "dry_run": false}
+    or {"source": ..., "thresholds": [400, 450, 500]} to compare without writing.
+    """
+    if _simulation_running():
+        return jsonify({"error": "Stop the running simulation first"}), 409
+    data = request.get_json(silent=True) or {}
+    try:
+        path = simulation.resolve_source(data.get("source"))
+        if data.get("thresholds"):
+            return jsonify(simulation.evaluate_thresholds(path, data["thresholds"]))
+        threshold = data.get("threshold")
+        if threshold is None:
+            threshold = get_setting("moisture_threshold", "500") or 500
+        return jsonify(simulation.fast_forward(
+            path, float(threshold), device_id=data.get("device_id"), persist=not data.get("dry_run")))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify({"status": "started", "total_rows": len(simulation_data)})
 
+@app.route("/api/simulation/sources", methods=["GET"])
+def simulation_sources():
+    return jsonify({"sources": simulation.list_sources(), "default": simulation.DEFAULT_SOURCE})
 
 
 @app.route("/api/simulation/stop", methods=["POST"])
 def stop_simulation():
-    global simulation_running
-    simulation_running = False
-    return jsonify({"status": "stopped"})
+    return _reply(cluster.call("simulation.stop"))
+
+
+@cluster.command("simulation.stop")
+def _stop_default_simulation():
+    scheduler.stop(DEFAULT_SESSION)
+    return {"status": "stopped"}, 200
+
+
+@cluster.command("simulation.stop_all")
+def _stop_all_simulations():
+    scheduler.stop_all()
+    return {"status": "stopped"}, 200
 
 
 @app.route("/api/simulation/data", methods=["GET"])
 def get_simulation_data():
     # Return the latest processed row when running; otherwise return status
-    if current_mode == "hardware":
+    if _mode() == "hardware":
         return jsonify({"status": "hardware_mode"})
-    if not simulation_running and current_row is None:
+    session = _sessions().get(DEFAULT_SESSION)
+    current_row = session["current_row"] if session else None
+    if session is None or (not session["running"] and current_row is None):
         return jsonify({"status": "stopped"})
-    if simulation_running is False and simulation_index >= len(simulation_data) and len(simulation_data) > 0:
+    if session["status"] == "completed":
         return jsonify({"status": "completed"})
     if current_row is None:
         return jsonify({"status": "starting"})
@@ -139,109 +324,201 @@ def get_simulation_data():
 
 @app.route("/api/simulation/status", methods=["GET"]) 
 def simulation_status():
-    total = len(simulation_data)
+    sessions = _sessions()
+    session = sessions.get(DEFAULT_SESSION)
     return jsonify({
-        "running": simulation_running,
-        "index": simulation_index,
-        "total": total,
-        "current_row": current_row
+        "running": bool(session and session["running"]),
+        "index": session["index"] if session else 0,
+        "total": session["total"] if session else 0,
+        "current_row": session["current_row"] if session else None,
+        "sessions_running": sum(1 for s in sessions.values() if s["running"]),
     })
 
 
+# --- Multi-zone simulation sessions ---
+@app.route("/api/simulation/sessions", methods=["GET", "POST"])
+def simulation_sessions():
+    """List sessions, or start one: {"id": "zone-1", "source": "...csv", "threshold": 450, "speed": 2}"""
+    if request.method == "GET":
+        return jsonify(list(_sessions().values()))
+    if _mode() == "hardware":
+        return jsonify({"error": "Simulation disabled in hardware mode"}), 400
+    data = request.get_json(silent=True) or {}
+    return _reply(cluster.call("simulation.sessions.start", data=data))
+
+
+@cluster.command("simulation.sessions.start")
+def _start_zone_session(data):
+    session_id = str(data.get("id") or f"zone-{len(scheduler.sessions) + 1}")
+    # zone sessions tag their rows with the session id; the default one stays untagged
+    device_id = None if session_id == DEFAULT_SESSION else str(data.get("device_id") or session_id)
+    session, error = _start_session(session_id, data, device_id)
+    if error:
+        return error
+    return session.to_dict(), 201
+
+
+@app.route("/api/simulation/sessions/<session_id>", methods=["GET", "DELETE"])
+def simulation_session(session_id):
+    if request.method == "DELETE":
+        return _reply(cluster.call("simulation.sessions.remove", session_id=session_id))
+    session = _sessions().get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify(session)
+
+
+@cluster.command("simulation.sessions.remove")
+def _remove_session(session_id):
+    session = scheduler.remove(session_id)
+    if session is None:
+        return {"error": "Unknown session"}, 404
+    return session.to_dict(), 200
+
+
+@app.route("/api/simulation/sessions/<session_id>/stop", methods=["POST"])
+def simulation_session_stop(session_id):
+    return _reply(cluster.call("simulation.sessions.stop", session_id=session_id))
+
+
+@cluster.command("simulation.sessions.stop")
+def _stop_session(session_id):
+    session = scheduler.stop(session_id)
+    if session is None:
+        return {"error": "Unknown session"}, 404
+    return session.to_dict(), 200
+
+
 # --- Pump Control APIs ---
 @app.route("/api/pump/on", methods=["POST"])
 def pump_on():
-    global last_pump_status
-    last_pump_status = "ON"
-    try:
-        log_notification("Pump manually turned ON", "info")
-    except Exception:
-        pass
+    _set_pump_status("ON", "manual")
+    tracker.sync([MANUAL_KEY], live=True)
+    tracker.observe(MANUAL_KEY, True)
+    _notify("Pump manually turned ON", "info")
     return jsonify({"status": "Pump turned ON"})
 
 
 @app.route("/api/pump/off", methods=["POST"])
 def pump_off():
-    global last_pump_status
-    last_pump_status = "OFF"
-    try:
-        log_notification("Pump manually turned OFF", "info")
-    except Exception:
-        pass
+    _set_pump_status("OFF", "manual")
+    tracker.sync([MANUAL_KEY], live=True)
+    tracker.observe(MANUAL_KEY, False)
+    _notify("Pump manually turned OFF", "info")
     return jsonify({"status": "Pump turned OFF"})
 
 
-# Simple hardware pump control endpoint for Pump Control page
-@app.route("/api/hardware/pump", methods=["POST"]) 
+# Manual pump control (Pump Control page); the only handler for this route
+@app.route("/api/hardware/pump", methods=["POST"])
 def hardware_pump():
     data = request.get_json(silent=True) or {}
     action = str(data.get("action", "")).upper()
     if action not in ("ON", "OFF"):
         return jsonify({"error": "Invalid action"}), 400
-    global last_pump_status
-    last_pump_status = action
-    try:
-        log_notification(f"Pump manually turned {action}", "info")
-    except Exception:
-        pass
-    return jsonify({"status": f"Pump {action}"})
+    set_manual_pump(action)  # latest reading + manual irrigation event
+    _set_pump_status(action, "manual")
+    _notify(f"Pump manually turned {action}", "info")
+    return jsonify({"status": "pump updated", "pump_status": action})
 
 
 # --- Data APIs ---
+def _sensor_dict(r):
+    return {"id": r[0], "timestamp": r[1], "soil_moisture": r[2],
+            "temperature": r[3], "humidity": r[4], "pump_status": r[5]}
+
+
+def _cursor_args():
+    """(before_id, after_id) keyset cursors from the query string; ValueError if malformed."""
+    before_id = request.args.get("before_id")
+    after_id = request.args.get("after_id")
+    return (int(before_id) if before_id else None, int(after_id) if after_id else None)
+
+
+def _limit_arg():
+    """?limit as a non-negative int, None when absent; ValueError if malformed or negative."""
+    limit = int(request.args["limit"]) if request.args.get("limit") else None
+    if limit is not None and limit < 0:
+        raise ValueError("limit must not be negative")  # SQLite reads LIMIT -1 as "no limit"
+    return limit
+
+
+def _stream_rows(rows, to_dict):
+    """Stream rows as a JSON array (default) or NDJSON (?format=ndjson) without buffering."""
+    ndjson = request.args.get("format") == "ndjson"
+    dumps = app.json.dumps
+
+    def generate():
+        if ndjson:
+            for r in rows:
+                yield dumps(to_dict(r)) + "\n"
+            return
+        yield "["
+        first = True
+        for r in rows:
+            yield ("" if first else ",") + dumps(to_dict(r))
+            first = False
+        yield "]\n"
+
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
 @app.route("/api/data/all", methods=["GET"])
 def get_all_data():
-    rows = fetch_all()
-    result = [
-        {"id": r[0], "timestamp": r[1], "soil_moisture": r[2],
-         "temperature": r[3], "humidity": r[4], "pump_status": r[5]}
-        for r in rows
-    ]
-    return jsonify(result)
+    """All sensor rows, newest first, streamed from the DB cursor.
+
+    Optional keyset paging: ?limit=N&before_id=ID (older rows) or
+    ?after_id=ID (newer rows, oldest first). ?format=ndjson streams NDJSON.
+    """
+    try:
+        limit = _limit_arg()
+        before_id, after_id = _cursor_args()
+    except ValueError:
+        return jsonify({"error": "limit must be a non-negative integer, before_id and after_id integers"}), 400
+    return _stream_rows(iter_sensor_rows(limit, before_id, after_id), _sensor_dict)
+
+
+RECENT_MAX_ROWS = 1000  # /api/data/recent page size cap; larger reads go through /api/data/all
 
 
 @app.route("/api/data/recent", methods=["GET"]) 
+@conditional("sensor_data")
 def get_recent_data():
-    """Return most recent N sensor_data rows"""
+    """Return most recent N sensor_data rows (older pages via ?before_id=ID)"""
     try:
         limit = int(request.args.get("limit", "50"))
     except ValueError:
         limit = 50
-    rows = fetch_all()  # already ordered DESC
-    rows = rows[:limit]
-    result = [
-        {"id": r[0], "timestamp": r[1], "soil_moisture": r[2],
-         "temperature": r[3], "humidity": r[4], "pump_status": r[5]}
-        for r in rows
-    ]
-    return jsonify(result)
+    limit = min(max(limit, 1), RECENT_MAX_ROWS)
+    try:
+        before_id, after_id = _cursor_args()
+    except ValueError:
+        return jsonify({"error": "before_id and after_id must be integers"}), 400
+    rows = fetch_sensor_page(limit, before_id, after_id)
+    return jsonify([_sensor_dict(r) for r in rows])
 
 
 # --- Mode APIs ---
 @app.route("/api/mode", methods=["GET", "POST"])
 def api_mode():
-    global current_mode
     if request.method == "GET":
-        return jsonify({"mode": current_mode})
+        return jsonify({"mode": _mode()})
     data = request.get_json(silent=True) or {}
     mode = str(data.get("mode", "")).lower()
     if mode not in ("simulation", "hardware"):
         return jsonify({"error": "Invalid mode"}), 400
-    current_mode = mode
+    if (shared.set("mode", mode) or "simulation") != mode:
+        publish("mode", {"mode": mode})
     # Stop simulation if switching to hardware
-    if current_mode == "hardware":
-        global simulation_running
-        simulation_running = False
-    return jsonify({"mode": current_mode})
+    if mode == "hardware":
+        cluster.call("simulation.stop_all")
+    return jsonify({"mode": mode})
 
 
 @app.route("/api/sensors/latest", methods=["GET"])
+@conditional("sensor_data")
 def sensors_latest():
-    import sqlite3
-    conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), "irrigation.db"))
-    c = conn.cursor()
-    c.execute("SELECT timestamp, soil_moisture, temperature, humidity, pump_status FROM sensor_data ORDER BY id DESC LIMIT 1")
-    r = c.fetchone()
-    conn.close()
+    r = fetch_latest()
     if not r:
         return jsonify({})
     return jsonify({
@@ -264,29 +541,82 @@ def water_log():
 
 
 @app.route("/api/water/usage", methods=["GET"])
+@conditional("water_usage")
 def water_usage():
-    data = fetch_water_usage()
-    usage_list = [{"timestamp": row[1], "liters_used": row[2]} for row in data]
-    resp = jsonify(usage_list)
-    # Prevent any caching so the page live-updates reliably
-    resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
-    resp.headers["Pragma"] = "no-cache"
-    return resp
+    """Water usage rows, newest first; same paging/streaming options as /api/data/all.
+
+    Not cached (streamed), but polls revalidate with If-None-Match and get a 304 until a write.
+    """
+    try:
+        limit = _limit_arg()
+        before_id, after_id = _cursor_args()
+    except ValueError:
+        return jsonify({"error": "limit must be a non-negative integer, before_id and after_id integers"}), 400
+    rows = iter_water_usage(limit, before_id, after_id)
+    return _stream_rows(rows, _water_dict)
 
 
 # --- Cross-page status API ---
+def _status():
+    state.refresh()
+    return {
+        "mode": _mode(),
+        "simulation_running": _simulation_running(),
+        "pump_status": _pump_status(),
+        "water_used": state.total_liters,
+        "water_in_progress": tracker.open_liters(),
+    }
+
+
 @app.route("/api/status", methods=["GET"])
 def api_status():
+    return jsonify(_status())
+
+
+DASHBOARD_MAX_ROWS = 1000
+
+
+def _water_dict(r):
+    return {"id": r[0], "timestamp": r[1], "liters_used": r[2],
+            "ended_at": r[3], "duration_s": r[4], "device_id": r[5]}
+
+
+@app.route("/api/dashboard", methods=["GET"])
+def api_dashboard():
+    """Status plus the sensor rows, water events and notifications added since `cursor`.
+
+    The first call (no cursor) returns the newest ?limit=N (default 50) of each;
+    pass the returned "cursor" back to get only what was added since. "more"
+    flags a feed whose delta was cut to the newest `limit` rows.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", "50")), 0), DASHBOARD_MAX_ROWS)
+        cursor = request.args.get("cursor")
+        after = [int(x) for x in cursor.split("-")] if cursor else [0, 0, 0]
+        if len(after) != 3 or min(after) < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "limit must be an integer and cursor '<sensor>-<water>-<notification>' ids"}), 400
+    changes = fetch_changes(*after, limit=limit)
+    feeds = ("sensor", "water", "notifications")
+    last = [rows[-1][0] if rows else a for rows, a in zip((changes[f] for f in feeds), after)]
     return jsonify({
-        "mode": current_mode,
-        "simulation_running": simulation_running,
-        "pump_status": last_pump_status,
-        "water_used": float(fetch_water_usage_total()),
+        "cursor": "-".join(map(str, last)),
+        "status": _status(),
+        "sensor": [_sensor_dict(r) for r in changes["sensor"]],
+        "water": [_water_dict(r) for r in changes["water"]],
+        "notifications": [
+            {"id": r[0], "timestamp": r[1], "message": r[2], "type": r[3]} for r in changes["notifications"]
+        ],
+        # rows were skipped between the cursor and the oldest row returned
+        "more": {f: bool(cursor) and len(changes[f]) == limit > 0 and changes[f][0][0] > a + 1
+                 for f, a in zip(feeds, after)},
     })
 
 
 # --- Notifications API ---
 @app.route("/api/notifications", methods=["GET"])  
+@conditional("notifications")
 def api_notifications():
     try:
         rows = fetch_notifications(limit=int(request.args.get("limit", 10)))
@@ -299,85 +629,67 @@ def api_notifications():
 
 # --- Reports API ---
 @app.route("/api/reports", methods=["GET"])
+@conditional("sensor_data", "water_usage")
 def api_reports():
-    import sqlite3, io, csv
-    from flask import Response
     range_key = request.args.get("range", "daily")
     export = request.args.get("export")  # 'csv' or 'pdf'
-    conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), "irrigation.db"))
-    c = conn.cursor()
-    # Determine grouping
-    if range_key == "weekly":
-        bucket = "%Y-%W"
-    else:
-        bucket = "%Y-%m-%d"
-    c.execute(
-        f"""
-        SELECT strftime('{bucket}', timestamp) as bucket,
-               AVG(soil_moisture), AVG(temperature), AVG(humidity)
-        FROM sensor_data
-        GROUP BY bucket
-        ORDER BY bucket ASC
-        """
-    )
-    sensor_rows = c.fetchall()
-    c.execute(
-        f"""
-        SELECT strftime('{bucket}', timestamp) as bucket,
-               SUM(liters_used)
-        FROM water_usage
-        GROUP BY bucket
-        ORDER BY bucket ASC
-        """
-    )
-    water_rows = c.fetchall()
-    conn.close()
-
-    # Merge by bucket
-    water_map = {r[0]: (r[1] or 0) for r in water_rows}
-    report = []
-    for b, avg_m, avg_t, avg_h in sensor_rows:
-        report.append({
-            "bucket": b,
-            "avg_soil_moisture": avg_m or 0,
-            "avg_temperature": avg_t or 0,
-            "avg_humidity": avg_h or 0,
-            "total_liters": water_map.get(b, 0)
-        })
 
     if export == "csv":
-        si = io.StringIO()
-        writer = csv.writer(si)
-        writer.writerow(["bucket", "avg_soil_moisture", "avg_temperature", "avg_humidity", "total_liters"])
-        for r in report:
-            writer.writerow([r["bucket"], r["avg_soil_moisture"], r["avg_temperature"], r["avg_humidity"], r["total_liters"]])
-        output = si.getvalue()
-        return Response(output, mimetype='text/csv', headers={'Content-Disposition': 'attachment; filename=report.csv'})
+        # streamed straight from the rollup cursor; nothing is buffered
+        return Response(
+            stream_with_context(reports.iter_csv(reports.iter_report(range_key))),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=report.csv'},
+        )
 
     if export == "pdf":
-        try:
-            from reportlab.lib.pagesizes import letter
-            from reportlab.pdfgen import canvas
-            buf = io.BytesIO()
-            cpdf = canvas.Canvas(buf, pagesize=letter)
-            cpdf.setFont("Helvetica", 12)
-            y = 750
-            cpdf.drawString(50, y, "Smart Irrigation Report")
-            y -= 30
-            for r in report:
-                line = f"{r['bucket']}: Moist {r['avg_soil_moisture']:.1f}, Temp {r['avg_temperature']:.1f}C, Hum {r['avg_humidity']:.1f}%, Liters {r['total_liters']:.1f}"
-                cpdf.drawString(50, y, line)
-                y -= 18
-                if y < 50:
-                    cpdf.showPage(); y = 750
-            cpdf.save()
-            pdf = buf.getvalue()
-            buf.close()
-            return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': 'attachment; filename=report.pdf'})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-
-    return jsonify(report)
+        # rendered in the background: serve the cached file if it is current, else hand back the job to poll
+        job = reports.jobs.submit(range_key)
+        path = reports.jobs.file_for(job)
+        if path:
+            return send_file(path, mimetype='application/pdf', as_attachment=True, download_name='report.pdf')
+        return _report_job_response(job, 202)
+
+    return jsonify(list(reports.iter_report(range_key)))
+
+
+def _report_job_response(job, status=200):
+    job = dict(job, download_url=f"/api/reports/jobs/{job['id']}/download" if job["status"] == "done" else None)
+    resp = jsonify(job)
+    resp.status_code = status
+    if status == 202:
+        resp.headers["Location"] = f"/api/reports/jobs/{job['id']}"
+    return resp
+
+
+@app.route("/api/reports/jobs", methods=["POST"])
+def api_report_jobs():
+    data = request.get_json(silent=True) or {}
+    range_key = data.get("range", "daily")
+    if range_key not in reports.RANGES:
+        return jsonify({"error": f"range must be one of {', '.join(reports.RANGES)}"}), 400
+    job = reports.jobs.submit(range_key)
+    return _report_job_response(job, 200 if job["status"] == "done" else 202)
+
+
+@app.route("/api/reports/jobs/<job_id>", methods=["GET"])
+def api_report_job(job_id):
+    job = reports.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return _report_job_response(job)
+
+
+@app.route("/api/reports/jobs/<job_id>/download", methods=["GET"])
+def api_report_job_download(job_id):
+    job = reports.jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    path = reports.jobs.file_for(job)
+    if path is None:
+        return jsonify({"error": f"report is {job['status']}", "job": job}), 409
+    return send_file(path, mimetype='application/pdf', as_attachment=True,
+                     download_name=f"report-{job['range']}.pdf")
 
 
 # --- Settings API ---
@@ -387,27 +699,136 @@ def api_settings():
         return jsonify({
             "moisture_threshold": float(get_setting("moisture_threshold", "500") or 500),
             "auto_mode": (get_setting("auto_mode", "false") == "true"),
+            "use_forecast": (get_setting("use_forecast", "false") == "true"),
+            "flow_rate_lpm": flow_rate(),
+            "retention_days": archive.retention_days(),
         })
     data = request.get_json(silent=True) or {}
     if "moisture_threshold" in data:
         set_setting("moisture_threshold", str(data.get("moisture_threshold")))
     if "auto_mode" in data:
         set_setting("auto_mode", "true" if data.get("auto_mode") else "false")
+    if "flow_rate_lpm" in data:
+        try:
+            flow = float(data["flow_rate_lpm"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "flow_rate_lpm must be a number"}), 400
+        if flow <= 0:
+            return jsonify({"error": "flow_rate_lpm must be positive"}), 400
+        set_setting("flow_rate_lpm", str(flow))
+    if "retention_days" in data:
+        try:
+            days = float(data["retention_days"] or 0)
+        except (TypeError, ValueError):
+            return jsonify({"error": "retention_days must be a number (0 disables retention)"}), 400
+        if days < 0:
+            return jsonify({"error": "retention_days must not be negative"}), 400
+        set_setting("retention_days", str(days))
+    if "use_forecast" in data:
+        set_setting("use_forecast", "true" if data.get("use_forecast") else "false")
     return jsonify({"status": "saved"})
 
 
+# --- Moisture forecast API ---
+@app.route("/api/forecast", methods=["GET", "POST"])
+def api_forecast():
+    """Moisture forecast (ml_model.HORIZON readings ahead) for many zones in one call.
+
+    GET ?device_id=a,b forecasts from each device's newest stored readings
+    (no device_id: the newest readings overall). POST {"zones": {"a": [reading, ...]}}
+    forecasts from caller-supplied readings, oldest first.
+    """
+    if ml_model.model_info() is None:
+        return jsonify({"error": "No forecast model loaded; POST /api/forecast/train first"}), 503
+    if request.method == "GET":
+        ids = [d.strip() for d in request.args.get("device_id", "").split(",") if d.strip()] or [None]
+        histories = fetch_device_history(ids, ml_model.LAGS)
+    else:
+        zones = (request.get_json(silent=True) or {}).get("zones")
+        if not isinstance(zones, dict) or not all(isinstance(v, list) for v in zones.values()):
+            return jsonify({"error": "Body must be {\"zones\": {\"<id>\": [readings...]}}"}), 400
+        histories = zones
+    ids = list(histories)
+    started = time.perf_counter()
+    try:
+        predictions = ml_model.predict_batch([histories[i] for i in ids]) or []
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({"error": f"Invalid readings: {e}"}), 400
+    elapsed_ms = (time.perf_counter() - started) * 1e3
+    return jsonify({
+        "horizon": ml_model.HORIZON,
+        "forecasts": [
+            {
+                "device_id": i,
+                "soil_moisture": histories[i][-1].get("soil_moisture") if histories[i] else None,
+                "forecast_moisture": round(p, 1) if histories[i] else None,
+            }
+            for i, p in zip(ids, predictions)
+        ],
+        "inference_ms": round(elapsed_ms, 3),
+    })
+
+
+@app.route("/api/forecast/model", methods=["GET"])
+def api_forecast_model():
+    info = ml_model.model_info()
+    if info is None:
+        return jsonify({"loaded": False}), 404
+    return jsonify({"loaded": True, **info})
+
+
+@app.route("/api/forecast/train", methods=["POST"])
+def api_forecast_train():
+    try:
+        return jsonify(ml_model.train())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+# --- Serial bridge (USB-attached NodeMCU) ---
+serial_link = serial_bridge.from_env()  # started by the leader when IRRIGATION_SERIAL_PORT is set
+
+
+@app.route("/api/hardware/serial", methods=["GET"])
+def api_serial_status():
+    if serial_link is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(serial_link.status(), enabled=True))
+
+
+# --- Sensor archive / retention ---
+@app.route("/api/archive", methods=["GET"])
+def api_archive():
+    return jsonify(archive.summary())
+
+
+@app.route("/api/archive/run", methods=["POST"])
+def api_archive_run():
+    """Archive now; body {"days": N} overrides the retention_days setting."""
+    data = request.get_json(silent=True) or {}
+    try:
+        days = float(data["days"]) if data.get("days") is not None else archive.retention_days()
+    except (TypeError, ValueError):
+        return jsonify({"error": "days must be a number"}), 400
+    if days <= 0:
+        return jsonify({"error": "No retention configured; pass days or set retention_days"}), 400
+    return jsonify(archive.archive_older_than(days))
+
+
 # --- System summary API ---
 @app.route("/api/system/summary", methods=["GET"]) 
 def api_system_summary():
     try:
         health = {"backend": "ok"}
-        mode = current_mode
+        state.refresh()
         status = {
             "health": health,
-            "mode": mode,
-            "simulation_running": simulation_running,
-            "pump_status": last_pump_status,
-            "water_used": float(fetch_water_usage_total()),
+            "mode": _mode(),
+            "simulation_running": _simulation_running(),
+            "pump_status": _pump_status(),
+            "water_used": state.total_liters,
+            "pump_on_ticks": state.pump_on_ticks,
+            "sensor_rows": state.sensor_rows,
             "moisture_threshold": float(get_setting("moisture_threshold", "500") or 500),
         }
         return jsonify(status)
@@ -416,65 +837,60 @@ def api_system_summary():
 
 
 # --- Metrics APIs (last 24 hours) ---
-def _since_for_range(range_key: str) -> str:
-    import datetime
-    now = datetime.datetime.utcnow()
-    if range_key == "24h":
-        dt = now - datetime.timedelta(hours=24)
-    elif range_key == "7d":
-        dt = now - datetime.timedelta(days=7)
-    elif range_key == "30d":
-        dt = now - datetime.timedelta(days=30)
-    elif range_key == "90d":
-        dt = now - datetime.timedelta(days=90)
-    else:
-        dt = now - datetime.timedelta(hours=24)
-    return dt.strftime("%Y-%m-%d %H:%M:%S")
+RANGE_SECONDS = {
+    "24h": 24 * 3600,
+    "7d": 7 * 86400,
+    "30d": 30 * 86400,
+    "90d": 90 * 86400,
+}
+
+
+MIN_POINTS = 10  # smallest accepted max_points for /api/metrics/sensors
+METRICS_STEP = 60  # metrics windows move in whole minutes, so results can be cached per minute
+
+
+def _since_for_range(range_key: str) -> int:
+    """Epoch seconds (UTC) for the start of a metrics range; unknown keys mean 24h."""
+    now = int(time.time()) // METRICS_STEP * METRICS_STEP
+    return now - RANGE_SECONDS.get(range_key, RANGE_SECONDS["24h"])
 
 
 @app.route("/api/metrics/water", methods=["GET"]) 
+@conditional("water_usage", every=METRICS_STEP)
 def metrics_water():
-    import sqlite3
     range_key = request.args.get("range", "24h")
     since = _since_for_range(range_key)
-    conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), "irrigation.db"))
-    c = conn.cursor()
     # Group by hour for 24h; by day for >=7d
-    bucket = "%Y-%m-%d %H:00:00" if range_key == "24h" else "%Y-%m-%d"
-    c.execute(
-        f"""
-        SELECT strftime('{bucket}', timestamp) as bucket,
-               SUM(liters_used) as liters
-        FROM water_usage
-        WHERE timestamp >= ?
-        GROUP BY bucket
-        ORDER BY bucket ASC
-        """,
-        (since,)
-    )
-    rows = c.fetchall()
-    conn.close()
-    return jsonify([{"bucket": r[0], "liters": r[1] or 0} for r in rows])
+    if range_key == "24h":
+        bucket, width = "%Y-%m-%d %H:00:00", rollups.HOUR
+    else:
+        bucket, width = "%Y-%m-%d", rollups.DAY
+    rows = rollups.water_buckets(width, since)
+    return jsonify([{"bucket": rollups.label(r[0], bucket), "liters": r[1] or 0} for r in rows])
 
 
 @app.route("/api/metrics/sensors", methods=["GET"]) 
+@conditional("sensor_data", every=METRICS_STEP)
 def metrics_sensors():
-    import sqlite3
+    """Raw sensor points in range; ?max_points=N reduces them server-side.
+
+    The reduction keeps the min and max of every series per bucket
+    (see downsample.minmax_indices), so peaks and dips stay visible.
+    """
     range_key = request.args.get("range", "24h")
     since = _since_for_range(range_key)
-    conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), "irrigation.db"))
-    c = conn.cursor()
-    c.execute(
-        """
-        SELECT timestamp, soil_moisture, temperature, humidity
-        FROM sensor_data
-        WHERE timestamp >= ?
-        ORDER BY timestamp ASC
-        """,
-        (since,)
-    )
-    rows = c.fetchall()
-    conn.close()
+    try:
+        max_points = int(request.args["max_points"]) if request.args.get("max_points") else None
+    except ValueError:
+        return jsonify({"error": "max_points must be an integer"}), 400
+    if max_points is not None:
+        max_points = max(max_points, MIN_POINTS)
+    rows = archive.sensor_rows_since(since)  # hot rows plus archived days in range
+    if max_points is not None and len(rows) > max_points:
+        import numpy as np
+        from downsample import minmax_indices
+        cols = np.array([r[1:] for r in rows], dtype=float).T  # None -> nan
+        rows = [rows[i] for i in minmax_indices(list(cols), max_points)]
     return jsonify([
         {
             "timestamp": r[0],
@@ -487,20 +903,23 @@ def metrics_sensors():
 
 
 @app.route("/api/metrics/summary", methods=["GET"]) 
+@conditional("sensor_data", "water_usage", every=METRICS_STEP)
 def metrics_summary():
     """Aggregated stats for charts (min/avg/max and counts)."""
-    import sqlite3
     range_key = request.args.get("range", "24h")
     since = _since_for_range(range_key)
-    conn = sqlite3.connect(os.path.join(os.path.dirname(__file__), "irrigation.db"))
-    c = conn.cursor()
-    c.execute("SELECT COUNT(1), SUM(CASE WHEN pump_status IN ('ON',1) THEN 1 ELSE 0 END) FROM sensor_data WHERE timestamp >= ?", (since,))
-    total_rows, pump_on = c.fetchone() or (0, 0)
-    c.execute("SELECT MIN(soil_moisture), AVG(soil_moisture), MAX(soil_moisture) FROM sensor_data WHERE timestamp >= ?", (since,))
-    moist_min, moist_avg, moist_max = c.fetchone() or (None, None, None)
-    c.execute("SELECT SUM(liters_used) FROM water_usage WHERE timestamp >= ?", (since,))
-    total_liters = c.fetchone()[0] or 0
-    conn.close()
+    # Hourly rollups cover whole hours; the partial first hour and any
+    # not-yet-compacted rows are aggregated from raw data by rollups.*_buckets
+    buckets = rollups.sensor_buckets(rollups.HOUR, since)
+    total_rows = sum(r["n"] or 0 for r in buckets)
+    pump_on = sum(r["pump_on"] or 0 for r in buckets)
+    moist_n = sum(r["moisture_n"] or 0 for r in buckets)
+    mins = [r["moisture_min"] for r in buckets if r["moisture_min"] is not None]
+    maxs = [r["moisture_max"] for r in buckets if r["moisture_max"] is not None]
+    moist_min = min(mins) if mins else None
+    moist_max = max(maxs) if maxs else None
+    moist_avg = (sum(r["moisture_sum"] or 0 for r in buckets) / moist_n) if moist_n else None
+    total_liters = sum(r[1] or 0 for r in rollups.water_buckets(rollups.HOUR, since))
     return jsonify({
         "total_rows": total_rows or 0,
         "pump_on": pump_on or 0,
@@ -525,6 +944,22 @@ def serve_static(path):
     return send_from_directory(FRONTEND_FOLDER, path)
 
 
+def start_services():
+    """Per-process startup after init_db(), shared by __main__ and wsgi.py."""
+    writer.start()
+    atexit.register(writer.stop)  # drain queued rows on shutdown
+    ml_model.load_model()  # cached for the process; absent until first trained
+    cluster.start()  # the leader (here: this process) starts the background jobs
+    atexit.register(cluster.stop)  # runs before writer.stop
+
+
 if __name__ == "__main__":
-    init_db()  # initialize DB on startup
+    # debug=True runs the Werkzeug reloader: this file runs again in a child
+    # process that serves requests, while the parent only watches for changes.
+    # Start everything in the child, or the parent becomes a second "leader"
+    # (compactor, retention, serial bridge) next to it.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_db()  # initialize DB on startup
+        tracker.load()  # close irrigation events left open by a previous run
+        start_services()
     app.run(host="0.0.0.0", port=5000, debug=True)
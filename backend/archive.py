@@ -0,0 +1,347 @@
+# backend/archive.py
+# Retention for sensor_data: rows older than `retention_days` move out of the
+# hot table into compressed, day-partitioned NumPy files next to the DB
+# (<db name>_archive/sensor_data/YYYY-MM/YYYY-MM-DD.npz), are deleted from
+# SQLite and their pages are released with incremental vacuum.
+#
+# Only rows already folded into the rollups are archived, so reports and the
+# hourly/daily metrics keep their full history from sensor_rollup.
+# Raw-range readers (sensor_rows_since, sensor_aggregates) consult the
+# partitions when a range reaches back past the hot table.
+#
+# CLI: python backend/archive.py run --days 90 | list | vacuum
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+import database
+from database import get_conn, get_setting
+from live_state import state
+from timeseries import recent
+
+VACUUM_PAGES = 2000        # pages freed per incremental_vacuum step
+FIELDS = ("soil_moisture", "temperature", "humidity")
+
+
+def archive_dir():
+    """Archive root for the current database file."""
+    return os.path.splitext(database.DB_PATH)[0] + "_archive"
+
+
+def _day(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+def _partition_path(day):
+    return os.path.join(archive_dir(), "sensor_data", day[:7], f"{day}.npz")
+
+
+def partitions():
+    """[(day, path)] of every archived day, oldest first."""
+    root = os.path.join(archive_dir(), "sensor_data")
+    if not os.path.isdir(root):
+        return []
+    out = []
+    for month in sorted(os.listdir(root)):
+        for name in sorted(os.listdir(os.path.join(root, month))):
+            if name.endswith(".npz"):
+                out.append((name[:-4], os.path.join(root, month, name)))
+    return out
+
+
+def _load(path):
+    with np.load(path, allow_pickle=False) as z:
+        return {k: z[k] for k in z.files}
+
+
+def _save(path, part):
+    """Write a partition atomically (readers never see a half-written file)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **part)
+    os.replace(tmp, path)
+
+
+def _to_partition(rows):
+    """Columnar arrays from (id, ts, soil, temp, hum, pump, device_id) rows."""
+    ids, ts, soil, temp, hum, pump, device = zip(*rows)
+    names = sorted({d for d in device if d is not None})
+    index = {d: i for i, d in enumerate(names)}
+    return {
+        "id": np.array(ids, dtype=np.int64),
+        "ts": np.array(ts, dtype=np.int64),
+        "soil_moisture": np.array(soil, dtype=float),   # None -> nan
+        "temperature": np.array(temp, dtype=float),
+        "humidity": np.array(hum, dtype=float),
+        "pump": np.array([1 if p in ("ON", 1, "1") else 0 for p in pump], dtype=np.int8),
+        "device": np.array([index.get(d, -1) for d in device], dtype=np.int32),
+        "devices": np.array(names, dtype=str),
+    }
+
+
+def _merge(old, new):
+    """Append `new` to an existing partition, dropping ids it already holds (re-run after a crash)."""
+    names = [str(d) for d in old["devices"]]
+    for d in new["devices"]:
+        if str(d) not in names:
+            names.append(str(d))
+    index = {d: i for i, d in enumerate(names)}
+    remap = np.array([index[str(d)] for d in new["devices"]] + [-1], dtype=np.int32)
+    new = dict(new, device=remap[new["device"]])  # -1 indexes the trailing -1
+    keep = ~np.isin(new["id"], old["id"])
+    merged = {k: np.concatenate([old[k], new[k][keep]]) for k in ("id", "ts", *FIELDS, "pump", "device")}
+    order = np.argsort(merged["id"], kind="stable")
+    merged = {k: v[order] for k, v in merged.items()}
+    merged["devices"] = np.array(names, dtype=str)
+    return merged
+
+
+# --- Retention ---
+def retention_days():
+    try:
+        return float(get_setting("retention_days", "0") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def archive_older_than(days, now=None):
+    """Move compacted sensor rows older than `days` into the archive; returns a summary.
+
+    Works one day at a time: read the day's rows, write (or extend) its
+    partition, then delete exactly those rows. A crash between the write and
+    the delete only leaves rows in both places, which the next run and the
+    readers de-duplicate by id.
+    """
+    started = time.perf_counter()
+    cutoff = int((now or time.time()) - days * 86400)
+    with get_conn() as conn:
+        watermark = conn.execute("SELECT last_id FROM rollup_state WHERE source = 'sensor_data'").fetchone()[0]
+        oldest = conn.execute(
+            "SELECT MIN(ts) FROM sensor_data WHERE ts IS NOT NULL AND ts < ?", (cutoff,)
+        ).fetchone()[0]
+    moved = 0
+    days_written = []
+    day_start = (oldest // 86400) * 86400 if oldest is not None else cutoff
+    while day_start < cutoff:
+        lo, hi = day_start, min(day_start + 86400, cutoff)
+        where = "ts >= ? AND ts < ? AND id <= ?"
+        with get_conn() as conn:
+            rows = conn.execute(
+                f"SELECT id, ts, soil_moisture, temperature, humidity, pump_status, device_id "
+                f"FROM sensor_data WHERE {where} ORDER BY id",
+                (lo, hi, watermark),
+            ).fetchall()
+        if rows:
+            day = _day(lo)
+            path = _partition_path(day)
+            part = _to_partition(rows)
+            if os.path.exists(path):
+                part = _merge(_load(path), part)
+            _save(path, part)
+            # sensor_data rows are never updated, so the same predicate deletes exactly what was saved
+            with get_conn() as conn, conn:
+                conn.execute(f"DELETE FROM sensor_data WHERE {where}", (lo, hi, watermark))
+                database.bump_versions(conn, "sensor_data", "sensor_archive")
+            recent.drop_archived(lo, hi, watermark)
+            state.bump("sensor_data")
+            moved += len(rows)
+            days_written.append(day)
+        day_start += 86400
+    freed = incremental_vacuum() if moved else 0
+    return {
+        "cutoff": cutoff,
+        "rows_archived": moved,
+        "days": days_written,
+        "pages_freed": freed,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+
+
+def incremental_vacuum(max_steps=1000):
+    """Release free pages in small steps so writers are never blocked for long; returns pages freed."""
+    freed = 0
+    with get_conn() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0  # not an incremental-vacuum database (see enable_incremental_vacuum)
+        for _ in range(max_steps):
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            # executescript steps the pragma to completion (execute() frees a single page)
+            conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+            freed += min(free, VACUUM_PAGES)
+    return freed
+
+
+def enable_incremental_vacuum():
+    """Switch an existing DB to auto_vacuum=INCREMENTAL (one full VACUUM; new DBs start that way)."""
+    with get_conn() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    return True
+
+
+def run_retention():
+    """Apply the retention_days setting (0 disables retention)."""
+    days = retention_days()
+    if days <= 0:
+        return None
+    return archive_older_than(days)
+
+
+_job = None
+_job_stop = threading.Event()
+
+
+def start_retention(interval=3600):
+    """Run run_retention() every `interval` seconds on a daemon thread."""
+    global _job
+    if _job is not None and _job.is_alive():
+        return
+
+    def loop():
+        while True:
+            try:
+                run_retention()
+            except Exception as e:
+                print(f"[archive] retention failed: {e}")
+            if _job_stop.wait(interval):
+                break
+
+    _job_stop.clear()
+    _job = threading.Thread(target=loop, name="sensor-retention", daemon=True)
+    _job.start()
+
+
+def stop_retention():
+    _job_stop.set()
+
+
+# --- Readers across hot and archived rows ---
+def _archived_since(since, until=None):
+    """Concatenated partition columns with since <= ts < until (None if nothing archived there)."""
+    first = _day(since) if since is not None else None
+    last = _day(until) if until is not None else None
+    parts = []
+    for day, path in partitions():
+        if (first and day < first) or (last and day > last):
+            continue
+        part = _load(path)
+        mask = np.ones(len(part["ts"]), dtype=bool)
+        if since is not None:
+            mask &= part["ts"] >= since
+        if until is not None:
+            mask &= part["ts"] < until
+        if mask.any():
+            parts.append({k: part[k][mask] for k in ("id", "ts", *FIELDS, "pump")})
+    if not parts:
+        return None
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def sensor_rows_since(since):
+    """(timestamp, soil_moisture, temperature, humidity) rows with ts >= since, hot and archived, by ts.
+
+    Archived timestamps are rebuilt from `ts` in the stored 'YYYY-mm-dd HH:MM:SS' form.
+    """
+    days = partitions()
+    if not days or days[-1][0] < _day(since):  # nothing archived in range
+        rows = recent.rows_since(since)
+        if rows is not None:
+            return rows
+    with get_conn() as conn:
+        hot = conn.execute(
+            """
+            SELECT id, ts, timestamp, soil_moisture, temperature, humidity
+            FROM sensor_data
+            WHERE ts >= ?
+            ORDER BY ts ASC
+            """,
+            (since,),
+        ).fetchall()
+    old = _archived_since(since)
+    if old is None:
+        return [r[2:] for r in hot]
+    if hot:
+        keep = ~np.isin(old["id"], np.fromiter((r[0] for r in hot), dtype=np.int64, count=len(hot)))
+        old = {k: v[keep] for k, v in old.items()}
+    stamps = np.char.replace(np.datetime_as_string(old["ts"].astype("datetime64[s]"), unit="s"), "T", " ")
+    cols = [np.where(np.isnan(old[f]), None, old[f]).tolist() for f in FIELDS]
+    rows = list(zip(stamps.tolist(), *cols)) + [r[2:] for r in hot]
+    ts = np.concatenate([old["ts"], np.fromiter((r[1] for r in hot), dtype=np.int64, count=len(hot))])
+    return [rows[i] for i in np.argsort(ts, kind="stable")]
+
+
+def sensor_aggregates(width, since, until):
+    """Per-bucket aggregates (rollups.SENSOR_FIELDS dicts) of archived rows with since <= ts < until."""
+    old = _archived_since(since, until)
+    if old is None:
+        return []
+    with get_conn() as conn:
+        hot = conn.execute("SELECT id FROM sensor_data WHERE ts >= ? AND ts < ?", (since, until)).fetchall()
+    if hot:
+        keep = ~np.isin(old["id"], np.array([r[0] for r in hot], dtype=np.int64))
+        old = {k: v[keep] for k, v in old.items()}
+    buckets = (old["ts"] // width) * width
+    out = []
+    for bucket in np.unique(buckets):
+        sel = buckets == bucket
+        row = {"bucket": int(bucket), "n": int(sel.sum()), "pump_on": int(old["pump"][sel].sum())}
+        for name, field in (("moisture", "soil_moisture"), ("temperature", "temperature"), ("humidity", "humidity")):
+            v = old[field][sel]
+            v = v[~np.isnan(v)]
+            row[f"{name}_n"] = int(len(v))
+            row[f"{name}_sum"] = float(v.sum()) if len(v) else None
+            row[f"{name}_min"] = float(v.min()) if len(v) else None
+            row[f"{name}_max"] = float(v.max()) if len(v) else None
+        out.append(row)
+    return out
+
+
+def summary():
+    parts = partitions()
+    size = sum(os.path.getsize(p) for _, p in parts)
+    return {
+        "dir": archive_dir(),
+        "partitions": len(parts),
+        "first_day": parts[0][0] if parts else None,
+        "last_day": parts[-1][0] if parts else None,
+        "bytes": size,
+        "retention_days": retention_days(),
+    }
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Archive old sensor_data rows and reclaim space.")
+    parser.add_argument("command", choices=["run", "list", "vacuum"])
+    parser.add_argument("--days", type=float, default=None,
+                        help="archive rows older than this (default: the retention_days setting)")
+    parser.add_argument("--db", default=None, help="SQLite file to use instead of backend/irrigation.db")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        database.DB_PATH = os.path.abspath(args.db)
+    database.init_db()
+    if args.command == "vacuum":
+        result = {"converted": enable_incremental_vacuum(), "pages_freed": incremental_vacuum()}
+    elif args.command == "list":
+        result = summary()
+    else:
+        days = retention_days() if args.days is None else args.days
+        if days <= 0:
+            raise SystemExit("No retention configured; pass --days or set retention_days")
+        result = archive_older_than(days)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
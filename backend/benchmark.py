@@ -0,0 +1,332 @@
+# backend/benchmark.py
+# Load/throughput benchmark for the API and ingestion paths.
+#
+# For each scale it seeds a fresh SQLite file with synthetic history, starts
+# the app in a child process (same startup as app.py: migrations, write-behind
+# queue, rollup compactor) and drives each scenario with concurrent HTTP
+# clients. Latency percentiles and throughput go to a JSON report so runs
+# can be diffed for regressions:
+#
+#   python backend/benchmark.py --scales 10000,1000000 --concurrency 8 --duration 10
+#   python backend/benchmark.py --url http://127.0.0.1:5000 --scenarios status,reports
+import datetime
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SEED_CHUNK = 200_000
+SEED_DEVICES = 4
+SEED_DAYS = 90
+BATCH_READINGS = 100  # readings per /api/hardware/batch request
+
+
+def _reading(i):
+    return {"device_id": f"bench-{i % 16}", "soil_moisture": 300 + (i * 37) % 400,
+            "temperature": 25.0, "humidity": 60.0}
+
+
+# name -> (method, path, body factory or None, items per request)
+SCENARIOS = {
+    "ingest": ("POST", "/api/hardware/read", _reading, 1),
+    "ingest_batch": ("POST", "/api/hardware/batch",
+                     lambda i: [_reading(i * BATCH_READINGS + k) for k in range(BATCH_READINGS)], BATCH_READINGS),
+    "status": ("GET", "/api/status", None, 1),
+    "sensors_latest": ("GET", "/api/sensors/latest", None, 1),
+    "data_recent": ("GET", "/api/data/recent?limit=50", None, 1),
+    "reports": ("GET", "/api/reports?range=daily", None, 1),
+    "metrics_water": ("GET", "/api/metrics/water?range=7d", None, 1),
+    "metrics_sensors": ("GET", "/api/metrics/sensors?range=90d&max_points=1000", None, 1),
+    "metrics_summary": ("GET", "/api/metrics/summary?range=30d", None, 1),
+}
+
+
+# --- Seeding ---
+def seed(rows, devices=SEED_DEVICES, days=SEED_DAYS, rng_seed=0):
+    """Bulk-load `rows` synthetic sensor readings (and their irrigation events)
+    into database.DB_PATH, spread over the last `days` days; returns seconds taken.
+    """
+    import database
+    import rollups
+    from water_tracker import event_params
+
+    database.init_db()
+    rng = np.random.default_rng(rng_seed)
+    end = int(time.time())
+    step = max(days * 86400 * devices // max(rows, 1), 1)  # seconds between readings of one device
+    started = time.perf_counter()
+    for lo in range(0, rows, SEED_CHUNK):
+        n = min(SEED_CHUNK, rows - lo)
+        idx = np.arange(lo, lo + n)
+        epoch = end - (rows - idx) // devices * step
+        stamps = np.char.replace(np.datetime_as_string(epoch.astype("datetime64[s]"), unit="s"), "T", " ")
+        # sawtooth moisture: slow drying, pump ON below 400
+        moisture = 700 - (idx // devices % 400) + rng.normal(0, 5, n)
+        on = moisture < 400
+        sensor = list(zip(
+            stamps.tolist(), moisture.round(1).tolist(),
+            (24 + 6 * np.sin(epoch / 86400 * 2 * np.pi) + rng.normal(0, 1, n)).round(2).tolist(),
+            (60 + rng.normal(0, 8, n)).round(2).tolist(),
+            np.where(on, "ON", "OFF").tolist(),
+            [f"zone-{d}" for d in (idx % devices).tolist()],
+        ))
+        # one irrigation event per drying cycle and device, roughly where the pump turns on
+        starts = np.flatnonzero((idx // devices % 400) == 300)
+        water = [
+            event_params({"timestamp": stamps[i], "liters_used": 200.0, "ended_at": stamps[min(i + 400, n - 1)],
+                          "duration_s": 6000.0, "device_id": f"zone-{idx[i] % devices}"})
+            for i in starts.tolist()
+        ]
+        database.execute_batches([(database.SENSOR_INSERT_SQL, sensor), (database.WATER_EVENT_INSERT_SQL, water)])
+    while rollups.compact_rollups():
+        pass
+    return time.perf_counter() - started
+
+
+# --- Server under test ---
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(db, port):
+    """Run the app as app.py does, on a threaded WSGI server (child process entry point)."""
+    import logging
+    from werkzeug.serving import make_server
+
+    import database
+    database.DB_PATH = db
+    import app as app_module
+    import rollups
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    database.init_db()
+    app_module.tracker.load()
+    app_module.writer.start()
+    rollups.start_compactor()
+    make_server("127.0.0.1", port, app_module.app, threaded=True).serve_forever()
+
+
+def start_server(db, timeout=30):
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--db", db, "--port", str(port)],
+        cwd=BACKEND_DIR,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            if _request(url, "GET", "/api/health")[0] == 200:
+                return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("server did not start")
+
+
+# --- Load generation ---
+def _request(base_url, method, path, body=None):
+    u = urllib.parse.urlsplit(base_url)
+    conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=60)
+    try:
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        conn.request(method, path, body=data, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, resp
+    finally:
+        conn.close()
+
+
+def run_scenario(base_url, name, concurrency=8, duration=10.0, warmup=1.0):
+    """Drive one scenario with `concurrency` clients for `duration` seconds; returns its stats."""
+    method, path, make_body, items = SCENARIOS[name]
+    counter = iter(range(1 << 62))
+    counter_lock = threading.Lock()
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    measure_from = time.monotonic() + warmup
+    stop_at = measure_from + duration
+
+    def client(slot):
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            with counter_lock:
+                i = next(counter)
+            body = make_body(i) if make_body else None
+            t0 = time.perf_counter()
+            try:
+                status = _request(base_url, method, path, body)[0]
+            except OSError:
+                status = 599
+            elapsed = time.perf_counter() - t0
+            if now < measure_from:
+                continue
+            latencies[slot].append(elapsed)
+            if status >= 400:
+                errors[slot] += 1
+
+    threads = [threading.Thread(target=client, args=(k,), daemon=True) for k in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    lat = np.concatenate([np.asarray(x) for x in latencies]) * 1e3 if any(latencies) else np.array([])
+    requests = len(lat)
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]).tolist() if requests else (None, None, None)
+    return {
+        "name": name,
+        "method": method,
+        "path": path,
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "requests": requests,
+        "errors": sum(errors),
+        "throughput_rps": round(requests / duration, 1),
+        "items_per_s": round(requests * items / duration, 1),
+        "latency_ms": {
+            "p50": _round(p50), "p95": _round(p95), "p99": _round(p99),
+            "mean": _round(float(lat.mean())) if requests else None,
+            "max": _round(float(lat.max())) if requests else None,
+        },
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark API latency and throughput at several DB sizes.")
+    sub = parser.add_subparsers(dest="command")
+    srv = sub.add_parser("serve", help=argparse.SUPPRESS)
+    srv.add_argument("--db", required=True)
+    srv.add_argument("--port", type=int, required=True)
+    parser.add_argument("--scales", default="10000,100000,1000000",
+                        help="comma-separated sensor_data row counts to seed (10k to 10M)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--url", default=None,
+                        help="benchmark an already running server instead (no seeding; --scales ignored)")
+    parser.add_argument("--workdir", default=None, help="where seeded DB files go (default: a temp dir)")
+    parser.add_argument("--keep-db", action="store_true", help="keep the seeded DB files")
+    parser.add_argument("--out", default="bench-report.json", help="JSON report path ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.db, args.port)
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    def run_all(url):
+        results = []
+        for name in scenarios:
+            result = run_scenario(url, name, args.concurrency, args.duration, args.warmup)
+            lat = result["latency_ms"]
+            _log(f"  {name:16s} {result['throughput_rps']:>9.1f} req/s  p50 {lat['p50']} ms  "
+                 f"p95 {lat['p95']} ms  p99 {lat['p99']} ms  errors {result['errors']}")
+            results.append(result)
+        return results
+
+    runs = []
+    if args.url:
+        _log(f"target {args.url}")
+        runs.append({"rows": None, "url": args.url, "scenarios": run_all(args.url)})
+    else:
+        import database
+
+        workdir = args.workdir or tempfile.mkdtemp(prefix="irrigation-bench-")
+        for rows in [int(float(s)) for s in args.scales.split(",") if s.strip()]:
+            db = os.path.join(workdir, f"bench-{rows}.db")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db + suffix):
+                    os.remove(db + suffix)
+            database.DB_PATH = db
+            _log(f"seeding {rows:,} rows -> {db}")
+            seed_s = seed(rows)
+            database.close_all()
+            proc, url = start_server(db)
+            try:
+                scenario_results = run_all(url)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+            runs.append({
+                "rows": rows,
+                "seed_s": round(seed_s, 2),
+                "db_bytes": os.path.getsize(db),
+                "scenarios": scenario_results,
+            })
+            if not args.keep_db:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(db + suffix):
+                        os.remove(db + suffix)
+
+    report = {
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "scenarios": scenarios,
+        },
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        _log(f"report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
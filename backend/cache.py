@@ -0,0 +1,112 @@
+# backend/cache.py
+# Conditional GETs and result caching for read endpoints, driven by the
+# per-table change counters in live_state (the table_versions rows every
+# writing process bumps, so external ingest invalidates them too).
+#
+#   @app.route("/api/metrics/water")
+#   @conditional("water_usage", every=60)
+#   def metrics_water(): ...
+#
+# The ETag is derived from (path, query, data version); a poll whose
+# If-None-Match still matches gets an empty 304 without running the view.
+# Otherwise the response body is looked up in a small LRU keyed the same way,
+# so a page polled by several clients is computed once per data change.
+# `every` adds a time slot to the key for views whose window moves with the
+# clock (they must align their window to the same slot, see app._since_for_range).
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, make_response, request
+
+from live_state import state
+
+MAX_ENTRIES = 128
+MAX_ENTRY_BYTES = 1 << 20  # bigger bodies are served but not kept
+
+
+class ResultCache:
+    """Thread-safe LRU of rendered response bodies."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+results = ResultCache()
+
+
+def _finish(resp, etag):
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"  # always revalidate; unchanged data costs a 304
+    return resp
+
+
+def conditional(*tables, every=None):
+    """ETag/304 plus result caching for a GET view reading `tables`."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != "GET":
+                return view(*args, **kwargs)
+            # read the version before the view runs: a write racing with it
+            # can only leave a newer result under an already outdated key
+            key = (
+                request.path,
+                tuple(sorted(request.args.items(multi=True))),
+                state.version(*tables),
+                int(time.time()) // every if every else None,
+            )
+            etag = hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                return _finish(Response(status=304), etag)
+
+            hit = results.get(key)
+            if hit is not None:
+                body, mimetype, headers = hit
+                return _finish(Response(body, mimetype=mimetype, headers=headers), etag)
+
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code != 200 or resp.get_etag()[0]:
+                return resp  # errors, 202 jobs and files carry their own semantics
+            if not resp.is_streamed:
+                body = resp.get_data()
+                if len(body) <= MAX_ENTRY_BYTES:
+                    headers = {k: v for k, v in resp.headers.items() if k == "Content-Disposition"}
+                    results.put(key, (body, resp.mimetype, headers))
+            return _finish(resp, etag)
+
+        return wrapper
+
+    return decorator
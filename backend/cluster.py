@@ -0,0 +1,370 @@
+# backend/cluster.py
+# Running the backend as several worker processes (gunicorn; see wsgi.py).
+#
+# Off by default: `python app.py` is one process and keeps mode, pump status
+# and simulation progress in memory, exactly as before. IRRIGATION_CLUSTER=1
+# (set by wsgi.py) makes every worker:
+#
+# - keep that state in the shared_state table (SharedState), so any worker
+#   answers the same;
+# - follow the change counters and totals other workers write (live_state,
+#   timeseries), so ETags, caches and the in-memory buffers stay correct;
+# - relay its SSE events through the event_log table, so a client connected
+#   to one worker sees the events raised in all of them;
+# - take part in leader election: the worker holding the "leader" lease runs
+#   the simulation scheduler and the background jobs (compactor, retention,
+#   serial bridge). The others hand simulation commands to it through the
+#   commands table (call()). A leader that stops renewing its lease is
+#   replaced within LEASE_TTL seconds; simulations it was running stop, and
+#   commands it had taken but not answered fail with 503.
+#
+# Everything goes through the one SQLite file, so this scales across the
+# cores of one machine, not across machines. Values other workers changed
+# show up within about POLL_INTERVAL (events) or at the next request (state).
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import database
+import events
+from live_state import state
+from timeseries import recent
+from water_tracker import tracker
+
+enabled = os.environ.get("IRRIGATION_CLUSTER", "").lower() in ("1", "true", "yes", "on")
+
+LEASE_TTL = 10.0        # seconds a leader lease lasts without renewal
+POLL_INTERVAL = 0.1     # worker loop: event relay, commands, leader ticks
+COMMAND_TIMEOUT = 10.0  # seconds call() waits for a leader to take a command
+COMMAND_MAX_WAIT = 60.0 # seconds call() waits for an answer in all
+KEEP_SECONDS = 60       # relayed events and finished commands kept this long
+OUTBOX_MAX = 10_000     # events waiting to be relayed before the oldest are dropped
+
+_node = (None, None)
+
+
+def node_id():
+    """This process's id in leases/commands/event_log (new after a fork)."""
+    global _node
+    pid = os.getpid()
+    if _node[0] != pid:
+        _node = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:6]}")
+    return _node[1]
+
+
+def _now():
+    return time.time()
+
+
+# --- Shared key/value state ---
+_SHARED_GET_SQL = "SELECT value FROM shared_state WHERE key = ?"
+
+
+class SharedState:
+    """JSON values by key: in memory, or in shared_state while clustered."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = {}
+
+    def get(self, key, default=None):
+        if not enabled:
+            return self._local.get(key, default)
+        with database.get_conn() as conn:
+            row = conn.execute(_SHARED_GET_SQL, (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        """Store `value`; returns the previous one (None if unset)."""
+        if not enabled:
+            with self._lock:
+                previous = self._local.get(key)
+                self._local[key] = value
+            return previous
+        with database.get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # read-then-write without another worker in between
+            try:
+                row = conn.execute(_SHARED_GET_SQL, (key,)).fetchone()
+                conn.execute(database.SHARED_STATE_SQL, (key, json.dumps(value, default=str), _now()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return json.loads(row[0]) if row else None
+
+
+shared = SharedState()
+
+
+# --- Leader election ---
+_LEASE_SQL = """
+    INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+    WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+"""
+
+
+class Leader:
+    """Holder of a named lease; runs the on_elected/on_demoted/every_tick callbacks."""
+
+    def __init__(self, name="leader"):
+        self.name = name
+        self.is_leader = False
+        self.expires_at = 0.0
+        self._elected, self._demoted, self._ticks = [], [], []
+        self._lock = threading.Lock()
+
+    # decorators
+    def on_elected(self, fn):
+        self._elected.append(fn)
+        return fn
+
+    def on_demoted(self, fn):
+        self._demoted.append(fn)
+        return fn
+
+    def every_tick(self, fn):
+        """Called every POLL_INTERVAL while this worker leads a cluster."""
+        self._ticks.append(fn)
+        return fn
+
+    def renew(self):
+        """Take or extend the lease; promotes/demotes this process accordingly."""
+        now = _now()
+        try:
+            with database.get_conn() as conn, conn:
+                won = conn.execute(_LEASE_SQL, (self.name, node_id(), now + LEASE_TTL, now)).rowcount == 1
+        except Exception as e:
+            print(f"[cluster] lease renewal failed: {e}")
+            if self.is_leader and _now() >= self.expires_at:
+                self._demote()  # someone else may hold it by now
+            return self.is_leader
+        if won:
+            self.expires_at = now + LEASE_TTL
+            if not self.is_leader:
+                self._promote()
+        elif self.is_leader:
+            self._demote()
+        return self.is_leader
+
+    def release(self):
+        if self.is_leader:
+            self._demote()
+        if enabled:
+            with database.get_conn() as conn, conn:
+                conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self.name, node_id()))
+
+    def tick(self):
+        for fn in self._ticks:
+            _safely(fn)
+
+    def _promote(self):
+        with self._lock:
+            if self.is_leader:
+                return
+            self.is_leader = True
+        if enabled:
+            print(f"[cluster] {node_id()} is the leader")
+        for fn in self._elected:
+            _safely(fn)
+
+    def _demote(self):
+        with self._lock:
+            if not self.is_leader:
+                return
+            self.is_leader = False
+        if enabled:
+            print(f"[cluster] {node_id()} is no longer the leader")
+        for fn in self._demoted:
+            _safely(fn)
+
+
+def _safely(fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        print(f"[cluster] {getattr(fn, '__name__', fn)} failed: {e}")
+
+
+leader = Leader()
+
+
+def is_leader():
+    """True where leader-only work runs: the leader worker, or the only process."""
+    return not enabled or leader.is_leader
+
+
+# --- Commands for the leader ---
+_handlers = {}
+
+
+def command(op):
+    """Register a leader-side handler: fn(**args) -> (JSON-able dict, HTTP status)."""
+    def register(fn):
+        _handlers[op] = fn
+        return fn
+    return register
+
+
+def call(op, **args):
+    """Run command `op` where the scheduler lives; returns (dict, status)."""
+    if is_leader():
+        result = _handlers[op](**args)
+        if enabled:
+            leader.tick()  # publish what changed before answering
+        return result
+    with database.get_conn() as conn, conn:
+        command_id = conn.execute(
+            "INSERT INTO commands (op, args, created_at) VALUES (?, ?, ?)",
+            (op, json.dumps(args, default=str), _now()),
+        ).lastrowid
+    started = time.monotonic()
+    delay = 0.005
+    while True:
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_INTERVAL)
+        with database.get_conn() as conn:
+            status, result, claimed_by = conn.execute(
+                "SELECT status, result, claimed_by FROM commands WHERE id = ?", (command_id,)).fetchone()
+            # a claimer that lost the lease (died, or was replaced) will never answer
+            leading = claimed_by is not None and conn.execute(
+                "SELECT 1 FROM leases WHERE name = ? AND owner = ? AND expires_at >= ?",
+                (leader.name, claimed_by, _now()),
+            ).fetchone() is not None
+        if status is not None:
+            return json.loads(result), status
+        waited = time.monotonic() - started
+        if (claimed_by is None and waited < COMMAND_TIMEOUT) or (leading and waited < COMMAND_MAX_WAIT):
+            continue
+        with database.get_conn() as conn, conn:
+            given_up = conn.execute(
+                "UPDATE commands SET status = 503, done_at = ? WHERE id = ? AND status IS NULL",
+                (_now(), command_id),
+            ).rowcount
+        if given_up:
+            return {"error": "no leader process answered"}, 503
+        # answered just now
+
+
+def _serve_commands():
+    with database.get_conn() as conn, conn:
+        claimed = conn.execute(
+            "UPDATE commands SET claimed_by = ? WHERE claimed_by IS NULL AND status IS NULL RETURNING id, op, args",
+            (node_id(),),
+        ).fetchall()
+    if not claimed:
+        return
+    done = []
+    for command_id, op, args in sorted(claimed):
+        try:
+            result, status = _handlers[op](**json.loads(args))
+        except Exception as e:
+            result, status = {"error": str(e)}, 500
+        done.append((status, json.dumps(result, default=str), _now(), command_id))
+    leader.tick()  # publish what changed before answering
+    with database.get_conn() as conn, conn:
+        conn.executemany(  # unless the caller gave up on it meanwhile
+            "UPDATE commands SET status = ?, result = ?, done_at = ? WHERE id = ? AND status IS NULL", done)
+
+
+# --- SSE event relay ---
+_outbox = collections.deque(maxlen=OUTBOX_MAX)
+_last_event_id = 0
+
+
+def _forward(event, data):
+    _outbox.append((node_id(), event, json.dumps(data, default=str), _now()))
+
+
+def _relay_events():
+    """Write this worker's new events to event_log; publish the other workers' locally."""
+    global _last_event_id
+    pending = []
+    while _outbox:
+        pending.append(_outbox.popleft())
+    with database.get_conn() as conn:
+        if pending:
+            with conn:
+                conn.executemany("INSERT INTO event_log (origin, event, data, created_at) VALUES (?, ?, ?, ?)",
+                                 pending)
+        rows = conn.execute(
+            "SELECT id, event, data FROM event_log WHERE id > ? AND origin != ? ORDER BY id LIMIT 1000",
+            (_last_event_id, node_id()),
+        ).fetchall()
+    for event_id, event, data in rows:
+        events.hub.publish(event, json.loads(data))
+        _last_event_id = event_id
+
+
+def _prune():
+    cutoff = _now() - KEEP_SECONDS
+    with database.get_conn() as conn, conn:
+        conn.execute("DELETE FROM event_log WHERE created_at < ?", (cutoff,))
+        conn.execute("DELETE FROM commands WHERE created_at < ?", (cutoff - COMMAND_MAX_WAIT,))
+
+
+# --- Worker loop ---
+_stop = threading.Event()
+_thread = None
+
+
+def enable():
+    """Switch this process to shared state (reads the env flag at import; wsgi.py sets it)."""
+    global enabled, _last_event_id
+    enabled = True
+    state.share(database.get_conn)
+    recent.share(database.get_conn)
+    tracker.shared = True
+    with database.get_conn() as conn:
+        _last_event_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM event_log").fetchone()[0]
+    events.forward = _forward
+
+
+def _run():
+    renew_every = LEASE_TTL / 3
+    renewed = time.monotonic()
+    pruned = 0.0
+    while not _stop.wait(POLL_INTERVAL):
+        if time.monotonic() - renewed >= renew_every:
+            leader.renew()
+            renewed = time.monotonic()
+        _safely(_relay_events)
+        if leader.is_leader:
+            _safely(_serve_commands)
+            leader.tick()
+            if time.monotonic() - pruned >= KEEP_SECONDS:
+                _safely(_prune)
+                pruned = time.monotonic()
+
+
+def start():
+    """Join the cluster (or, when not clustered, just become the leader).
+
+    Call it once, in the process that serves requests (not a reloader parent).
+    """
+    global _thread
+    if not enabled:
+        leader._promote()
+        return
+    if _thread is not None:
+        return
+    enable()
+    leader.renew()  # before serving, so a lone worker is the leader from its first request
+    _stop.clear()
+    _thread = threading.Thread(target=_run, name="cluster", daemon=True)
+    _thread.start()
+
+
+def stop(timeout=5):
+    """Leave the cluster: hand the lease back, flush events not yet relayed."""
+    global _thread
+    _stop.set()
+    if _thread is not None:
+        _thread.join(timeout)
+        _thread = None
+        _safely(_relay_events)
+    _safely(leader.release)
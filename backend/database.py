@@ -1,11 +1,94 @@
 import sqlite3
 import os
+import queue
+import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from live_state import state, MISSING
+from timeseries import recent
+import instrumentation
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "irrigation.db")
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# --- Connection pool ---
+# Connections are opened once and reused across requests/threads instead of
+# paying a connect + pragma setup per helper call.
+POOL_SIZE = 8
+_pools = {}
+_pools_lock = threading.Lock()
+
+PRAGMAS = (
+    # Only takes effect on a new file (must precede journal_mode); existing DBs
+    # switch with `python backend/archive.py vacuum`
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def _open_conn(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False, cached_statements=256)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _pool_for(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = queue.LifoQueue(maxsize=POOL_SIZE)
+        return pool
+
+
+@contextmanager
+def get_conn():
+    """Borrow a pooled connection to DB_PATH; it is returned to the pool on exit."""
+    path = DB_PATH
+    pool = _pool_for(path)
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open_conn(path)
+    try:
+        yield instrumentation.TimedConnection(conn) if instrumentation.enabled else conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def close_all():
+    """Close every pooled connection (used on shutdown and in tooling)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _add_column_if_missing(c, table, column, decl):
+    cols = {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# --- Schema migrations ---
+# Each migration runs once, in order, inside its own transaction; the applied
+# version is tracked in PRAGMA user_version so existing databases upgrade in place.
+
+def _migration_1_base_tables(c):
     # Sensor data table
     c.execute("""
         CREATE TABLE IF NOT EXISTS sensor_data (
@@ -14,9 +97,11 @@ def init_db():
             soil_moisture REAL,
             temperature REAL,
             humidity REAL,
-            pump_status TEXT
+            pump_status TEXT,
+            device_id TEXT
         )
     """)
+    _add_column_if_missing(c, "sensor_data", "device_id", "TEXT")
     # Water usage table
     c.execute("""
         CREATE TABLE IF NOT EXISTS water_usage (
@@ -41,89 +126,488 @@ def init_db():
             value TEXT
         )
     """)
-    conn.commit()
-    conn.close()
 
-def insert_data(row):
-    """Insert one row of simulation data into sensor_data table"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+
+def _migration_2_epoch_and_indexes(c):
+    # Integer epoch seconds (UTC) alongside the TEXT timestamp, for range scans and bucketing
+    for table in ("sensor_data", "water_usage"):
+        _add_column_if_missing(c, table, "ts", "INTEGER")
+        c.execute(f"UPDATE {table} SET ts = CAST(strftime('%s', timestamp) AS INTEGER) WHERE ts IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_ts ON sensor_data (ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_device_ts ON sensor_data (device_id, ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_water_usage_ts ON water_usage (ts)")
+
+
+def _migration_3_rollups(c):
+    # Per-bucket aggregates (width = 3600 hourly or 86400 daily, bucket = start epoch),
+    # maintained incrementally by rollups.compact_rollups()
+    stats = ",\n".join(
+        f"{col}_n INTEGER, {col}_sum REAL, {col}_min REAL, {col}_max REAL"
+        for col in ("moisture", "temperature", "humidity")
+    )
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS sensor_rollup (
+            width INTEGER,
+            bucket INTEGER,
+            n INTEGER,
+            pump_on INTEGER,
+            {stats},
+            PRIMARY KEY (width, bucket)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS water_rollup (
+            width INTEGER,
+            bucket INTEGER,
+            n INTEGER,
+            liters REAL,
+            PRIMARY KEY (width, bucket)
+        ) WITHOUT ROWID
+    """)
+    # Highest raw row id already folded into the rollups, per source table
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        )
+    """)
+    c.execute("INSERT OR IGNORE INTO rollup_state (source, last_id) VALUES ('sensor_data', 0), ('water_usage', 0)")
+
+
+def _migration_4_irrigation_events(c):
+    # water_usage rows become one record per irrigation event (timestamp = start);
+    # older per-tick rows simply have no end/duration
+    _add_column_if_missing(c, "water_usage", "ended_at", "TEXT")
+    _add_column_if_missing(c, "water_usage", "duration_s", "REAL")
+    _add_column_if_missing(c, "water_usage", "device_id", "TEXT")
+    # Events whose pump is still ON, so they survive a restart (see water_tracker)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS irrigation_open (
+            key TEXT PRIMARY KEY,
+            device_id TEXT,
+            started_at TEXT,
+            started_ts INTEGER
+        )
+    """)
+
+
+def _migration_5_shared_state(c):
+    # State shared by worker processes when clustered (see cluster.py)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS shared_state (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at REAL
+        )
+    """)
+    # Random per-database prefix for the shared change counters (ETags)
+    c.execute("""
+        INSERT OR IGNORE INTO shared_state (key, value, updated_at)
+        VALUES ('epoch', '"' || lower(hex(randomblob(4))) || '"', CAST(strftime('%s', 'now') AS REAL))
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            n INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT,
+            args TEXT,
+            created_at REAL,
+            claimed_by TEXT,
+            status INTEGER,
+            result TEXT,
+            done_at REAL
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS event_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT,
+            event TEXT,
+            data TEXT,
+            created_at REAL
+        )
+    """)
+    # Newest reading per hardware device
     c.execute("""
-        INSERT INTO sensor_data (timestamp, soil_moisture, temperature, humidity, pump_status)
-        VALUES (?, ?, ?, ?, ?)
-    """, (
+        CREATE TABLE IF NOT EXISTS device_latest (
+            device_id TEXT PRIMARY KEY,
+            timestamp TEXT,
+            soil_moisture REAL,
+            temperature REAL,
+            humidity REAL,
+            pump_status TEXT
+        )
+    """)
+
+
+MIGRATIONS = [
+    _migration_1_base_tables,
+    _migration_2_epoch_and_indexes,
+    _migration_3_rollups,
+    _migration_4_irrigation_events,
+    _migration_5_shared_state,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db():
+    """Create the schema or upgrade an existing database to the latest version."""
+    with get_conn() as conn:
+        current = schema_version(conn)
+        for version, migrate in enumerate(MIGRATIONS, start=1):
+            if version <= current:
+                continue
+            conn.execute("BEGIN")
+            try:
+                migrate(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        state.rebuild(conn)
+        recent.rebuild(conn)
+    # the gateway, the serial bridge and other CLI tools write from their own
+    # processes: versions/totals come from table_versions, and readers check
+    # sensor_data before trusting the buffer (both at most every
+    # live_state.REFRESH_INTERVAL, unless this process wrote)
+    state.share(get_conn)
+    recent.share(get_conn)
+
+# --- Insert statements (shared by the direct helpers and the write-behind queue) ---
+# `ts` is derived from the timestamp text in SQL so every writer agrees with the backfill.
+SENSOR_INSERT_SQL = """
+    INSERT INTO sensor_data (timestamp, soil_moisture, temperature, humidity, pump_status, device_id, ts)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, CAST(strftime('%s', ?1) AS INTEGER))
+"""
+WATER_INSERT_SQL = """
+    INSERT INTO water_usage (timestamp, liters_used, ts)
+    VALUES (?1, ?2, CAST(strftime('%s', ?1) AS INTEGER))
+"""
+WATER_EVENT_INSERT_SQL = """
+    INSERT INTO water_usage (timestamp, liters_used, ended_at, duration_s, device_id, ts)
+    VALUES (?1, ?2, ?3, ?4, ?5, CAST(strftime('%s', ?1) AS INTEGER))
+"""
+IRRIGATION_OPEN_SQL = """
+    INSERT OR REPLACE INTO irrigation_open (key, device_id, started_at, started_ts)
+    VALUES (?, ?, ?, ?)
+"""
+IRRIGATION_CLOSE_SQL = "DELETE FROM irrigation_open WHERE key = ?"
+NOTIFICATION_INSERT_SQL = "INSERT INTO notifications (timestamp, message, type) VALUES (?, ?, ?)"
+SHARED_STATE_SQL = """
+    INSERT INTO shared_state (key, value, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+"""
+DEVICE_LATEST_SQL = """
+    INSERT INTO device_latest (device_id, timestamp, soil_moisture, temperature, humidity, pump_status)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(device_id) DO UPDATE SET
+        timestamp = excluded.timestamp, soil_moisture = excluded.soil_moisture,
+        temperature = excluded.temperature, humidity = excluded.humidity, pump_status = excluded.pump_status
+    WHERE excluded.timestamp >= device_latest.timestamp
+"""
+TABLE_VERSION_SQL = "INSERT INTO table_versions (name, n) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET n = n + 1"
+
+
+def bump_versions(conn, *tables):
+    """Count a write to `tables` in table_versions, inside the writer's transaction.
+
+    These are the counters every process (and CLI tool) agrees on. live_state
+    reads them (throttled, see live_state.refresh) for ETags, cache keys and
+    totals, and timeseries to notice rows other processes added.
+    """
+    conn.executemany(TABLE_VERSION_SQL, [(t,) for t in tables])
+
+
+def sensor_params(row):
+    """Map a reading dict onto SENSOR_INSERT_SQL parameters"""
+    return (
         row.get("timestamp") or "",
         row.get("soil_moisture"),
         row.get("temperature"),
         row.get("humidity"),
-        row.get("pump_status") or "OFF"
-    ))
-    conn.commit()
-    conn.close()
+        row.get("pump_status") or "OFF",
+        row.get("device_id")
+    )
+
+
+def _utc_now():
+    import datetime
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+@lru_cache(maxsize=128)
+def written_table(sql):
+    """Table an INSERT/UPDATE/DELETE statement writes to"""
+    m = re.search(r"\b(?:INTO|UPDATE|DELETE\s+FROM)\s+(\w+)", sql, re.IGNORECASE)
+    return m.group(1) if m else None
+
+
+def execute_batches(batches):
+    """Run several (sql, [params, ...]) groups with executemany in one transaction"""
+    batches = [(sql, rows) for sql, rows in batches if rows]
+    if not batches:
+        return
+    recorded = []
+    try:
+        with get_conn() as conn, conn:
+            for sql, rows in batches:
+                conn.executemany(sql, rows)
+                if sql is SENSOR_INSERT_SQL:
+                    # still inside the write transaction, so rows reach the buffer in id order
+                    recorded.append(recent.record(conn, rows))
+            bump_versions(conn, *{written_table(sql) for sql, _ in batches})
+    except Exception:
+        for ids in filter(None, recorded):
+            recent.discard(*ids)
+        raise
+    # Committed: keep the live counters in step
+    state.bump(*{written_table(sql) for sql, _ in batches})
+    if instrumentation.enabled:
+        for sql, rows in batches:
+            instrumentation.rows_written.inc((written_table(sql),), len(rows))
+    for sql, rows in batches:
+        if sql is SENSOR_INSERT_SQL:
+            state.record_sensor_rows([r[4] for r in rows])
+        elif sql is WATER_INSERT_SQL or sql is WATER_EVENT_INSERT_SQL:
+            state.record_water([r[1] for r in rows])
+
+
+def insert_data(row):
+    """Insert one row of simulation data into sensor_data table"""
+    params = sensor_params(row)
+    ids = None
+    try:
+        with get_conn() as conn, conn:
+            conn.execute(SENSOR_INSERT_SQL, params)
+            ids = recent.record(conn, [params])
+            bump_versions(conn, "sensor_data")
+    except Exception:
+        if ids:
+            recent.discard(*ids)
+        raise
+    state.bump("sensor_data")
+    state.record_sensor_rows([params[4]])
 
 def fetch_all():
     """Fetch all rows from sensor_data"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM sensor_data ORDER BY id DESC")
-    rows = c.fetchall()
-    conn.close()
+    with get_conn() as conn:
+        return conn.execute("SELECT * FROM sensor_data ORDER BY id DESC").fetchall()
+
+# --- Keyset pagination / streaming reads ---
+SENSOR_COLUMNS = ("id", "timestamp", "soil_moisture", "temperature", "humidity", "pump_status")
+WATER_COLUMNS = ("id", "timestamp", "liters_used", "ended_at", "duration_s", "device_id")
+
+
+def _iter_keyset(table, columns, limit=None, before_id=None, after_id=None, chunk=1000):
+    """Yield rows of `table` by id: newest first, or oldest first when after_id is given.
+
+    Rows are pulled from a server-side cursor `chunk` at a time, so memory use
+    does not depend on table size. The pooled connection is held until the
+    generator is exhausted or closed.
+    """
+    where, params = [], []
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(int(before_id))
+    if after_id is not None:
+        where.append("id > ?")
+        params.append(int(after_id))
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id " + ("ASC" if after_id is not None else "DESC")
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+
+
+def iter_sensor_rows(limit=None, before_id=None, after_id=None):
+    return _iter_keyset("sensor_data", SENSOR_COLUMNS, limit, before_id, after_id)
+
+
+def fetch_sensor_page(limit, before_id=None, after_id=None):
+    rows = recent.page(limit, before_id, after_id)  # served from memory when it holds the whole page
+    if rows is None:
+        rows = list(iter_sensor_rows(limit, before_id, after_id))
     return rows
 
+def fetch_device_history(device_ids, n):
+    """Newest `n` readings per device, oldest first: {device_id: [row dict, ...]}.
+
+    A device_id of None means the newest rows regardless of device.
+    """
+    history = {}
+    for device_id in device_ids:
+        rows = recent.history(device_id, n)
+        if rows is not None:
+            history[device_id] = rows
+    missing = [d for d in device_ids if d not in history]
+    if not missing:
+        return history
+    with get_conn() as conn:
+        for device_id in missing:
+            if device_id is None:
+                sql = "SELECT timestamp, soil_moisture, temperature, humidity FROM sensor_data ORDER BY id DESC LIMIT ?"
+                params = (n,)
+            else:
+                sql = ("SELECT timestamp, soil_moisture, temperature, humidity FROM sensor_data "
+                       "WHERE device_id = ? ORDER BY ts DESC, id DESC LIMIT ?")
+                params = (device_id, n)
+            rows = conn.execute(sql, params).fetchall()
+            history[device_id] = [
+                {"timestamp": r[0], "soil_moisture": r[1], "temperature": r[2], "humidity": r[3]}
+                for r in reversed(rows)
+            ]
+    return history
+
+
+def fetch_latest():
+    """Fetch the newest sensor_data row (timestamp, moisture, temp, humidity, pump)"""
+    row = recent.latest()
+    if row is not None:
+        return row[1:] if row else None
+    with get_conn() as conn:
+        return conn.execute(
+            "SELECT timestamp, soil_moisture, temperature, humidity, pump_status FROM sensor_data ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+
 def log_water_usage(timestamp, liters):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO water_usage (timestamp, liters_used) VALUES (?, ?)", (timestamp, liters))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn, conn:
+        conn.execute(WATER_INSERT_SQL, (timestamp, liters))
+        bump_versions(conn, "water_usage")
+    state.bump("water_usage")
+    state.record_water([liters])
 
 def fetch_water_usage():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT * FROM water_usage ORDER BY id DESC")
-    data = c.fetchall()
-    conn.close()
-    return data
+    with get_conn() as conn:
+        return conn.execute("SELECT * FROM water_usage ORDER BY id DESC").fetchall()
+
+def iter_water_usage(limit=None, before_id=None, after_id=None):
+    return _iter_keyset("water_usage", WATER_COLUMNS, limit, before_id, after_id)
+
+def fetch_open_irrigation(keys=None):
+    """Persisted open irrigation events: [(key, device_id, started_at, started_ts), ...], optionally only `keys`"""
+    sql = "SELECT key, device_id, started_at, started_ts FROM irrigation_open"
+    params = ()
+    if keys is not None:
+        params = tuple(keys)
+        sql += f" WHERE key IN ({', '.join('?' * len(params))})"
+    with get_conn() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def fetch_device_latest():
+    """{device_id: newest reading dict} from device_latest (kept while clustered)"""
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT device_id, timestamp, soil_moisture, temperature, humidity, pump_status FROM device_latest"
+        ).fetchall()
+    keys = ("device_id", "timestamp", "soil_moisture", "temperature", "humidity", "pump_status")
+    return {r[0]: dict(zip(keys, r)) for r in rows}
+
+
+def fetch_last_reading_time(device_id=None, since_ts=0):
+    """(timestamp, ts) of the newest sensor reading at or after since_ts, optionally for one device."""
+    with get_conn() as conn:
+        if device_id is None:
+            return conn.execute(
+                "SELECT timestamp, ts FROM sensor_data WHERE ts >= ? ORDER BY ts DESC LIMIT 1", (since_ts,)
+            ).fetchone()
+        return conn.execute(
+            "SELECT timestamp, ts FROM sensor_data WHERE device_id = ? AND ts >= ? ORDER BY ts DESC LIMIT 1",
+            (device_id, since_ts),
+        ).fetchone()
 
 def fetch_water_usage_total():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT COALESCE(SUM(liters_used), 0) FROM water_usage")
-    total = c.fetchone()[0] or 0
-    conn.close()
-    return total
+    with get_conn() as conn:
+        total = conn.execute("SELECT COALESCE(SUM(liters_used), 0) FROM water_usage").fetchone()[0]
+    return total or 0
 
 def log_notification(message: str, type_: str = "info", timestamp: str = None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     if not timestamp:
-        import datetime
-        timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute("INSERT INTO notifications (timestamp, message, type) VALUES (?, ?, ?)", (timestamp, message, type_))
-    conn.commit()
-    conn.close()
+        timestamp = _utc_now()
+    with get_conn() as conn, conn:
+        conn.execute(NOTIFICATION_INSERT_SQL, (timestamp, message, type_))
+        bump_versions(conn, "notifications")
+    state.bump("notifications")
 
 def fetch_notifications(limit: int = 10):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, timestamp, message, type FROM notifications ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    with get_conn() as conn:
+        return conn.execute(
+            "SELECT id, timestamp, message, type FROM notifications ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+
+# One statement for the three feeds a dashboard poll needs: the newest `limit`
+# rows after each cursor id (sensor rows, water events, notifications)
+_CHANGES_SQL = """
+    SELECT * FROM (SELECT 's', id, timestamp, soil_moisture, temperature, humidity, pump_status
+                   FROM sensor_data WHERE id > ?1 ORDER BY id DESC LIMIT ?4)
+    UNION ALL
+    SELECT * FROM (SELECT 'w', id, timestamp, liters_used, ended_at, duration_s, device_id
+                   FROM water_usage WHERE id > ?2 ORDER BY id DESC LIMIT ?4)
+    UNION ALL
+    SELECT * FROM (SELECT 'n', id, timestamp, message, type, NULL, NULL
+                   FROM notifications WHERE id > ?3 ORDER BY id DESC LIMIT ?4)
+"""
+
+
+def fetch_changes(sensor_after=0, water_after=0, notification_after=0, limit=50):
+    """Rows added after each cursor id, at most the newest `limit` of each, oldest first.
+
+    Returns {"sensor": [SENSOR_COLUMNS tuples], "water": [WATER_COLUMNS tuples],
+    "notifications": [(id, timestamp, message, type)]}.
+    """
+    with get_conn() as conn:
+        rows = conn.execute(_CHANGES_SQL, (sensor_after, water_after, notification_after, limit)).fetchall()
+    out = {"sensor": [], "water": [], "notifications": []}
+    feeds = {"s": out["sensor"], "w": out["water"], "n": out["notifications"]}
+    for row in reversed(rows):
+        kind = row[0]
+        feeds[kind].append(row[1:5] if kind == "n" else row[1:])
+    return out
+
 
 def get_setting(key: str, default: str = None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    row = c.fetchone()
-    conn.close()
-    if row and row[0] is not None:
-        return row[0]
+    """Setting value, served from the live-state cache after the first read"""
+    value = state.cached_setting(key)
+    if value is MISSING:
+        with get_conn() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        value = row[0] if row else None
+        state.store_setting(key, value)
+    if value is not None:
+        return value
     return default
 
 def set_setting(key: str, value: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn, conn:
+        conn.execute("INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value", (key, value))
+        bump_versions(conn, "settings")
+    state.store_setting(key, value)  # write-through
+    state.bump("settings")
@@ -0,0 +1,103 @@
+# backend/events.py
+# Server-Sent Events push channel.
+#
+# Producers (simulation loop, hardware ingestion, pump/mode routes) call
+# publish(); the hub encodes each event once and fans it out to every
+# subscriber's bounded queue, so connected clients cost no DB queries.
+# When clustered, cluster.py relays events between the worker processes.
+from flask import Blueprint, Response, request, stream_with_context
+from collections import deque
+import itertools
+import json
+import queue
+import threading
+
+events_bp = Blueprint("events", __name__)
+
+KEEPALIVE_SECONDS = 15
+SUBSCRIBER_QUEUE = 256  # events buffered per client before the oldest are dropped
+REPLAY_BUFFER = 500     # recent events kept for Last-Event-ID resume
+
+
+class EventHub:
+    def __init__(self, replay=REPLAY_BUFFER):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._recent = deque(maxlen=replay)
+        self._ids = itertools.count(1)
+
+    def publish(self, event, data):
+        """Broadcast one event to all subscribers (never blocks on slow clients)."""
+        with self._lock:
+            event_id = next(self._ids)
+            frame = f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+            self._recent.append((event_id, frame))
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(frame)
+            except queue.Full:
+                # slow client: drop its oldest event to make room
+                try:
+                    q.get_nowait()
+                    q.put_nowait(frame)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscribe(self, last_event_id=None):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        with self._lock:
+            if last_event_id is not None:
+                for event_id, frame in self._recent:
+                    if event_id > last_event_id:
+                        try:
+                            q.put_nowait(frame)
+                        except queue.Full:
+                            break
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+hub = EventHub()
+forward = None  # set by cluster.py: also hand each event to the other worker processes
+
+
+def publish(event, data):
+    hub.publish(event, data)
+    if forward is not None:
+        forward(event, data)
+
+
+@events_bp.route("/api/events", methods=["GET"])
+def stream_events():
+    """SSE stream of sensor, water, pump, mode, simulation and notification events."""
+    try:
+        last_id = int(request.headers.get("Last-Event-ID") or request.args.get("last_event_id") or 0) or None
+    except ValueError:
+        last_id = None
+    q = hub.subscribe(last_id)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            hub.unsubscribe(q)
+
+    resp = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
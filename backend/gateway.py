@@ -0,0 +1,370 @@
+# backend/gateway.py
+# Standalone asyncio ingestion gateway: sensor readings over UDP/TCP in a
+# fixed 20-byte binary frame instead of one HTTP JSON request per reading.
+#
+# Frame (little-endian, FRAME / FRAME_DTYPE below):
+#   u8  version      always 1
+#   u8  flags        reserved, 0
+#   8s  device_id    ASCII, NUL-padded (e.g. b"zone-12" or a chip id in hex)
+#   u32 epoch        UTC seconds; 0 = use the gateway's clock
+#   u16 moisture     tenths of a raw unit      (0xFFFF = missing)
+#   i16 temperature  hundredths of a degree C  (-32768 = missing)
+#   u16 humidity     hundredths of a percent   (0xFFFF = missing)
+#
+# A UDP datagram carries one or more whole frames; a TCP connection is a
+# plain stream of frames. Received bytes are pooled and decoded together with
+# one np.frombuffer per flush, then posted from a single writer thread to the
+# app's POST /api/hardware/batch (--forward, default http://127.0.0.1:5000).
+# The app process then owns the irrigation tracker and the SSE push, as it
+# does for every other reading.
+#
+# With --forward '' the gateway writes the database itself through
+# hardware.ingest_readings(), for installs without the app running. Its
+# tracker then follows irrigation_open (like a cluster worker), so an app
+# started on the same file and closing "left over" events doesn't get them
+# counted twice. Its SSE pushes stay in the gateway process, though: browsers
+# connected to the app don't see those readings live, only on their next poll.
+#
+#   python backend/gateway.py serve --udp 0.0.0.0:9750 --tcp 0.0.0.0:9751
+#   python backend/gateway.py emulate --devices 5000 --interval 1 --duration 30
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import struct
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+import database
+
+FRAME = struct.Struct("<BB8sIHhH")
+FRAME_DTYPE = np.dtype([
+    ("version", "u1"), ("flags", "u1"), ("device", "S8"), ("epoch", "<u4"),
+    ("moisture", "<u2"), ("temperature", "<i2"), ("humidity", "<u2"),
+])
+assert FRAME_DTYPE.itemsize == FRAME.size == 20
+VERSION = 1
+MISSING_U16 = 0xFFFF
+MISSING_I16 = -32768
+
+DEFAULT_UDP = "0.0.0.0:9750"
+DEFAULT_TCP = "0.0.0.0:9751"
+DEFAULT_FORWARD = "http://127.0.0.1:5000"
+FORWARD_TIMEOUT = 30.0    # seconds per POST /api/hardware/batch
+FLUSH_INTERVAL = 0.1      # seconds between flushes of pooled frames
+MAX_BATCH = 5000          # frames per batch upload / ingest_readings() call (hardware.MAX_BATCH)
+MAX_PENDING = 200_000     # frames buffered before UDP drops / TCP pauses reading
+UDP_RCVBUF = 8 << 20
+
+
+def encode(device_id, epoch=0, moisture=None, temperature=None, humidity=None):
+    """One frame; the reference for device firmware and the emulator."""
+    return FRAME.pack(
+        VERSION, 0, str(device_id).encode("ascii")[:8], int(epoch or 0),
+        MISSING_U16 if moisture is None else int(round(moisture * 10)),
+        MISSING_I16 if temperature is None else int(round(temperature * 100)),
+        MISSING_U16 if humidity is None else int(round(humidity * 100)),
+    )
+
+
+def decode(buf):
+    """Reading dicts (hardware.validate_reading input) from whole frames, plus the count rejected."""
+    frames = np.frombuffer(buf, dtype=FRAME_DTYPE, count=len(buf) // FRAME.size)
+    ok = frames["version"] == VERSION
+    rejected = int(len(frames) - ok.sum())
+    frames = frames[ok]
+    if not len(frames):
+        return [], rejected
+
+    def column(values, missing, scale):
+        out = values.astype(float) / scale
+        return np.where(values == missing, None, out).tolist()
+
+    devices = [d.decode("ascii", "replace") for d in frames["device"].tolist()]
+    epochs = frames["epoch"].tolist()
+    moisture = column(frames["moisture"], MISSING_U16, 10)
+    temperature = column(frames["temperature"], MISSING_I16, 100)
+    humidity = column(frames["humidity"], MISSING_U16, 100)
+    readings = [
+        {"device_id": d, "timestamp": e or None, "soil_moisture": m, "temperature": t, "humidity": h}
+        for d, e, m, t, h in zip(devices, epochs, moisture, temperature, humidity)
+    ]
+    return readings, rejected
+
+
+def _address(text):
+    host, _, port = text.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+# --- Server ---
+class Gateway:
+    """Pools frames from every transport and persists them in batches."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH, max_pending=MAX_PENDING,
+                 forward=None):
+        self.forward = forward.rstrip("/") + "/api/hardware/batch" if forward else None
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._chunks = []
+        self._pending = 0          # whole frames buffered
+        self._tcp = set()          # transports, paused together under backpressure
+        self._paused = False
+        self.closing = False
+        self.stats = {"frames": 0, "ingested": 0, "rejected": 0, "dropped": 0, "batches": 0, "errors": 0}
+
+    def feed(self, data, transport=None):
+        """Buffer whole frames; returns the bytes of a trailing partial frame (TCP keeps them)."""
+        whole = len(data) - len(data) % FRAME.size
+        if whole:
+            if self._pending >= self.max_pending and transport is None:
+                self.stats["dropped"] += whole // FRAME.size  # UDP has no backpressure
+            else:
+                self._chunks.append(data[:whole])
+                self._pending += whole // FRAME.size
+                self.stats["frames"] += whole // FRAME.size
+                if self._pending >= self.max_pending and not self._paused:
+                    self._paused = True
+                    for t in self._tcp:
+                        t.pause_reading()
+        return data[whole:]
+
+    def _take(self):
+        buf = b"".join(self._chunks)
+        self._chunks, self._pending = [], 0
+        if self._paused:
+            self._paused = False
+            for t in self._tcp:
+                t.resume_reading()
+        return buf
+
+    def _post(self, readings):
+        """Upload one batch to the app; returns (accepted, rejected) counts."""
+        request = urllib.request.Request(
+            self.forward, data=json.dumps(readings).encode(),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=FORWARD_TIMEOUT) as response:
+                body = json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code != 400:
+                raise
+            body = json.load(e)  # every reading in the batch was invalid
+        return body.get("accepted", 0), body.get("rejected", 0)
+
+    def _ingest(self, readings):
+        import hardware
+
+        accepted, errors = hardware.ingest_readings(readings)
+        return len(accepted), len(errors)
+
+    def _persist(self, buf):
+        """Writer thread: decode and forward (or ingest) in MAX_BATCH slices."""
+        store = self._post if self.forward else self._ingest
+        step = self.max_batch * FRAME.size
+        for lo in range(0, len(buf), step):
+            readings, rejected = decode(buf[lo:lo + step])
+            self.stats["rejected"] += rejected
+            if readings:
+                accepted, errors = store(readings)
+                self.stats["ingested"] += accepted
+                self.stats["rejected"] += errors
+                self.stats["batches"] += 1
+
+    async def flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            closing = self.closing
+            if not closing:
+                await asyncio.sleep(self.flush_interval)
+            if not self._chunks:
+                if closing:
+                    return
+                continue
+            buf = self._take()
+            try:
+                # default executor, awaited: batches are written one at a time, in order
+                await loop.run_in_executor(None, self._persist, buf)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[gateway] dropped {len(buf) // FRAME.size} frames: {e}")
+
+    def udp_protocol(self):
+        gateway = self
+
+        class Udp(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                gateway.feed(data)
+
+        return Udp()
+
+    def tcp_protocol(self):
+        gateway = self
+
+        class Tcp(asyncio.Protocol):
+            def connection_made(self, transport):
+                self.transport = transport
+                self.rest = b""
+                gateway._tcp.add(transport)
+                if gateway._paused:
+                    transport.pause_reading()
+
+            def data_received(self, data):
+                self.rest = gateway.feed(self.rest + data if self.rest else data, self.transport)
+
+            def connection_lost(self, exc):
+                gateway._tcp.discard(self.transport)
+
+        return Tcp()
+
+
+async def serve(udp=DEFAULT_UDP, tcp=DEFAULT_TCP, stats_interval=10.0, forward=DEFAULT_FORWARD):
+    gateway = Gateway(forward=forward)
+    loop = asyncio.get_running_loop()
+    servers = []
+    if udp:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF)
+        sock.bind(_address(udp))
+        transport, _ = await loop.create_datagram_endpoint(gateway.udp_protocol, sock=sock)
+        servers.append(transport)
+        print(f"[gateway] UDP on {udp}")
+    if tcp:
+        host, port = _address(tcp)
+        servers.append(await loop.create_server(gateway.tcp_protocol, host, port))
+        print(f"[gateway] TCP on {tcp}")
+    print(f"[gateway] forwarding to {gateway.forward}" if forward else f"[gateway] writing {database.DB_PATH}")
+    flusher = asyncio.ensure_future(gateway.flush_loop())
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # not on this platform/thread; Ctrl-C still ends asyncio.run()
+    try:
+        last = dict(gateway.stats)
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), stats_interval)
+                break
+            except asyncio.TimeoutError:
+                pass
+            s = dict(gateway.stats)
+            rate = (s["ingested"] - last["ingested"]) / stats_interval
+            print(f"[gateway] {rate:,.0f} readings/s  " + "  ".join(f"{k} {v:,}" for k, v in s.items()))
+            last = s
+    finally:
+        for server in servers:
+            server.close()
+        gateway.closing = True
+        await flusher  # finishes the batch in flight, then writes what is still buffered
+
+
+# --- NodeMCU emulator ---
+async def emulate(host="127.0.0.1", port=9750, protocol="udp", devices=1000, interval=1.0,
+                  duration=10.0, connections=100, seed=0):
+    """Every device sends one reading per `interval` seconds, at a random phase, for `duration` seconds.
+
+    UDP: one datagram per reading, as a NodeMCU would. TCP: devices share
+    `connections` long-lived connections; each tick's frames go out in one write.
+    """
+    rng = random.Random(seed)
+    names = [f"nd{k:06d}" for k in range(devices)]
+    level = [rng.uniform(350, 750) for _ in range(devices)]
+    loop = asyncio.get_running_loop()
+    sent = 0
+
+    def frame(k):
+        level[k] = level[k] - rng.uniform(0, 2) if level[k] > 330 else 760.0
+        return encode(names[k], int(time.time()), level[k], 22 + rng.gauss(0, 1), 60 + rng.gauss(0, 5))
+
+    if protocol == "udp":
+        transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(host, port))
+        writers = None
+    else:
+        transport = None
+        writers = [(await asyncio.open_connection(host, port))[1] for _ in range(min(connections, devices))]
+
+    # spread each device's sends over the interval, like unsynchronised boards
+    slots = 50
+    groups = [[] for _ in range(slots)]
+    for k in range(devices):
+        groups[rng.randrange(slots)].append(k)
+    started = time.monotonic()
+    try:
+        for tick in range(max(1, int(duration / interval))):
+            for s, group in enumerate(groups):
+                due = started + tick * interval + s * interval / slots
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if writers is None:
+                    for k in group:
+                        transport.sendto(frame(k))
+                else:
+                    per_conn = {}
+                    for k in group:
+                        per_conn.setdefault(k % len(writers), []).append(frame(k))
+                    for c, frames in per_conn.items():
+                        writers[c].write(b"".join(frames))
+                    await asyncio.gather(*(writers[c].drain() for c in per_conn))
+                sent += len(group)
+    finally:
+        if transport is not None:
+            transport.close()
+        for w in writers or ():
+            w.close()
+    elapsed = time.monotonic() - started
+    print(f"sent {sent:,} readings from {devices:,} devices over {protocol.upper()} "
+          f"in {elapsed:.1f}s ({sent / elapsed:,.0f}/s)")
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UDP/TCP binary ingestion gateway and NodeMCU emulator.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    srv = sub.add_parser("serve", help="run the gateway")
+    srv.add_argument("--udp", default=DEFAULT_UDP, help="host:port ('' to disable)")
+    srv.add_argument("--tcp", default=DEFAULT_TCP, help="host:port ('' to disable)")
+    srv.add_argument("--forward", default=DEFAULT_FORWARD,
+                     help="app base URL to post batches to ('' to write the database directly)")
+    srv.add_argument("--db", default=None, help="with --forward '': SQLite file to use instead of backend/irrigation.db")
+    srv.add_argument("--stats-interval", type=float, default=10.0)
+    emu = sub.add_parser("emulate", help="emulate many NodeMCUs sending to a gateway")
+    emu.add_argument("--host", default="127.0.0.1")
+    emu.add_argument("--port", type=int, default=None, help="default 9750 (UDP) / 9751 (TCP)")
+    emu.add_argument("--protocol", choices=["udp", "tcp"], default="udp")
+    emu.add_argument("--devices", type=int, default=1000)
+    emu.add_argument("--interval", type=float, default=1.0, help="seconds between readings of a device")
+    emu.add_argument("--duration", type=float, default=10.0)
+    emu.add_argument("--connections", type=int, default=100, help="TCP connections shared by the devices")
+    args = parser.parse_args(argv)
+
+    if args.command == "emulate":
+        port = args.port or _address(DEFAULT_UDP if args.protocol == "udp" else DEFAULT_TCP)[1]
+        asyncio.run(emulate(args.host, port, args.protocol, args.devices, args.interval,
+                            args.duration, args.connections))
+        return
+    if not args.forward:
+        from water_tracker import tracker
+
+        if args.db:
+            database.DB_PATH = os.path.abspath(args.db)
+        database.init_db()
+        tracker.shared = True  # the app may close or reopen events on the same file
+    try:
+        asyncio.run(serve(args.udp, args.tcp, args.stats_interval, args.forward))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
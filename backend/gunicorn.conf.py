@@ -0,0 +1,25 @@
+# backend/gunicorn.conf.py
+# gunicorn settings for wsgi.py: one worker per core by default.
+#
+# Threaded workers, so long-lived /api/events (SSE) streams don't each tie up
+# a whole process. Override with WEB_CONCURRENCY, IRRIGATION_THREADS and
+# IRRIGATION_BIND.
+import multiprocessing
+import os
+
+bind = os.environ.get("IRRIGATION_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("IRRIGATION_THREADS", "16"))
+graceful_timeout = 15
+
+
+def on_starting(server):
+    """Once, in the master before any worker forks: migrate and recover."""
+    os.environ.setdefault("IRRIGATION_CLUSTER", "1")
+    import database
+    from water_tracker import tracker
+
+    database.init_db()
+    tracker.load()  # close irrigation events left open by a previous run
+    database.close_all()  # don't hand open SQLite connections to forked workers
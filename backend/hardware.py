@@ -1,10 +1,31 @@
 # backend/hardware.py
 from flask import Blueprint, request, jsonify
 import datetime
+import json
+import threading
+import time
+
+from database import (
+    SENSOR_INSERT_SQL,
+    DEVICE_LATEST_SQL,
+    SHARED_STATE_SQL,
+    sensor_params,
+    execute_batches,
+    fetch_device_latest,
+)
+import cluster
+from cluster import shared
+import instrumentation
+from events import publish
+from water_tracker import tracker, MANUAL_KEY
 
 hardware_bp = Blueprint("hardware", __name__)
 
-# Store latest sensor data
+DEFAULT_DEVICE = "default"
+MAX_BATCH = 5000  # readings accepted per upload
+PUMP_ON_BELOW = 400  # moisture below this turns the pump ON
+
+# Store latest sensor data (most recent reading from any device)
 latest_data = {
     "timestamp": None,
     "soil_moisture": None,
@@ -13,31 +34,194 @@ latest_data = {
     "pump_status": "OFF"
 }
 
+# Latest reading per device_id
+device_state = {}
+_state_lock = threading.Lock()
+
+# When clustered, readings arrive at every worker: the latest one lives in
+# shared_state under this key and the per-device ones in device_latest,
+# written in the same transaction as the readings
+LATEST_KEY = "hardware_latest"
+
+
+def _latest():
+    """The most recent reading from any device, as this or any worker stored it."""
+    if cluster.enabled:
+        return shared.get(LATEST_KEY) or dict(latest_data)
+    return latest_data
+
+
+def _number(value, field):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{field} must be a number")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{field} must be a number")
+
+
+def _timestamp(value, now):
+    """Accept 'YYYY-mm-dd HH:MM:SS' strings (UTC unless they carry an offset) or epoch
+    seconds; default to server time. Stored as UTC text, like the rest of the DB."""
+    if value is None or value == "":
+        return now
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        except (OverflowError, OSError, ValueError):  # out of range (e.g. 1e20), NaN
+            raise ValueError("timestamp epoch seconds out of range") from None
+    if isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value.replace("T", " "))
+        except ValueError:
+            pass
+        else:
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone(datetime.timezone.utc)
+            return parsed.strftime("%Y-%m-%d %H:%M:%S")
+    raise ValueError("timestamp must be 'YYYY-mm-dd HH:MM:SS' or epoch seconds")
+
+
+def validate_reading(data, now):
+    """Normalize one raw reading dict; raises ValueError when it is unusable."""
+    if not isinstance(data, dict):
+        raise ValueError("reading must be an object")
+    reading = {
+        "device_id": str(data.get("device_id") or data.get("zone_id") or DEFAULT_DEVICE),
+        "timestamp": _timestamp(data.get("timestamp"), now),
+        "soil_moisture": _number(data.get("soil_moisture"), "soil_moisture"),
+        "temperature": _number(data.get("temperature"), "temperature"),
+        "humidity": _number(data.get("humidity"), "humidity"),
+    }
+    if reading["soil_moisture"] is None:
+        raise ValueError("soil_moisture is required")
+    # Auto pump logic (same rule: <400 moisture → ON)
+    reading["pump_status"] = "ON" if reading["soil_moisture"] < PUMP_ON_BELOW else "OFF"
+    return reading
+
+
+def ingest_readings(raw_readings):
+    """Validate, persist (one transaction) and publish a batch of readings.
+
+    Returns (accepted readings, [{"index": i, "error": msg}, ...]).
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    accepted, errors = [], []
+    for i, data in enumerate(raw_readings):
+        try:
+            accepted.append(validate_reading(data, now))
+        except ValueError as e:
+            errors.append({"index": i, "error": str(e)})
+    instrumentation.ingested.inc(("accepted",), len(accepted))
+    instrumentation.ingested.inc(("rejected",), len(errors))
+    if accepted:
+        latest = {k: v for k, v in accepted[-1].items() if k != "device_id"}
+        batches = [(SENSOR_INSERT_SQL, [sensor_params(r) for r in accepted])]
+        if cluster.enabled:
+            prev_pump = _latest()["pump_status"]
+            newest = {}
+            for r in accepted:
+                if r["device_id"] not in newest or r["timestamp"] >= newest[r["device_id"]]["timestamp"]:
+                    newest[r["device_id"]] = r
+            batches += [
+                (DEVICE_LATEST_SQL, [(r["device_id"],) + sensor_params(r)[:5] for r in newest.values()]),
+                (SHARED_STATE_SQL, [(LATEST_KEY, json.dumps(latest), time.time())]),
+            ]
+        execute_batches(batches)
+        updated = {}
+        with _state_lock:
+            for r in accepted:
+                prev = device_state.get(r["device_id"])
+                if prev is None or r["timestamp"] >= prev["timestamp"]:
+                    device_state[r["device_id"]] = updated[r["device_id"]] = r
+            if not cluster.enabled:
+                prev_pump = latest_data["pump_status"]
+            latest_data.update(latest)
+        # Irrigation events per device; only pump transitions write
+        keys = {f"device:{r['device_id']}" for r in accepted}
+        tracker.sync(keys)  # another worker may have taken this device's previous readings
+        for r in sorted(accepted, key=lambda r: r["timestamp"]):
+            tracker.observe(f"device:{r['device_id']}", r["pump_status"] == "ON", r["timestamp"], r["device_id"])
+        # One push per device (its newest reading), however large the batch
+        for r in updated.values():
+            publish("sensor", r)
+        if latest["pump_status"] != prev_pump:
+            publish("pump", {"pump_status": latest["pump_status"], "source": "hardware"})
+    return accepted, errors
+
+
+def _parse_batch_body():
+    """Readings from a JSON array, {"readings": [...]} or NDJSON body."""
+    ctype = (request.mimetype or "").lower()
+    if ctype in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        readings = []
+        for line in request.get_data(as_text=True).splitlines():
+            line = line.strip()
+            if line:
+                readings.append(json.loads(line))
+        return readings
+    body = request.get_json(silent=False)
+    if isinstance(body, dict):
+        body = body.get("readings", [body])
+    if not isinstance(body, list):
+        raise ValueError("expected a list of readings")
+    return body
+
+
 # Endpoint 1: Receive sensor data (from NodeMCU later, now just test via POST)
 @hardware_bp.route("/api/hardware/read", methods=["POST"])
 def read_sensor():
-    data = request.json
-    latest_data["timestamp"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    latest_data["soil_moisture"] = data.get("soil_moisture")
-    latest_data["temperature"] = data.get("temperature")
-    latest_data["humidity"] = data.get("humidity")
+    data = request.get_json(silent=True) or {}
+    accepted, errors = ingest_readings([data])
+    if errors:
+        return jsonify({"error": errors[0]["error"]}), 400
+    return jsonify({"status": "received", "data": latest_data})
 
-    # Auto pump logic (same rule: <400 moisture → ON)
-    if latest_data["soil_moisture"] is not None and latest_data["soil_moisture"] < 400:
-        latest_data["pump_status"] = "ON"
-    else:
-        latest_data["pump_status"] = "OFF"
 
-    return jsonify({"status": "received", "data": latest_data})
+# Endpoint 1b: Batched upload from buffering devices (JSON array or NDJSON)
+@hardware_bp.route("/api/hardware/batch", methods=["POST"])
+def read_sensor_batch():
+    try:
+        readings = _parse_batch_body()
+    except Exception as e:
+        return jsonify({"error": f"Invalid batch body: {e}"}), 400
+    if len(readings) > MAX_BATCH:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH} readings)"}), 413
+    accepted, errors = ingest_readings(readings)
+    return jsonify({
+        "status": "received",
+        "accepted": len(accepted),
+        "rejected": len(errors),
+        "errors": errors[:50],
+    }), (200 if accepted or not errors else 400)
+
 
 # Endpoint 2: Get latest status
 @hardware_bp.route("/api/hardware/status", methods=["GET"])
 def get_status():
-    return jsonify(latest_data)
-
-# Endpoint 3: Manually toggle pump
-@hardware_bp.route("/api/hardware/pump", methods=["POST"])
-def control_pump():
-    action = request.json.get("action")  # "ON" or "OFF"
-    latest_data["pump_status"] = action
-    return jsonify({"status": "pump updated", "pump_status": action})
+    return jsonify(_latest())
+
+
+# Endpoint 2b: Latest reading per device
+@hardware_bp.route("/api/hardware/devices", methods=["GET"])
+def get_devices():
+    if cluster.enabled:
+        return jsonify(fetch_device_latest())
+    with _state_lock:
+        return jsonify(dict(device_state))
+
+
+def set_manual_pump(action):
+    """Apply a manual "ON"/"OFF" (POST /api/hardware/pump in app.py) to the hardware state.
+
+    Records it on the latest reading and opens/closes the manual irrigation
+    event; the caller validates `action` and pushes the 'pump' event.
+    """
+    latest = _latest()
+    latest["pump_status"] = action
+    if cluster.enabled:
+        shared.set(LATEST_KEY, latest)
+    tracker.sync([MANUAL_KEY], live=True)
+    tracker.observe(MANUAL_KEY, action == "ON")
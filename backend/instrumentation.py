@@ -0,0 +1,273 @@
+# backend/instrumentation.py
+# Request, query and pipeline metrics in Prometheus text format.
+#
+# Off by default. IRRIGATION_METRICS=1 turns it on at startup (or call
+# enable()); IRRIGATION_SLOW_QUERY_MS sets the slow-query log threshold
+# (default 100 ms). When disabled every hook returns after one flag check and
+# database.get_conn() hands out the raw sqlite3 connection, so the cost is nil.
+#
+#   GET /api/internal/metrics
+#
+# - http_request_duration_seconds{method,route,status}: time to build the
+#   response (for streamed responses, until the body starts)
+# - db_query_duration_seconds{op,table}: execute plus fetching the results
+# - db_slow_queries_total{op,table}, with one "[slow-query]" log line each
+# - db_rows_written_total{table}, simulation_ticks_total, ingest_readings_total{result}
+# - gauges registered by the app (write queue depth, SSE clients, ...)
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import Blueprint, Response, g, request
+
+instrumentation_bp = Blueprint("instrumentation", __name__)
+
+enabled = os.environ.get("IRRIGATION_METRICS", "").lower() in ("1", "true", "yes", "on")
+SLOW_QUERY_MS = float(os.environ.get("IRRIGATION_SLOW_QUERY_MS", "100") or 100)
+
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+_lock = threading.Lock()  # guards every metric update
+_metrics = []
+_gauges = []
+
+
+def enable(flag=True, slow_query_ms=None):
+    global enabled, SLOW_QUERY_MS
+    enabled = bool(flag)
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = float(slow_query_ms)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _fmt(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, labels=(), n=1):
+        if not enabled:
+            return
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {_fmt(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=REQUEST_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help_text, labels, buckets
+        self._series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, labels, value):
+        if not enabled:
+            return
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), series):
+                cumulative += n
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time to build an HTTP response.", ("method", "route", "status"))
+query_duration = Histogram(
+    "db_query_duration_seconds", "SQLite statement time (execute plus fetch).", ("op", "table"), QUERY_BUCKETS)
+slow_queries = Counter(
+    "db_slow_queries_total", "Statements slower than the slow-query threshold.", ("op", "table"))
+rows_written = Counter("db_rows_written_total", "Rows written in committed batches.", ("table",))
+simulation_ticks = Counter("simulation_ticks_total", "Simulation rows stepped by the scheduler.")
+ingested = Counter("ingest_readings_total", "Hardware readings received.", ("result",))
+
+
+def register_gauge(name, help_text, fn):
+    """Sample `fn()` (a number) at every scrape."""
+    _gauges.append((name, help_text, fn))
+
+
+def render():
+    with _lock:
+        lines = [line for metric in _metrics for line in metric.render()]
+    for name, help_text, fn in _gauges:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_fmt(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+# --- Flask hooks ---
+@instrumentation_bp.before_app_request
+def _start_timer():
+    if enabled:
+        g.request_started = time.perf_counter()
+
+
+@instrumentation_bp.after_app_request
+def _observe_request(resp):
+    started = g.get("request_started") if enabled else None
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        request_duration.observe((request.method, route, str(resp.status_code)), time.perf_counter() - started)
+    return resp
+
+
+@instrumentation_bp.route("/api/internal/metrics", methods=["GET"])
+def metrics_endpoint():
+    if not enabled:
+        return Response("# instrumentation disabled (set IRRIGATION_METRICS=1)\n", status=404, mimetype="text/plain")
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+# --- SQLite statement timing ---
+_OP = re.compile(r"^\s*(\w+)(?:\s+(\w+))?")
+_TABLE = re.compile(r"\b(?:FROM|INTO|TABLE)\s+(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def statement_labels(sql):
+    """(op, table) for a statement, e.g. ('SELECT', 'sensor_data'); bounded label cardinality."""
+    m = _OP.match(sql)
+    if not m:
+        return ("OTHER", "")
+    op = m.group(1).upper()
+    if op == "UPDATE":
+        return (op, m.group(2) or "")
+    t = _TABLE.search(sql)
+    return (op, t.group(1) if t else "")
+
+
+def _record(sql, elapsed):
+    labels = statement_labels(sql)
+    query_duration.observe(labels, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc(labels)
+        text = " ".join(sql.split())
+        print(f"[slow-query] {elapsed * 1000:.1f} ms: {text[:300]}")
+
+
+class TimedCursor:
+    """Cursor wrapper that records a statement once its results are consumed."""
+
+    __slots__ = ("_cur", "_sql", "_elapsed")
+
+    def __init__(self, cur, sql, elapsed):
+        self._cur, self._sql, self._elapsed = cur, sql, elapsed
+        if cur.description is None:  # no result rows: done at execute
+            self._done()
+
+    def _done(self):
+        if self._sql is not None:
+            _record(self._sql, self._elapsed)
+            self._sql = None
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = self._cur.fetchone()
+        self._elapsed += time.perf_counter() - t0
+        self._done()
+        return row
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = self._cur.fetchall()
+        self._elapsed += time.perf_counter() - t0
+        self._done()
+        return rows
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = self._cur.fetchmany(size) if size is not None else self._cur.fetchmany()
+        self._elapsed += time.perf_counter() - t0
+        if len(rows) < (size or self._cur.arraysize):
+            self._done()
+        return rows
+
+    def __iter__(self):
+        while True:
+            t0 = time.perf_counter()
+            row = self._cur.fetchone()
+            self._elapsed += time.perf_counter() - t0
+            if row is None:
+                self._done()
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class TimedConnection:
+    """sqlite3 connection wrapper handed out by get_conn() while enabled."""
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, *params):
+        t0 = time.perf_counter()
+        cur = self._conn.execute(sql, *params)
+        return TimedCursor(cur, sql, time.perf_counter() - t0)
+
+    def executemany(self, sql, rows):
+        t0 = time.perf_counter()
+        cur = self._conn.executemany(sql, rows)
+        _record(sql, time.perf_counter() - t0)
+        return cur
+
+    def executescript(self, script):
+        t0 = time.perf_counter()
+        cur = self._conn.executescript(script)
+        _record(script, time.perf_counter() - t0)
+        return cur
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,174 @@
+# backend/live_state.py
+# In-process cache of settings and running totals, so status endpoints and the
+# simulation loop don't hit SQLite on every poll/tick.
+#
+# database.py keeps this in sync: set_setting() writes through, and every
+# committed sensor/water insert bumps the counters. rebuild() seeds everything
+# from the DB at startup.
+#
+# Per-table change counters (bumped after every committed write to a table)
+# give readers a cheap data version for ETags and result caching (cache.py).
+#
+# Other processes write too (the standalone gateway and serial bridge, other
+# workers when clustered), so init_db() calls share(): the counters then come
+# from the table_versions rows every writer bumps, and refresh() reloads
+# settings/totals whenever those show another process wrote. It looks at most
+# every REFRESH_INTERVAL seconds, so hot paths (settings per simulation tick,
+# ETags per poll) stay in memory; writes by this process show up at once.
+import json
+import threading
+import time
+import uuid
+
+MISSING = object()
+REFRESH_INTERVAL = 0.5  # seconds between table_versions checks
+
+
+class LiveState:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settings = {}
+        self.total_liters = 0.0
+        self.water_rows = 0
+        self.sensor_rows = 0
+        self.pump_on_ticks = 0
+        self._versions = {}
+        self.epoch = uuid.uuid4().hex[:8]  # new per process/DB, so versions never repeat across restarts
+        self._connect = None  # set by share()
+        self._seen = {}
+        self._totals_key = None
+        self._checked = None  # monotonic time of the last table_versions check
+
+    # --- settings cache ---
+    def cached_setting(self, key):
+        """Cached value, None for a known-missing key, or MISSING if never loaded."""
+        self.refresh(totals=False)
+        return self._settings.get(key, MISSING)
+
+    def store_setting(self, key, value):
+        self._settings[key] = value
+
+    # --- counters ---
+    def record_sensor_rows(self, pump_flags):
+        """pump_flags: pump_status values of the rows just committed."""
+        if self._connect is not None:
+            return  # shared: refresh() reloads the totals instead
+        on = sum(1 for p in pump_flags if p in ("ON", 1, "1"))
+        with self._lock:
+            self.sensor_rows += len(pump_flags)
+            self.pump_on_ticks += on
+
+    def record_water(self, liters):
+        """liters: liters_used values of the rows just committed."""
+        if self._connect is not None:
+            return
+        total = sum(float(x) for x in liters if x is not None)
+        with self._lock:
+            self.water_rows += len(liters)
+            self.total_liters += total
+
+    # --- change counters ---
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def version(self, *tables):
+        """Opaque token that changes whenever any of `tables` is written."""
+        self.refresh(totals=False)
+        with self._lock:
+            return "-".join([self.epoch] + [str(self._versions.get(t, 0)) for t in tables])
+
+    # --- shared (multi-process) mode ---
+    def share(self, connect):
+        """Follow the counters in table_versions; `connect` is database.get_conn."""
+        self._connect = connect
+        self._seen = {}
+        self._totals_key = None
+        self._checked = None
+        self.refresh()
+
+    def refresh(self, totals=True):
+        """Pick up writes made by other processes (no-op unless shared).
+
+        Settings and change counters are brought up to date at most every
+        REFRESH_INTERVAL; the totals (a heavier query) only when `totals` is
+        true and the data changed.
+        """
+        if self._connect is None:
+            return
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < REFRESH_INTERVAL:
+            # _versions includes this process's own writes since the last check
+            key = (self._seen.get(""), self._versions.get("sensor_data"), self._versions.get("water_usage"))
+            if not totals or key == self._totals_key:
+                return
+        self._checked = now
+        with self._connect() as conn:
+            seen = dict(conn.execute("""
+                SELECT name, n FROM table_versions
+                UNION ALL SELECT '', value FROM shared_state WHERE key = 'epoch'
+            """).fetchall())
+            key = (seen.get(""), seen.get("sensor_data"), seen.get("water_usage"))
+            loaded = self._load_totals(conn) if totals and key != self._totals_key else None
+        with self._lock:
+            if seen != self._seen:
+                if seen.get("settings") != self._seen.get("settings") or seen.get("") != self._seen.get(""):
+                    self._settings = {}  # reloaded lazily by database.get_setting()
+                self._seen = seen
+                versions = dict(seen)
+                epoch = versions.pop("", None)
+                if epoch:
+                    self.epoch = json.loads(epoch)
+                self._versions = versions
+            if loaded is not None:
+                self._set_totals(*loaded)
+                self._totals_key = key
+
+    def rebuild(self, conn):
+        """Reload settings and totals from the DB (daily rollups + uncompacted tail)."""
+        settings = dict(conn.execute("SELECT key, value FROM settings").fetchall())
+        totals = self._load_totals(conn)
+        with self._lock:
+            self._settings = settings
+            self._set_totals(*totals)
+            self._versions = {}
+            self.epoch = uuid.uuid4().hex[:8]
+            self._seen = {}
+            self._totals_key = None
+            self._checked = None
+
+    def _set_totals(self, liters, water_rows, sensor_rows, pump_on):
+        self.total_liters = float(liters)
+        self.water_rows = water_rows
+        self.sensor_rows = sensor_rows
+        self.pump_on_ticks = pump_on
+
+    @staticmethod
+    def _load_totals(conn):
+        liters, water_rows = conn.execute("""
+            SELECT COALESCE(SUM(liters), 0), COALESCE(SUM(n), 0) FROM (
+                SELECT liters, n FROM water_rollup WHERE width = 86400
+                UNION ALL
+                SELECT SUM(liters_used), COUNT(*) FROM water_usage
+                WHERE id > (SELECT last_id FROM rollup_state WHERE source = 'water_usage')
+                UNION ALL
+                SELECT SUM(liters_used), COUNT(*) FROM water_usage
+                WHERE ts IS NULL AND id <= (SELECT last_id FROM rollup_state WHERE source = 'water_usage')
+            )
+        """).fetchone()
+        sensor_rows, pump_on = conn.execute("""
+            SELECT COALESCE(SUM(n), 0), COALESCE(SUM(pump_on), 0) FROM (
+                SELECT n, pump_on FROM sensor_rollup WHERE width = 86400
+                UNION ALL
+                SELECT COUNT(*), SUM(CASE WHEN pump_status IN ('ON',1) THEN 1 ELSE 0 END) FROM sensor_data
+                WHERE id > (SELECT last_id FROM rollup_state WHERE source = 'sensor_data')
+                UNION ALL
+                SELECT COUNT(*), SUM(CASE WHEN pump_status IN ('ON',1) THEN 1 ELSE 0 END) FROM sensor_data
+                WHERE ts IS NULL AND id <= (SELECT last_id FROM rollup_state WHERE source = 'sensor_data')
+            )
+        """).fetchone()
+        return liters, water_rows, sensor_rows, pump_on
+
+
+state = LiveState()
@@ -0,0 +1,199 @@
+# backend/ml_model.py
+# Soil-moisture forecasting: predicts the moisture HORIZON readings ahead of
+# a zone's most recent LAGS readings.
+#
+# The model is trained from sensor_data history, persisted with joblib and
+# loaded once per process. Inference is batched: one predict() call serves
+# every zone in a request (or every session due on a simulation tick).
+import os
+import threading
+import time
+
+import numpy as np
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "models")
+MODEL_PATH = os.path.join(MODEL_DIR, "moisture_forecast.joblib")
+
+LAGS = 6            # recent moisture readings used as features
+HORIZON = 5         # readings ahead being predicted
+MAX_TRAIN_ROWS = 500_000
+FEATURES = [f"moisture_lag{i}" for i in range(LAGS)] + ["temperature", "humidity"]
+
+_model = None       # {"pipeline": ..., "meta": {...}} once loaded/trained
+_model_lock = threading.Lock()
+
+
+def _feature_rows(histories):
+    """Feature matrix from per-zone histories (each: readings oldest -> newest).
+
+    A reading is a dict with soil_moisture/temperature/humidity. Histories
+    shorter than LAGS are padded with their oldest moisture value; missing
+    values become NaN and are imputed by the pipeline.
+    """
+    X = np.full((len(histories), len(FEATURES)), np.nan)
+    for i, readings in enumerate(histories):
+        if not readings:
+            continue
+        moist = [r.get("soil_moisture") for r in readings[-LAGS:]]
+        moist = [np.nan if m is None else float(m) for m in moist]
+        moist = [moist[0]] * (LAGS - len(moist)) + moist
+        X[i, :LAGS] = moist[::-1]  # lag0 = newest
+        last = readings[-1]
+        for j, key in enumerate(("temperature", "humidity")):
+            value = last.get(key)
+            X[i, LAGS + j] = np.nan if value is None else float(value)
+    return X
+
+
+def _training_frame(conn, max_rows=MAX_TRAIN_ROWS):
+    import pandas as pd
+    rows = conn.execute(
+        """
+        SELECT id, COALESCE(device_id, ''), ts, soil_moisture, temperature, humidity
+        FROM sensor_data
+        WHERE ts IS NOT NULL AND soil_moisture IS NOT NULL
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (max_rows,),
+    ).fetchall()
+    df = pd.DataFrame(rows, columns=["id", "device_id", "ts", "soil_moisture", "temperature", "humidity"])
+    return df.sort_values(["device_id", "ts", "id"], kind="stable")
+
+
+def build_dataset(df, holdout=0.0):
+    """(X, y, is_holdout) with per-device lag features and the moisture HORIZON steps ahead.
+
+    `df` is ordered by device, then time; is_holdout marks the newest
+    `holdout` fraction of each device's samples.
+    """
+    g = df.groupby("device_id", sort=False)["soil_moisture"]
+    cols = {f"moisture_lag{i}": g.shift(i) for i in range(LAGS)}
+    cols["temperature"] = df["temperature"]
+    cols["humidity"] = df["humidity"]
+    target = g.shift(-HORIZON)
+    import pandas as pd
+    frame = pd.DataFrame(cols)
+    mask = frame[[f"moisture_lag{i}" for i in range(LAGS)]].notna().all(axis=1) & target.notna()
+    devices = df["device_id"][mask]
+    position = devices.groupby(devices, sort=False).cumcount()  # 0 = oldest sample of its device
+    count = devices.map(devices.value_counts())
+    is_holdout = (position >= count - (count * holdout).astype(int)).to_numpy()
+    return frame[mask].to_numpy(dtype=float), target[mask].to_numpy(dtype=float), is_holdout
+
+
+def train(conn=None, max_rows=MAX_TRAIN_ROWS, path=MODEL_PATH):
+    """Fit on sensor_data history, save with joblib and make it the live model."""
+    import joblib
+    from sklearn.impute import SimpleImputer
+    from sklearn.linear_model import Ridge
+    from sklearn.metrics import mean_absolute_error
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from database import get_conn
+
+    started = time.perf_counter()
+    if conn is None:
+        with get_conn() as conn:
+            df = _training_frame(conn, max_rows)
+    else:
+        df = _training_frame(conn, max_rows)
+    X, y, test = build_dataset(df, holdout=0.2)
+    if len(y) < 20:
+        raise ValueError(
+            f"Not enough history to train: need at least 20 samples, each {LAGS + HORIZON} consecutive readings of one zone")
+
+    # Hold out each device's newest 20% for an honest forecast error estimate
+    pipeline = make_pipeline(SimpleImputer(strategy="mean"), StandardScaler(), Ridge(alpha=1.0))
+    mae = None
+    if test.any() and not test.all():
+        pipeline.fit(X[~test], y[~test])
+        mae = float(mean_absolute_error(y[test], pipeline.predict(X[test])))
+    pipeline.fit(X, y)
+
+    meta = {
+        "features": FEATURES,
+        "lags": LAGS,
+        "horizon": HORIZON,
+        "samples": int(len(y)),
+        "devices": int(df["device_id"].nunique()),
+        "holdout_mae": mae,
+        "trained_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        "train_seconds": round(time.perf_counter() - started, 3),
+    }
+    model = {"pipeline": pipeline, "meta": meta}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(model, path)
+    global _model
+    with _model_lock:
+        _model = model
+    return meta
+
+
+def load_model(path=MODEL_PATH):
+    """Load the persisted model once; returns its metadata or None if there is none."""
+    global _model
+    with _model_lock:
+        if _model is None and os.path.exists(path):
+            import joblib
+            _model = joblib.load(path)
+        return _model["meta"] if _model else None
+
+
+def model_info():
+    return _model["meta"] if _model else None
+
+
+def predict_batch(histories):
+    """Forecast moisture for many zones in one call; None if no model is loaded.
+
+    `histories` is a list of per-zone reading lists (oldest -> newest).
+    """
+    model = _model
+    if model is None or not histories:
+        return None
+    return model["pipeline"].predict(_feature_rows(histories)).tolist()
+
+
+def benchmark(batch_sizes=(1, 10, 100, 1000), repeats=200):
+    """Mean predict_batch() latency in ms per call, by batch size."""
+    if _model is None:
+        raise RuntimeError("No model loaded")
+    rng = np.random.default_rng(0)
+    results = {}
+    for n in batch_sizes:
+        histories = [
+            [{"soil_moisture": float(m), "temperature": 25.0, "humidity": 60.0} for m in rng.uniform(200, 800, LAGS)]
+            for _ in range(n)
+        ]
+        predict_batch(histories)  # warm-up
+        started = time.perf_counter()
+        for _ in range(repeats):
+            predict_batch(histories)
+        results[n] = round((time.perf_counter() - started) / repeats * 1e3, 4)
+    return results
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Train or benchmark the soil-moisture forecaster.")
+    parser.add_argument("command", choices=["train", "bench"])
+    parser.add_argument("--db", default=None, help="SQLite file to use instead of backend/irrigation.db")
+    args = parser.parse_args(argv)
+
+    import database
+    if args.db:
+        database.DB_PATH = os.path.abspath(args.db)
+    if args.command == "train":
+        database.init_db()
+        print(json.dumps(train(), indent=2))
+    else:
+        if load_model() is None:
+            raise SystemExit("No trained model; run `python backend/ml_model.py train` first")
+        print(json.dumps({"ms_per_call_by_batch_size": benchmark()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
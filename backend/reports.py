@@ -0,0 +1,216 @@
+# backend/reports.py
+# Daily/weekly report rows, streamed CSV export and background PDF rendering.
+#
+# Rows are produced lazily from the rollup cursor, so a CSV export is written
+# to the client line by line. PDFs are rendered by one worker thread and
+# cached on disk under <db name>_reports/, keyed on (range, data version): the
+# same report is never rendered twice, and new data simply yields a new key.
+# Job state is kept on disk with the PDF, so every worker process sees it.
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from database import get_conn
+import rollups
+
+RANGES = ("daily", "weekly")
+CSV_COLUMNS = ["bucket", "avg_soil_moisture", "avg_temperature", "avg_humidity", "total_liters"]
+STALE_AFTER = 600     # seconds before a queued/running job whose worker went away counts as failed
+
+
+def _fmt(range_key):
+    return "%Y-%W" if range_key == "weekly" else "%Y-%m-%d"
+
+
+def iter_report(range_key="daily"):
+    """Report rows, oldest first, read from the daily rollups as they stream.
+
+    Weeks are merged from consecutive days; water totals come from a small
+    per-day map (one entry per day with usage).
+    """
+    fmt = _fmt(range_key)
+    water_map = {}
+    for bucket, liters in rollups.water_buckets(rollups.DAY):
+        key = rollups.label(bucket, fmt)
+        water_map[key] = water_map.get(key, 0) + (liters or 0)
+
+    days = ((rollups.label(row["bucket"], fmt), row) for row in rollups.iter_sensor_buckets(rollups.DAY))
+    for label, group in itertools.groupby(days, key=lambda item: item[0]):
+        acc = {}
+        for _, row in group:
+            for field, value in row.items():
+                if field.endswith(("_n", "_sum")):
+                    acc[field] = acc.get(field, 0) + (value or 0)
+        yield {
+            "bucket": label,
+            "avg_soil_moisture": rollups.avg(acc, "moisture") or 0,
+            "avg_temperature": rollups.avg(acc, "temperature") or 0,
+            "avg_humidity": rollups.avg(acc, "humidity") or 0,
+            "total_liters": water_map.get(label, 0),
+        }
+
+
+def iter_csv(rows):
+    """CSV text, one chunk per row (header first)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_COLUMNS)
+    yield buf.getvalue()
+    for r in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([r[c] for c in CSV_COLUMNS])
+        yield buf.getvalue()
+
+
+def data_version():
+    """Changes whenever a report could: newest sensor/water row ids."""
+    with get_conn() as conn:
+        sensor = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sensor_data").fetchone()[0]
+        water = conn.execute("SELECT COALESCE(MAX(id), 0) FROM water_usage").fetchone()[0]
+    return f"{sensor}-{water}"
+
+
+def render_pdf(rows, path):
+    """Write the report as a PDF (reportlab) to `path`, atomically."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    tmp = path + ".tmp"
+    cpdf = canvas.Canvas(tmp, pagesize=letter)
+    cpdf.setFont("Helvetica", 12)
+    y = 750
+    cpdf.drawString(50, y, "Smart Irrigation Report")
+    y -= 30
+    for r in rows:
+        line = f"{r['bucket']}: Moist {r['avg_soil_moisture']:.1f}, Temp {r['avg_temperature']:.1f}C, Hum {r['avg_humidity']:.1f}%, Liters {r['total_liters']:.1f}"
+        cpdf.drawString(50, y, line)
+        y -= 18
+        if y < 50:
+            cpdf.showPage(); y = 750
+    cpdf.save()
+    os.replace(tmp, path)
+
+
+def cache_dir():
+    return os.path.splitext(database.DB_PATH)[0] + "_reports"
+
+
+class PdfJobs:
+    """Submit/poll/download PDF renders, one at a time on a worker thread.
+
+    A job is identified by what it renders: its id is "<range>-<data version>"
+    and its state lives next to the PDF in a small JSON file, so any worker
+    process can answer a poll or a download, not only the one rendering it.
+    """
+
+    _ID = re.compile(r"^(daily|weekly)-(\d+-\d+)$")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _path(self, range_key, version, ext="pdf"):
+        return os.path.join(cache_dir(), f"report-{range_key}-{version}.{ext}")
+
+    def _write_state(self, job):
+        path = self._path(job["range"], job["version"], "json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({k: job[k] for k in ("status", "error", "submitted_at", "finished_at")}, f)
+        os.replace(tmp, path)
+
+    def _claim(self, job):
+        """Create the job's state file unless it exists; True if this process got it."""
+        try:
+            fd = os.open(self._path(job["range"], job["version"], "json"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.close(fd)
+        self._write_state(job)
+        return True
+
+    def submit(self, range_key):
+        """Job for the current data; an existing render or cached file is reused."""
+        range_key = "weekly" if range_key == "weekly" else "daily"
+        version = data_version()
+        os.makedirs(cache_dir(), exist_ok=True)
+        job_id = f"{range_key}-{version}"
+        with self._lock:
+            job = self.get(job_id)
+            if job is not None and job["status"] != "failed":
+                return job
+            retry = job is not None
+            job = {"id": job_id, "range": range_key, "version": version, "status": "queued",
+                   "error": None, "submitted_at": time.time(), "finished_at": None}
+            if retry:
+                self._write_state(job)
+            elif not self._claim(job):  # another worker just submitted it
+                return self.get(job_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf-report")
+            self._executor.submit(self._run, dict(job))
+            return job
+
+    def _run(self, job):
+        job["status"] = "running"
+        self._write_state(job)
+        path = self._path(job["range"], job["version"])
+        try:
+            render_pdf(iter_report(job["range"]), path)
+            self._evict(job["range"], keep=job["version"])
+            status, error = "done", None
+        except Exception as e:
+            status, error = "failed", str(e)
+        job.update(status=status, error=error, finished_at=time.time())
+        self._write_state(job)
+
+    def _evict(self, range_key, keep):
+        """Older versions of a range can never be served again; drop their files."""
+        pattern = re.compile(rf"^report-{range_key}-(\d+)-(\d+)\.")
+        newest = tuple(int(n) for n in keep.split("-"))
+        for name in os.listdir(cache_dir()):
+            m = pattern.match(name)
+            if m and tuple(int(n) for n in m.groups()) < newest:
+                try:
+                    os.remove(os.path.join(cache_dir(), name))
+                except OSError:
+                    pass
+
+    def get(self, job_id):
+        """The job's current state, from disk; None if it was never submitted."""
+        m = self._ID.match(job_id)
+        if m is None:
+            return None
+        range_key, version = m.groups()
+        job = {"id": job_id, "range": range_key, "version": version, "status": None,
+               "error": None, "submitted_at": None, "finished_at": None}
+        try:
+            with open(self._path(range_key, version, "json")) as f:
+                job.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except ValueError:  # created by _claim(), not written yet
+            job["status"] = "queued"
+        if job["status"] != "done" and os.path.exists(self._path(range_key, version)):
+            job["status"] = "done"  # rendered by an earlier process
+        if job["status"] is None:
+            return None
+        elif job["status"] in ("queued", "running") and time.time() - (job["submitted_at"] or 0) > STALE_AFTER:
+            job.update(status="failed", error="render did not finish (worker stopped?)")
+        return job
+
+    def file_for(self, job):
+        """Path of a finished job's PDF, or None if it is not (or no longer) available."""
+        path = self._path(job["range"], job["version"])
+        return path if job["status"] == "done" and os.path.exists(path) else None
+
+
+jobs = PdfJobs()
@@ -0,0 +1,247 @@
+# backend/rollups.py
+# Hourly/daily rollups of sensor_data and water_usage.
+#
+# compact_rollups() folds raw rows with id > rollup_state.last_id into the
+# rollup tables. Readers combine the rollups with the raw "tail" (rows not
+# yet compacted) in a single statement, so answers are exact whether or not
+# compaction has run, and their cost stays proportional to the number of
+# buckets instead of the number of raw rows.
+#
+# Column names of the unions below come from their first (rollup) SELECT, and
+# the tail filter uses +ts so SQLite walks the id range rather than the ts index.
+# Archived sensor rows (archive.py) are always compacted first, so the rollups
+# keep their history; only a raw partial first bucket has to look at the archive.
+import datetime
+import threading
+
+from database import get_conn
+import archive
+
+HOUR = 3600
+DAY = 86400
+WIDTHS = (HOUR, DAY)
+
+_PUMP_ON = "CASE WHEN pump_status IN ('ON',1) THEN 1 ELSE 0 END"
+_SENSOR_COLS = (("moisture", "soil_moisture"), ("temperature", "temperature"), ("humidity", "humidity"))
+
+# Column order of every sensor aggregate row produced below
+SENSOR_FIELDS = ["bucket", "n", "pump_on"] + [
+    f"{name}_{stat}" for name, _ in _SENSOR_COLS for stat in ("n", "sum", "min", "max")
+]
+
+
+def _raw_sensor_agg(width, where):
+    stats = ", ".join(
+        f"COUNT({col}), SUM({col}), MIN({col}), MAX({col})" for _, col in _SENSOR_COLS
+    )
+    return f"""
+        SELECT (ts / {width}) * {width} AS bucket, COUNT(*), SUM({_PUMP_ON}), {stats}
+        FROM sensor_data
+        WHERE ts IS NOT NULL AND {where}
+        GROUP BY ts / {width}
+    """
+
+
+def _raw_water_agg(width, where):
+    return f"""
+        SELECT (ts / {width}) * {width} AS bucket, COUNT(*), SUM(liters_used)
+        FROM water_usage
+        WHERE ts IS NOT NULL AND {where}
+        GROUP BY ts / {width}
+    """
+
+
+def _merge_min(col):
+    return f"CASE WHEN excluded.{col} IS NULL THEN {col} WHEN {col} IS NULL THEN excluded.{col} ELSE MIN({col}, excluded.{col}) END"
+
+
+def _merge_max(col):
+    return f"CASE WHEN excluded.{col} IS NULL THEN {col} WHEN {col} IS NULL THEN excluded.{col} ELSE MAX({col}, excluded.{col}) END"
+
+
+def _merge_sum(col):
+    return f"COALESCE({col}, 0) + COALESCE(excluded.{col}, 0)"
+
+
+def _sensor_upsert(width):
+    cols = SENSOR_FIELDS
+    updates = ["n = n + excluded.n", "pump_on = pump_on + excluded.pump_on"]
+    for name, _ in _SENSOR_COLS:
+        updates.append(f"{name}_n = {name}_n + excluded.{name}_n")
+        updates.append(f"{name}_sum = {_merge_sum(name + '_sum')}")
+        updates.append(f"{name}_min = {_merge_min(name + '_min')}")
+        updates.append(f"{name}_max = {_merge_max(name + '_max')}")
+    return f"""
+        INSERT INTO sensor_rollup (width, {", ".join(cols)})
+        SELECT {width}, * FROM ({_raw_sensor_agg(width, "id > :lo AND id <= :hi")}) WHERE true
+        ON CONFLICT (width, bucket) DO UPDATE SET {", ".join(updates)}
+    """
+
+
+def _water_upsert(width):
+    return f"""
+        INSERT INTO water_rollup (width, bucket, n, liters)
+        SELECT {width}, * FROM ({_raw_water_agg(width, "id > :lo AND id <= :hi")}) WHERE true
+        ON CONFLICT (width, bucket) DO UPDATE SET n = n + excluded.n, liters = {_merge_sum("liters")}
+    """
+
+
+def compact_rollups():
+    """Fold newly inserted raw rows into the rollup tables; returns rows folded."""
+    folded = 0
+    with get_conn() as conn:
+        # IMMEDIATE takes the write lock up front so two compactors can't fold the same ids
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for source, upsert in (("sensor_data", _sensor_upsert), ("water_usage", _water_upsert)):
+                lo = conn.execute("SELECT last_id FROM rollup_state WHERE source = ?", (source,)).fetchone()[0]
+                hi = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {source}").fetchone()[0]
+                if hi <= lo:
+                    continue
+                for width in WIDTHS:
+                    conn.execute(upsert(width), {"lo": lo, "hi": hi})
+                conn.execute("UPDATE rollup_state SET last_id = ? WHERE source = ?", (hi, source))
+                folded += hi - lo
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return folded
+
+
+def _window(width, since):
+    """Split [since, now) into a raw head (partial first bucket) and a bucket-aligned rest."""
+    if since is None:
+        return None, None
+    aligned = -(-since // width) * width
+    return since, aligned
+
+
+def _sensor_buckets_sql(width, since):
+    head, aligned = _window(width, since)
+    rollup_cols = ", ".join(SENSOR_FIELDS)
+    parts = [
+        f"SELECT {rollup_cols} FROM sensor_rollup WHERE width = {width} AND bucket >= :aligned",
+        _raw_sensor_agg(width, "id > (SELECT last_id FROM rollup_state WHERE source = 'sensor_data') AND +ts >= :aligned"),
+    ]
+    if head is not None and head < aligned:
+        parts.append(_raw_sensor_agg(width, "ts >= :head AND ts < :aligned"))
+    outer = ["bucket", "SUM(n)", "SUM(pump_on)"]
+    for name, _ in _SENSOR_COLS:
+        outer += [f"SUM({name}_n)", f"SUM({name}_sum)", f"MIN({name}_min)", f"MAX({name}_max)"]
+    union = " UNION ALL ".join(parts)
+    sql = f"""
+        SELECT {", ".join(outer)}
+        FROM ({union})
+        GROUP BY bucket
+        ORDER BY bucket ASC
+    """
+    params = {"aligned": aligned if aligned is not None else -(2 ** 62), "head": head}
+    return sql, params
+
+
+def sensor_buckets(width, since=None):
+    """Per-bucket sensor aggregates (dicts keyed by SENSOR_FIELDS) for ts >= since, oldest first."""
+    sql, params = _sensor_buckets_sql(width, since)
+    with get_conn() as conn:
+        rows = [dict(zip(SENSOR_FIELDS, r)) for r in conn.execute(sql, params).fetchall()]
+    head, aligned = _window(width, since)
+    if head is not None and head < aligned:
+        # the partial first bucket is read from raw rows, some of which may be archived
+        extra = archive.sensor_aggregates(width, head, aligned)
+        if extra:
+            rows = _combine_sensor_rows(rows, extra)
+    return rows
+
+
+def iter_sensor_buckets(width, chunk=500):
+    """Like sensor_buckets() over the whole history, but yielded from the cursor as it is read."""
+    sql, params = _sensor_buckets_sql(width, None)
+    with get_conn() as conn:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            for r in rows:
+                yield dict(zip(SENSOR_FIELDS, r))
+
+
+def _combine_sensor_rows(rows, extra):
+    """Merge two bucket-sorted lists of SENSOR_FIELDS dicts."""
+    merged = {r["bucket"]: dict(r) for r in rows}
+    for r in extra:
+        acc = merged.get(r["bucket"])
+        if acc is None:
+            merged[r["bucket"]] = dict(r)
+            continue
+        for field, value in r.items():
+            if field == "bucket" or value is None:
+                continue
+            if acc.get(field) is None:
+                acc[field] = value
+            elif field.endswith("_min"):
+                acc[field] = min(acc[field], value)
+            elif field.endswith("_max"):
+                acc[field] = max(acc[field], value)
+            else:
+                acc[field] += value
+    return [merged[b] for b in sorted(merged)]
+
+
+def water_buckets(width, since=None):
+    """[(bucket_epoch, liters)] for ts >= since, oldest first."""
+    head, aligned = _window(width, since)
+    parts = [
+        f"SELECT bucket, n, liters FROM water_rollup WHERE width = {width} AND bucket >= :aligned",
+        _raw_water_agg(width, "id > (SELECT last_id FROM rollup_state WHERE source = 'water_usage') AND +ts >= :aligned"),
+    ]
+    if head is not None and head < aligned:
+        parts.append(_raw_water_agg(width, "ts >= :head AND ts < :aligned"))
+    sql = f"""
+        SELECT bucket, SUM(liters)
+        FROM ({" UNION ALL ".join(parts)})
+        GROUP BY bucket
+        ORDER BY bucket ASC
+    """
+    params = {"aligned": aligned if aligned is not None else -(2 ** 62), "head": head}
+    with get_conn() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def avg(row, name):
+    n = row.get(f"{name}_n") or 0
+    return (row[f"{name}_sum"] / n) if n else None
+
+
+def label(bucket, fmt):
+    return datetime.datetime.utcfromtimestamp(bucket).strftime(fmt)
+
+
+# --- Background compaction ---
+_compactor = None
+_compactor_stop = threading.Event()
+
+
+def start_compactor(interval=30):
+    """Run compact_rollups() every `interval` seconds on a daemon thread."""
+    global _compactor
+    if _compactor is not None and _compactor.is_alive():
+        return
+
+    def loop():
+        while True:
+            try:
+                compact_rollups()
+            except Exception as e:
+                print(f"[rollups] compaction failed: {e}")
+            if _compactor_stop.wait(interval):
+                break
+
+    _compactor_stop.clear()
+    _compactor = threading.Thread(target=loop, name="rollup-compactor", daemon=True)
+    _compactor.start()
+
+
+def stop_compactor():
+    _compactor_stop.set()
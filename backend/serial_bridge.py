@@ -0,0 +1,338 @@
+# backend/serial_bridge.py
+# Serial ingestion for a USB-attached NodeMCU (e.g. on a gateway Pi), without
+# going through HTTP.
+#
+# A reader thread pulls bytes off the port and splits them into records
+# (newline-terminated lines, or the 20-byte frames of gateway.py) into a
+# bounded ring buffer; when the buffer is full the oldest records are
+# overwritten and counted as overruns. A writer thread drains it in batches,
+# parses them and stores each batch with hardware.ingest_readings() - one
+# transaction, same validation and pump rule as POST /api/hardware/batch.
+# A lost port is reopened with exponential backoff.
+#
+# Line records are either a JSON object ({"device_id": "zone-1",
+# "soil_moisture": 512, ...}) or CSV "device_id,soil_moisture[,temperature
+# [,humidity[,timestamp]]]"; lines starting with '#' are ignored as debug output.
+#
+#   python backend/serial_bridge.py run --port /dev/ttyUSB0 --baud 115200
+#   python backend/serial_bridge.py fake-device --link /tmp/ttyFAKE --rate 500   # pty stand-in
+#
+# app.py starts the bridge in-process when IRRIGATION_SERIAL_PORT is set
+# (IRRIGATION_SERIAL_BAUD, IRRIGATION_SERIAL_FORMAT optional).
+import collections
+import json
+import os
+import threading
+import time
+
+import database
+import gateway
+
+RING_CAPACITY = 50_000     # records buffered between the reader and the writer
+BATCH_SIZE = 2000          # records per transaction
+FLUSH_INTERVAL = 0.1       # max seconds a record waits for its batch
+READ_TIMEOUT = 0.2
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 10.0
+MAX_LINE = 4096            # longer "lines" are noise; dropped
+
+
+def parse_line(line):
+    """Reading dict from one text line; None for comments/blank, ValueError if unusable."""
+    text = line.decode("utf-8", "replace").strip()
+    if not text or text.startswith("#"):
+        return None
+    if text.startswith("{"):
+        reading = json.loads(text)
+        if not isinstance(reading, dict):
+            raise ValueError("expected a JSON object")
+        return reading
+    fields = [f.strip() for f in text.split(",")]
+    if len(fields) < 2:
+        raise ValueError(f"unrecognised line: {text[:60]!r}")
+    reading = {"device_id": fields[0] or None}
+    for name, value in zip(("soil_moisture", "temperature", "humidity"), fields[1:4]):
+        reading[name] = value if value != "" else None
+    if len(fields) > 4 and fields[4]:
+        ts = fields[4]
+        reading["timestamp"] = int(ts) if ts.isdigit() else ts
+    return reading
+
+
+class SerialBridge:
+    def __init__(self, port, baudrate=115200, fmt="line", capacity=RING_CAPACITY,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        if fmt not in ("line", "frame"):
+            raise ValueError("format must be 'line' or 'frame'")
+        self.port = port
+        self.baudrate = baudrate
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._ring = collections.deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()      # reader
+        self._closing = threading.Event()   # writer: drain and exit
+        self._threads = []
+        self.connected = False
+        self.stats = {
+            "records": 0, "ingested": 0, "rejected": 0, "overruns": 0,
+            "batches": 0, "errors": 0, "connects": 0, "disconnects": 0,
+        }
+
+    # --- lifecycle ---
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self._closing.clear()
+        self._threads = [
+            threading.Thread(target=self._read_loop, name="serial-reader", daemon=True),
+            threading.Thread(target=self._write_loop, name="serial-writer", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout=5):
+        """Stop reading, then write whatever is still buffered."""
+        self._stop.set()
+        reader, writer = self._threads or (None, None)
+        if reader is not None:
+            reader.join(timeout)
+        self._closing.set()
+        with self._cond:
+            self._cond.notify_all()
+        if writer is not None:
+            writer.join(timeout)
+        self._threads = []
+
+    # --- reader ---
+    def _open(self):
+        import serial  # pyserial; only needed once a port is actually opened
+        # exclusive: a second reader (another process, a second bridge) would
+        # get a share of the bytes and split records; it keeps retrying instead
+        return serial.serial_for_url(self.port, baudrate=self.baudrate, timeout=READ_TIMEOUT, exclusive=True)
+
+    def _read_loop(self):
+        backoff = RECONNECT_MIN
+        while not self._stop.is_set():
+            try:
+                port = self._open()
+            except Exception as e:  # serial.SerialException / OSError: not there (yet)
+                if backoff == RECONNECT_MIN:
+                    print(f"[serial] cannot open {self.port}: {e}; retrying")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_MAX)
+                continue
+            backoff = RECONNECT_MIN
+            self.connected = True
+            self.stats["connects"] += 1
+            rest = b""
+            synced = self.fmt == "frame"  # frames resync by themselves; lines skip the first partial one
+            try:
+                while not self._stop.is_set():
+                    chunk = port.read(max(1, port.in_waiting))
+                    if chunk and not synced:
+                        cut = chunk.find(b"\n")
+                        chunk = chunk[cut + 1:] if cut >= 0 else b""
+                        synced = cut >= 0
+                    if chunk:
+                        rest = self._split(rest + chunk if rest else chunk)
+            except Exception as e:
+                print(f"[serial] {self.port} lost: {e}")
+                self.stats["disconnects"] += 1
+            finally:
+                self.connected = False
+                try:
+                    port.close()
+                except Exception:
+                    pass
+
+    def _split(self, data):
+        """Push complete records into the ring; returns the unfinished tail."""
+        if self.fmt == "line":
+            *records, rest = data.split(b"\n")
+            if len(rest) > MAX_LINE:
+                rest = b""
+            records = [r for r in records if len(r) <= MAX_LINE]
+        else:
+            records, rest = self._frames(data)
+        if records:
+            with self._cond:
+                overflow = len(self._ring) + len(records) - self._ring.maxlen
+                if overflow > 0:
+                    self.stats["overruns"] += overflow  # oldest records are overwritten
+                self._ring.extend(records)
+                self.stats["records"] += len(records)
+                if len(self._ring) >= self.batch_size:
+                    self._cond.notify()
+        return rest
+
+    @staticmethod
+    def _frames(data):
+        """Whole gateway frames; resyncs a byte at a time if the stream is misaligned."""
+        size = gateway.FRAME.size
+        records = []
+        i = 0
+        while len(data) - i >= size:
+            if data[i] == gateway.VERSION and data[i + 1] == 0:
+                records.append(data[i:i + size])
+                i += size
+            else:
+                i += 1
+        return records, data[i:]
+
+    # --- writer ---
+    def _take(self):
+        with self._cond:
+            n = min(len(self._ring), self.batch_size)
+            return [self._ring.popleft() for _ in range(n)]
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                if len(self._ring) < self.batch_size and not self._closing.is_set():
+                    self._cond.wait(self.flush_interval)
+                stopping = self._closing.is_set()
+            while True:
+                batch = self._take()
+                if not batch:
+                    break
+                try:
+                    self._persist(batch)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    print(f"[serial] dropped batch of {len(batch)} records: {e}")
+                if len(batch) < self.batch_size:
+                    break
+            if stopping:
+                return
+
+    def _persist(self, batch):
+        import hardware
+
+        if self.fmt == "frame":
+            readings, rejected = gateway.decode(b"".join(batch))
+        else:
+            readings, rejected = [], 0
+            for line in batch:
+                try:
+                    reading = parse_line(line)
+                except ValueError:
+                    rejected += 1
+                    continue
+                if reading is not None:
+                    readings.append(reading)
+        self.stats["rejected"] += rejected
+        if readings:
+            accepted, errors = hardware.ingest_readings(readings)
+            self.stats["ingested"] += len(accepted)
+            self.stats["rejected"] += len(errors)
+            self.stats["batches"] += 1
+
+    def status(self):
+        with self._cond:
+            buffered = len(self._ring)
+        return dict(self.stats, port=self.port, connected=self.connected, buffered=buffered)
+
+
+def from_env():
+    """Bridge configured by IRRIGATION_SERIAL_* variables, or None."""
+    port = os.environ.get("IRRIGATION_SERIAL_PORT")
+    if not port:
+        return None
+    return SerialBridge(
+        port,
+        baudrate=int(os.environ.get("IRRIGATION_SERIAL_BAUD", "115200")),
+        fmt=os.environ.get("IRRIGATION_SERIAL_FORMAT", "line"),
+    )
+
+
+# --- Pseudo-terminal stand-in for a NodeMCU ---
+def fake_device(link=None, rate=100.0, devices=4, fmt="line", duration=None, seed=0):
+    """Open a pty and write readings to it at `rate` records/s; the bridge reads the other end.
+
+    `link` is a stable path (symlink to the pty) the bridge can be pointed at;
+    a second fake device started with the same link stands in for a replugged board.
+    """
+    import pty  # Unix only
+    import random
+    import tty
+
+    rng = random.Random(seed)
+    master, slave = pty.openpty()
+    path = os.ttyname(slave)
+    tty.setraw(slave)  # no echo/line discipline; bytes go through untouched
+    if link:
+        tmp = link + ".tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(path, tmp)
+        os.replace(tmp, link)
+    print(f"fake device on {path}" + (f" ({link})" if link else ""), flush=True)
+    level = [rng.uniform(350, 750) for _ in range(devices)]
+    started = time.monotonic()
+    sent = 0
+    try:
+        while duration is None or time.monotonic() - started < duration:
+            k = sent % devices
+            level[k] = level[k] - rng.uniform(0, 2) if level[k] > 330 else 760.0
+            temp, hum = 22 + rng.gauss(0, 1), 60 + rng.gauss(0, 5)
+            if fmt == "frame":
+                record = gateway.encode(f"tty-{k}", 0, level[k], temp, hum)
+            else:
+                record = f"tty-{k},{level[k]:.1f},{temp:.2f},{hum:.2f}\n".encode()
+            os.write(master, record)
+            sent += 1
+            delay = started + sent / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        time.sleep(1.0)  # closing the master discards unread bytes; give the reader time to drain
+        os.close(master)
+        os.close(slave)
+    print(f"sent {sent:,} records", flush=True)
+    return sent
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ingest NodeMCU readings from a serial port.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="read a serial port into the database")
+    run.add_argument("--port", required=True, help="device path or pyserial URL (e.g. /dev/ttyUSB0)")
+    run.add_argument("--baud", type=int, default=115200)
+    run.add_argument("--format", choices=["line", "frame"], default="line")
+    run.add_argument("--db", default=None, help="SQLite file to use instead of backend/irrigation.db")
+    run.add_argument("--stats-interval", type=float, default=10.0)
+    fake = sub.add_parser("fake-device", help="pty stand-in for a NodeMCU")
+    fake.add_argument("--link", default=None, help="symlink to create for the pty (stable port path)")
+    fake.add_argument("--rate", type=float, default=100.0, help="records per second")
+    fake.add_argument("--devices", type=int, default=4)
+    fake.add_argument("--format", choices=["line", "frame"], default="line")
+    fake.add_argument("--duration", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "fake-device":
+        fake_device(args.link, args.rate, args.devices, args.format, args.duration)
+        return
+    if args.db:
+        database.DB_PATH = os.path.abspath(args.db)
+    database.init_db()
+    bridge = SerialBridge(args.port, args.baud, args.format)
+    bridge.start()
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print("[serial] " + "  ".join(f"{k} {v}" for k, v in bridge.status().items()), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bridge.stop()
+
+
+if __name__ == "__main__":
+    main()
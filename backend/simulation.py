@@ -0,0 +1,466 @@
+# backend/simulation.py
+# Simulation data sources: lazy, chunked replay of recorded CSV files, plus a
+# scheduler that runs many zone sessions off one clock thread, and a headless
+# fast-forward mode (also usable as a CLI: python backend/simulation.py -h).
+import collections
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+DEFAULT_SOURCE = "sample_data.csv"
+
+# Columns read from a replay CSV and their dtypes (anything else in the file is ignored)
+CSV_DTYPES = {
+    "timestamp": "string",
+    "soil_moisture": "float64",
+    "temperature": "float64",
+    "humidity": "float64",
+}
+CHUNK_ROWS = 1000
+
+
+def resolve_source(name=None):
+    """Absolute path of a CSV inside DATA_DIR; raises ValueError/FileNotFoundError."""
+    name = name or DEFAULT_SOURCE
+    path = os.path.abspath(os.path.join(DATA_DIR, name))
+    if os.path.dirname(path) != DATA_DIR or not path.endswith(".csv"):
+        raise ValueError(f"Invalid simulation source: {name}")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"CSV not found at {path}")
+    return path
+
+
+def list_sources():
+    return sorted(f for f in os.listdir(DATA_DIR) if f.endswith(".csv"))
+
+
+def count_rows(path, block=1 << 20):
+    """Data rows in a CSV (lines minus header) without parsing it."""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(block)
+            if not buf:
+                break
+            lines += buf.count(b"\n")
+            last = buf[-1:]
+    if last != b"\n":
+        lines += 1  # final line without a trailing newline
+    return max(lines - 1, 0)
+
+
+def _finite(value, name):
+    """float(value); ValueError for NaN/inf, which would poison comparisons and due times."""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a finite number")
+    return number
+
+
+def _clean(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+class CsvReplay:
+    """Iterate a CSV as row dicts, reading CHUNK_ROWS rows at a time.
+
+    Only the current chunk is held in memory; `total` is counted up front
+    so progress reporting stays exact for any file size.
+    """
+
+    def __init__(self, path, chunksize=CHUNK_ROWS):
+        self.path = path
+        self.chunksize = chunksize
+        self.total = count_rows(path)
+        header = pd.read_csv(path, nrows=0).columns
+        missing = [c for c in CSV_DTYPES if c not in header]
+        if missing:
+            raise ValueError(f"{os.path.basename(path)} is missing columns: {', '.join(missing)}")
+
+    def chunks(self):
+        """DataFrames of at most `chunksize` rows, typed per CSV_DTYPES."""
+        return pd.read_csv(
+            self.path,
+            usecols=list(CSV_DTYPES),
+            dtype=CSV_DTYPES,
+            chunksize=self.chunksize,
+        )
+
+    def __iter__(self):
+        columns = list(CSV_DTYPES)
+        with self.chunks() as reader:
+            for chunk in reader:
+                for values in chunk.itertuples(index=False, name=None):
+                    yield {col: _clean(v) for col, v in zip(columns, values)}
+
+
+
+# --- Multi-zone scheduler ---
+MAX_SPEED = 1000.0  # rows per second per session
+HISTORY_ROWS = 16   # recent rows kept per session (forecast features)
+
+
+class SimulationSession:
+    """One zone replaying one CSV at its own threshold and speed."""
+
+    def __init__(self, session_id, path, threshold=None, speed=1.0, device_id=None):
+        speed = _finite(speed, "speed")
+        if speed <= 0 or speed > MAX_SPEED:
+            raise ValueError(f"speed must be between 0 and {MAX_SPEED:g} rows/s")
+        self.id = session_id
+        self.path = path
+        self.threshold = None if threshold is None else _finite(threshold, "threshold")  # None -> saved setting
+        self.speed = speed
+        self.device_id = device_id
+        self.replay = CsvReplay(path)
+        self.total = self.replay.total
+        self.index = 0
+        self.current_row = None
+        self.pump_status = "OFF"
+        self.status = "running"  # running | stopped | completed | failed
+        self.error = None
+        self.history = collections.deque(maxlen=HISTORY_ROWS)
+        self._rows = iter(self.replay)
+
+    @property
+    def running(self):
+        return self.status == "running"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "source": os.path.basename(self.path),
+            "status": self.status,
+            "running": self.running,
+            "threshold": self.threshold,
+            "speed": self.speed,
+            "device_id": self.device_id,
+            "index": self.index,
+            "total": self.total,
+            "pump_status": self.pump_status,
+            "current_row": self.current_row,
+            "error": self.error,
+        }
+
+
+class SimulationScheduler:
+    """Drives any number of sessions from one clock thread.
+
+    Sessions sit in a heap keyed by their next due time; the clock sleeps
+    until the earliest one is due, then steps every due session by one row
+    and re-queues them. `prepare(pairs)`, if given, sees all of a tick's
+    (session, row) pairs at once before they are processed, so per-row work
+    that batches well (model inference) runs once per tick rather than once
+    per zone. `process_row(session, row)` does the per-row work (pump logic,
+    persistence, events) and `on_finish(session)` runs when a session ends.
+    """
+
+    def __init__(self, process_row, on_finish=None, prepare=None):
+        self.process_row = process_row
+        self.on_finish = on_finish
+        self.prepare = prepare
+        self.sessions = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self, session):
+        with self._cond:
+            old = self.sessions.get(session.id)
+            if old is not None and old.running:
+                raise ValueError(f"Session {session.id} is already running")
+            self.sessions[session.id] = session
+            heapq.heappush(self._heap, (time.monotonic(), next(self._seq), session))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="simulation-clock", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return session
+
+    def stop(self, session_id):
+        """Stop a session; returns it (or None). It leaves the heap on its next due time."""
+        with self._cond:
+            session = self.sessions.get(session_id)
+            if session is not None and session.running:
+                session.status = "stopped"
+                finished = True
+            else:
+                finished = False
+        if finished and self.on_finish:
+            self.on_finish(session)
+        return session
+
+    def stop_all(self):
+        for session_id in list(self.sessions):
+            self.stop(session_id)
+
+    def remove(self, session_id):
+        self.stop(session_id)
+        with self._cond:
+            return self.sessions.pop(session_id, None)
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def running_count(self):
+        return sum(1 for s in list(self.sessions.values()) if s.running)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+            due = [(t, s) for t, _, s in due if s.running and self.sessions.get(s.id) is s]
+            pairs = []
+            for _, session in due:
+                row = self._next_row(session)
+                if row is not None:
+                    pairs.append((session, row))
+            if pairs and self.prepare:
+                try:
+                    self.prepare(pairs)
+                except Exception:
+                    pass  # extras only; the rows still go through process_row
+            for session, row in pairs:
+                self._step(session, row)
+            instrumentation.simulation_ticks.inc(n=len(pairs))
+            now = time.monotonic()
+            with self._cond:
+                for t, session in due:
+                    if session.running:
+                        # if the clock fell behind, don't burst to catch up
+                        next_due = max(t + 1.0 / session.speed, now)
+                        heapq.heappush(self._heap, (next_due, next(self._seq), session))
+
+    def _finish(self, session, status, error=None):
+        session.status = status
+        session.error = error
+        if self.on_finish:
+            self.on_finish(session)
+
+    def _next_row(self, session):
+        try:
+            row = next(session._rows, None)
+        except Exception as e:
+            self._finish(session, "failed", str(e))
+            return None
+        if row is None:
+            self._finish(session, "completed")
+        return row
+
+    def _step(self, session, row):
+        try:
+            self.process_row(session, row)
+        except Exception as e:
+            self._finish(session, "failed", str(e))
+            return
+        session.current_row = row
+        session.history.append(row)
+        session.index += 1
+
+# --- Fast-forward (headless) replay ---
+FAST_CHUNK_ROWS = 200_000
+DEFAULT_MOISTURE = 500.0  # used when a row has no soil_moisture reading, like run_simulation
+
+
+def _pump_on(moisture, threshold):
+    return np.where(np.isnan(moisture), DEFAULT_MOISTURE, moisture) < threshold
+
+
+def evaluate_thresholds(path, thresholds, flow_lpm=None):
+    """Summaries of what each threshold would have done over a recording, without writing.
+
+    One vectorized pass over the file, whatever the number of thresholds.
+    Liters come from irrigation event durations at `flow_lpm` (default: the
+    flow_rate_lpm setting).
+    """
+    import water_tracker
+
+    flow_lpm = water_tracker.flow_rate() if flow_lpm is None else float(flow_lpm)
+    thresholds = [_finite(t, "threshold") for t in thresholds]
+    acc = {t: {"pump_on_ticks": 0, "irrigation_events": 0, "liters": 0.0} for t in thresholds}
+    spans = {t: water_tracker.ChunkedEvents(flow_lpm) for t in thresholds}
+    rows = 0
+    started = time.perf_counter()
+    replay = CsvReplay(path, chunksize=FAST_CHUNK_ROWS)
+    with replay.chunks() as reader:
+        for chunk in reader:
+            moisture = chunk["soil_moisture"].to_numpy(dtype=float, na_value=np.nan)
+            texts = chunk["timestamp"].fillna("").to_numpy(dtype=object)
+            ts = water_tracker.epochs(chunk["timestamp"])
+            rows += len(moisture)
+            for t in thresholds:
+                on = _pump_on(moisture, t)
+                events = spans[t].feed(on, texts, ts)
+                acc[t]["pump_on_ticks"] += int(on.sum())
+                acc[t]["irrigation_events"] += len(events)
+                acc[t]["liters"] += sum(e["liters_used"] for e in events)
+    for t in thresholds:
+        events = spans[t].finish()
+        acc[t]["irrigation_events"] += len(events)
+        acc[t]["liters"] += sum(e["liters_used"] for e in events)
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "flow_rate_lpm": flow_lpm,
+        "elapsed_s": round(elapsed, 3),
+        "results": [
+            {
+                "threshold": t,
+                "pump_on_ticks": a["pump_on_ticks"],
+                "pump_on_pct": round(100.0 * a["pump_on_ticks"] / rows, 2) if rows else 0.0,
+                "irrigation_events": a["irrigation_events"],
+                "liters": round(a["liters"], 3),
+            }
+            for t, a in acc.items()
+        ],
+    }
+
+
+def fast_forward(path, threshold, flow_lpm=None, device_id=None, persist=True):
+    """Replay a whole recording at full speed with vectorized pump decisions.
+
+    Per chunk, pump status comes from NumPy comparisons and irrigation
+    events from the ON/OFF edges. One water_usage row is stored per event
+    (liters = duration x `flow_lpm`, default the flow_rate_lpm setting) and
+    a notification when the pump switches ON. With `persist` the chunk's
+    sensor, water and notification rows are bulk-loaded in one
+    transaction. Returns a summary dict.
+    """
+    from database import (
+        SENSOR_INSERT_SQL,
+        WATER_EVENT_INSERT_SQL,
+        NOTIFICATION_INSERT_SQL,
+        execute_batches,
+    )
+    import water_tracker
+
+    flow_lpm = water_tracker.flow_rate() if flow_lpm is None else float(flow_lpm)
+    threshold = _finite(threshold, "threshold")
+    rows = pump_on_ticks = 0
+    events = 0
+    liters = 0.0
+    m_min, m_max, m_sum, m_n = math.inf, -math.inf, 0.0, 0
+    prev_on = False
+    spans = water_tracker.ChunkedEvents(flow_lpm, device_id)
+    started = time.perf_counter()
+    replay = CsvReplay(path, chunksize=FAST_CHUNK_ROWS)
+    with replay.chunks() as reader:
+        for chunk in reader:
+            moisture = chunk["soil_moisture"].to_numpy(dtype=float, na_value=np.nan)
+            if not len(moisture):
+                continue
+            on = _pump_on(moisture, threshold)
+            starts = on & ~np.concatenate(([prev_on], on[:-1]))
+            prev_on = bool(on[-1])
+            rows += len(on)
+            pump_on_ticks += int(on.sum())
+            timestamps = chunk["timestamp"].fillna("").to_numpy(dtype=object)
+            closed = spans.feed(on, timestamps, water_tracker.epochs(chunk["timestamp"]))
+            events += len(closed)
+            liters += sum(e["liters_used"] for e in closed)
+            valid = moisture[~np.isnan(moisture)]
+            if len(valid):
+                m_min = min(m_min, float(valid.min()))
+                m_max = max(m_max, float(valid.max()))
+                m_sum += float(valid.sum())
+                m_n += len(valid)
+            if not persist:
+                continue
+
+            columns = [
+                np.where(np.isnan(v), None, v).tolist()
+                for v in (moisture,
+                          chunk["temperature"].to_numpy(dtype=float, na_value=np.nan),
+                          chunk["humidity"].to_numpy(dtype=float, na_value=np.nan))
+            ]
+            pump = on.astype(int).tolist()
+            sensor_rows = list(zip(timestamps.tolist(), *columns, pump, [device_id] * len(pump)))
+            notes = [(ts, "Pump turned ON by simulation", "info") for ts in timestamps[starts].tolist()]
+            execute_batches([
+                (SENSOR_INSERT_SQL, sensor_rows),
+                (WATER_EVENT_INSERT_SQL, [water_tracker.event_params(e) for e in closed]),
+                (NOTIFICATION_INSERT_SQL, notes),
+            ])
+    closed = spans.finish()  # pump still ON at the end of the recording
+    events += len(closed)
+    liters += sum(e["liters_used"] for e in closed)
+    if persist and closed:
+        execute_batches([(WATER_EVENT_INSERT_SQL, [water_tracker.event_params(e) for e in closed])])
+    elapsed = time.perf_counter() - started
+    return {
+        "source": os.path.basename(path),
+        "threshold": threshold,
+        "flow_rate_lpm": flow_lpm,
+        "rows": rows,
+        "pump_on_ticks": pump_on_ticks,
+        "pump_on_pct": round(100.0 * pump_on_ticks / rows, 2) if rows else 0.0,
+        "irrigation_events": events,
+        "liters": round(liters, 3),
+        "moisture": {
+            "min": m_min if m_n else None,
+            "avg": (m_sum / m_n) if m_n else None,
+            "max": m_max if m_n else None,
+        },
+        "persisted": persist,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed) if elapsed > 0 else None,
+    }
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Fast-forward a recorded CSV through the pump logic.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE, help="CSV in data/ or a path to one")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="moisture threshold (default: the saved moisture_threshold setting)")
+    parser.add_argument("--compare", default=None, metavar="T1,T2,...",
+                        help="evaluate several thresholds without writing anything")
+    parser.add_argument("--flow", type=float, default=None,
+                        help="pump flow in liters/minute (default: the saved flow_rate_lpm setting)")
+    parser.add_argument("--device", default=None, help="device_id to tag persisted rows with")
+    parser.add_argument("--dry-run", action="store_true", help="compute the summary without writing to the DB")
+    parser.add_argument("--db", default=None, help="SQLite file to use instead of backend/irrigation.db")
+    args = parser.parse_args(argv)
+
+    import database
+    if args.db:
+        database.DB_PATH = os.path.abspath(args.db)
+    path = os.path.abspath(args.source) if os.path.exists(args.source) else resolve_source(args.source)
+
+    database.init_db()
+    if args.compare:
+        result = evaluate_thresholds(path, [t for t in args.compare.split(",") if t.strip()], args.flow)
+    else:
+        threshold = args.threshold
+        if threshold is None:
+            threshold = float(database.get_setting("moisture_threshold", "500") or 500)
+        result = fast_forward(path, threshold, args.flow, device_id=args.device, persist=not args.dry_run)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
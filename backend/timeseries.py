@@ -0,0 +1,446 @@
+# backend/timeseries.py
+# In-memory copy of the newest sensor readings, so polling endpoints
+# (/api/data/recent, /api/sensors/latest, short-range /api/metrics/sensors,
+# GET /api/forecast) don't query SQLite for rows written moments ago.
+#
+# Rows live in preallocated NumPy column rings (Ring): one per device, holding
+# its newest DEVICE_ROWS readings, plus a "tail" ring of the newest TAIL_ROWS
+# readings overall in id order. The oldest row is overwritten when a ring is
+# full and at most MAX_DEVICES device rings exist (least recently written
+# dropped), so memory is bounded whatever the ingest rate.
+#
+# database.py feeds it from inside every sensor_data write transaction (the
+# simulation's write-behind queue, hardware ingestion, the gateway, the serial
+# bridge all go through execute_batches), so rows arrive in id order with
+# their real ids; a rolled-back batch is taken out again. rebuild() seeds it
+# from the DB at startup. Readers get None whenever the buffer cannot answer
+# exactly what the equivalent query would return (rows already pushed out,
+# archived, ...) and fall back to SQLite.
+#
+# Other processes write sensor_data too (the standalone gateway and serial
+# bridge, other workers when clustered), so init_db() calls share(): readers
+# then first catch_up() on rows other processes committed, and start over
+# after another process archived rows. catch_up() only queries SQLite when
+# live_state's (throttled) sensor_data/sensor_archive versions moved.
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from live_state import state
+
+DEVICE_ROWS = int(os.environ.get("IRRIGATION_RECENT_ROWS", "1440") or 1440)  # per device: a day at 1/min
+TAIL_ROWS = 2000      # newest rows overall, for id-ordered pages
+MAX_DEVICES = 256
+PRIME_ROWS = 20_000   # rows loaded by rebuild()
+
+NO_TS = np.iinfo(np.int64).min  # ts is NULL (timestamp text SQLite could not parse)
+FLOATS = ("soil_moisture", "temperature", "humidity")
+TEXTS = ("timestamp", "pump_status")
+COLUMNS = ("id", "ts") + FLOATS + TEXTS
+
+
+class Ring:
+    """Preallocated columns keeping the newest `capacity` rows appended."""
+
+    __slots__ = ("capacity", "size", "head", "stale_ts", "max_ts") + COLUMNS
+
+    def __init__(self, capacity, stale_ts=None):
+        self.capacity = capacity
+        self.id = np.zeros(capacity, dtype=np.int64)
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        for name in FLOATS:
+            setattr(self, name, np.zeros(capacity))
+        for name in TEXTS:
+            setattr(self, name, np.empty(capacity, dtype=object))
+        self.reset(stale_ts)
+
+    def reset(self, stale_ts=None):
+        self.size = 0
+        self.head = 0  # next slot to write
+        self.max_ts = None  # newest ts ever appended (cheap bound for everything held)
+        # newest ts among this ring's rows that are no longer held (None: nothing missing)
+        self.stale_ts = stale_ts
+
+    def order(self):
+        """Slots oldest first."""
+        return (self.head - self.size + np.arange(self.size)) % self.capacity
+
+    def extend(self, batch, sel=slice(None)):
+        """Append rows `sel` of a column batch; returns (max id, max ts) of the rows pushed out, or None."""
+        ids = batch["id"][sel]
+        n = len(ids)
+        out = None
+        over = self.size + n - self.capacity
+        if over > 0:
+            gone = self.order()[:min(over, self.size)]
+            out_id = [self.id[gone]]
+            out_ts = [self.ts[gone]]
+            if n > self.capacity:  # part of the batch itself never fits
+                out_id.append(ids[:n - self.capacity])
+                out_ts.append(batch["ts"][sel][:n - self.capacity])
+            out = (int(max(a.max() for a in out_id if len(a))), int(max(a.max() for a in out_ts if len(a))))
+            self.stale_ts = out[1] if self.stale_ts is None else max(self.stale_ts, out[1])
+        top = int(batch["ts"][sel].max())
+        self.max_ts = top if self.max_ts is None else max(self.max_ts, top)
+        m = min(n, self.capacity)
+        slots = (self.head + np.arange(m)) % self.capacity
+        for name in COLUMNS:
+            getattr(self, name)[slots] = batch[name][sel][n - m:]
+        self.head = (self.head + m) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        return out
+
+    def push(self, batch, i):
+        """extend() for the single row `i` of a batch."""
+        out = None
+        if self.size == self.capacity:
+            out = (int(self.id[self.head]), int(self.ts[self.head]))
+            self.stale_ts = out[1] if self.stale_ts is None else max(self.stale_ts, out[1])
+        for name in COLUMNS:
+            getattr(self, name)[self.head] = batch[name][i]
+        ts = int(batch["ts"][i])
+        self.max_ts = ts if self.max_ts is None else max(self.max_ts, ts)
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return out
+
+    def keep(self, mask):
+        """Keep only the rows (oldest first) where `mask` is true; returns the max ts of the others or None."""
+        if mask.all():
+            return None
+        o = self.order()
+        dropped = self.ts[o][~mask]
+        k = int(mask.sum())
+        for name in COLUMNS:
+            col = getattr(self, name)
+            col[:k] = col[o][mask]
+        self.size = k
+        self.head = k % self.capacity
+        return int(dropped.max())
+
+    def rows(self, slots, names):
+        """Python values of `names` at `slots`, one list per column (NaN -> None)."""
+        cols = []
+        for name in names:
+            v = getattr(self, name)[slots]
+            cols.append(np.where(np.isnan(v), None, v).tolist() if name in FLOATS else v.tolist())
+        return cols
+
+
+def _text(value):
+    """What a TEXT column hands back for a bound parameter."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f"unsupported value {value!r}")
+
+
+def _texts(values):
+    if all(type(v) is str for v in values):
+        return np.array(values, dtype=object)
+    return np.array([_text(v) for v in values], dtype=object)
+
+
+def _reals(values):
+    """What a REAL column hands back (NaN for NULL); ValueError for text SQLite would keep as text."""
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _batch(ids, ts, timestamp, soil_moisture, temperature, humidity, pump_status, device_id):
+    """Column batch (and the rows' device ids) from per-column sequences."""
+    batch = {
+        "id": np.asarray(ids, dtype=np.int64),
+        "ts": np.array([NO_TS if t is None else t for t in ts], dtype=np.int64),
+        "soil_moisture": _reals(soil_moisture),
+        "temperature": _reals(temperature),
+        "humidity": _reals(humidity),
+        "timestamp": _texts(timestamp),
+        "pump_status": _texts(pump_status),
+    }
+    return batch, _texts(device_id).tolist()
+
+
+_READ_BACK_SQL = """
+    SELECT id, ts, timestamp, soil_moisture, temperature, humidity, pump_status, device_id
+    FROM sensor_data WHERE id > ? ORDER BY id
+"""
+
+
+class RecentReadings:
+    def __init__(self, device_rows=DEVICE_ROWS, tail_rows=TAIL_ROWS, max_devices=MAX_DEVICES):
+        self.device_rows = device_rows
+        self.max_devices = max_devices
+        self._lock = threading.Lock()
+        self.tail = Ring(tail_rows)
+        self._devices = OrderedDict()  # device_id -> Ring, least recently written first
+        self.ready = False   # False until rebuild(); readers then always fall back
+        self.floor_id = 0    # every row with a larger id is in `tail`
+        self.stale_ts = None  # newest ts of rows held by no device ring (None: nothing missing)
+        self.last_id = 0
+        self._connect = None  # set by share()
+        self._archived = None
+        self._version = None  # state.version() at the last catch_up() query
+
+    # --- writers ---
+    def rebuild(self, conn):
+        """Load the newest PRIME_ROWS rows of sensor_data."""
+        rows = conn.execute(
+            "SELECT id, ts, timestamp, soil_moisture, temperature, humidity, pump_status, device_id "
+            "FROM sensor_data ORDER BY id DESC LIMIT ?", (PRIME_ROWS,)
+        ).fetchall()
+        rows.reverse()
+        floor, stale = 0, None
+        if len(rows) == PRIME_ROWS:
+            floor = rows[0][0] - 1
+            stale = conn.execute(
+                "SELECT MAX(COALESCE(ts, ?)) FROM sensor_data WHERE id <= ?", (int(NO_TS), floor)
+            ).fetchone()[0]
+        try:
+            batch = _batch(*zip(*rows)) if rows else None
+        except (TypeError, ValueError) as e:  # e.g. text stored in a REAL column
+            print(f"[recent] buffer disabled: {e}")
+            self.ready = False
+            return
+        with self._lock:
+            self.tail.reset()
+            self._devices.clear()
+            self.floor_id, self.stale_ts = floor, stale
+            self.last_id = 0
+            if batch:
+                self._append(*batch)
+            self.ready = True
+
+    def record(self, conn, params):
+        """Add rows just inserted with SENSOR_INSERT_SQL `params`, inside the same transaction.
+
+        Returns the (first, last) ids added, to undo with discard() if the
+        transaction rolls back. Never raises: on any problem the buffer stops
+        answering until the next rebuild().
+        """
+        if not self.ready:
+            return None
+        try:
+            first = conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(params) + 1
+            batch = None
+            if first == self.last_id + 1:  # else another connection wrote in between
+                # ids of one transaction are consecutive; ts comes from SQLite so it matches exactly
+                ts = [r[0] for r in conn.execute("SELECT ts FROM sensor_data WHERE id >= ? ORDER BY id", (first,))]
+                try:
+                    batch = _batch(range(first, first + len(params)), ts, *zip(*params))
+                except (TypeError, ValueError):
+                    pass  # values the columns store differently; read them back
+            if batch is None:
+                rows = conn.execute(_READ_BACK_SQL, (self.last_id,)).fetchall()
+                batch = _batch(*zip(*rows)) if rows else None
+        except Exception as e:
+            print(f"[recent] buffer disabled until restart: {e}")
+            self.ready = False
+            return None
+        if batch is None:
+            return None
+        with self._lock:
+            self._append(*batch)
+        return first, first + len(params) - 1
+
+    def discard(self, first, last):
+        """Take out rows first..last (their transaction rolled back)."""
+        with self._lock:
+            for ring in (self.tail, *self._devices.values()):
+                ids = ring.id[ring.order()]
+                ring.keep((ids < first) | (ids > last))
+            if self.last_id == last:
+                self.last_id = first - 1
+
+    def drop_archived(self, lo, hi, watermark):
+        """Take out rows archive.py moved out of sensor_data (lo <= ts < hi, id <= watermark)."""
+        with self._lock:
+            for ring in (self.tail, *self._devices.values()):
+                o = ring.order()
+                gone = ring.keep(~((ring.ts[o] >= lo) & (ring.ts[o] < hi) & (ring.id[o] <= watermark)))
+                if gone is not None and ring is not self.tail:
+                    ring.stale_ts = gone if ring.stale_ts is None else max(ring.stale_ts, gone)
+                    self._stale(gone)
+
+    def _stale(self, ts):
+        self.stale_ts = ts if self.stale_ts is None else max(self.stale_ts, ts)
+
+    def _append(self, batch, devices):
+        if batch["id"][0] <= self.last_id:  # partly held already (another thread caught up)
+            keep = batch["id"] > self.last_id
+            if not keep.any():
+                return
+            batch = {name: col[keep] for name, col in batch.items()}
+            devices = [d for d, k in zip(devices, keep) if k]
+        out = self.tail.extend(batch)
+        if out is not None:
+            self.floor_id = max(self.floor_id, out[0])
+        groups = {}
+        for i, device in enumerate(devices):
+            groups.setdefault(device, []).append(i)
+        for device, idx in groups.items():
+            ring = self._ring(device)
+            if len(idx) == 1:
+                out = ring.push(batch, idx[0])
+            else:
+                out = ring.extend(batch, np.array(idx) if len(groups) > 1 else slice(None))
+            if out is not None:
+                self._stale(out[1])
+        self.last_id = int(batch["id"][-1])
+
+    def _ring(self, device):
+        ring = self._devices.get(device)
+        if ring is not None:
+            self._devices.move_to_end(device)
+            return ring
+        if len(self._devices) >= self.max_devices:
+            _, ring = self._devices.popitem(last=False)
+            if ring.size:
+                self._stale(ring.max_ts)
+            ring.reset(self.stale_ts)
+        else:
+            ring = Ring(self.device_rows, self.stale_ts)
+        self._devices[device] = ring
+        return ring
+
+    # --- shared (multi-process) mode ---
+    def share(self, connect):
+        """Follow sensor_data writes by other processes too; `connect` is database.get_conn."""
+        with connect() as conn:
+            row = conn.execute("SELECT n FROM table_versions WHERE name = 'sensor_archive'").fetchone()
+        self._archived = row[0] if row else None
+        self._version = None
+        self._connect = connect
+
+    def catch_up(self):
+        """Append rows other processes committed since the newest one held (no-op unless shared)."""
+        if self._connect is None:
+            return
+        version = state.version("sensor_data", "sensor_archive")
+        if version == self._version:
+            return
+        self._version = version
+        with self._connect() as conn:
+            archived, newest = conn.execute("""
+                SELECT (SELECT n FROM table_versions WHERE name = 'sensor_archive'), MAX(id) FROM sensor_data
+            """).fetchone()
+            if archived != self._archived or (self.ready and newest and newest - self.last_id > PRIME_ROWS):
+                self._archived = archived
+                self.rebuild(conn)  # rows this process holds may be gone, or too many are new
+                return
+            if not self.ready or newest is None or newest <= self.last_id:
+                return
+            rows = conn.execute(_READ_BACK_SQL, (self.last_id,)).fetchall()
+        try:
+            batch = _batch(*zip(*rows)) if rows else None
+        except (TypeError, ValueError) as e:
+            print(f"[recent] buffer disabled: {e}")
+            self.ready = False
+            return
+        if batch:
+            with self._lock:
+                self._append(*batch)
+
+    # --- readers (None: ask the database) ---
+    def page(self, limit, before_id=None, after_id=None):
+        """database.SENSOR_COLUMNS tuples, as database.fetch_sensor_page() returns them."""
+        self.catch_up()
+        if not self.ready or limit is None or limit < 0:
+            return None
+        with self._lock:
+            t = self.tail
+            if before_id is None and after_id is None:  # plain "newest N": no search needed
+                if limit > t.size and self.floor_id:
+                    return None
+                slots = (t.head - 1 - np.arange(min(limit, t.size))) % t.capacity
+                return list(zip(*t.rows(slots, ("id", "timestamp", *FLOATS, "pump_status"))))
+            o = t.order()
+            ids = t.id[o]
+            end = int(np.searchsorted(ids, before_id)) if before_id is not None else len(ids)
+            if after_id is not None:
+                if after_id < self.floor_id:
+                    return None
+                start = int(np.searchsorted(ids, after_id, side="right"))
+                slots = o[start:min(end, start + limit)]
+            else:
+                start = max(0, end - limit)
+                if end - start < limit and self.floor_id:
+                    return None  # the rest is older than the buffer
+                slots = o[start:end][::-1]
+            return list(zip(*t.rows(slots, ("id", "timestamp", *FLOATS, "pump_status"))))
+
+    def latest(self):
+        """Newest row as a SENSOR_COLUMNS tuple, False when there are none, None when unknown."""
+        self.catch_up()
+        if not self.ready:
+            return None
+        with self._lock:
+            t = self.tail
+            if not t.size:
+                return None if self.floor_id else False
+            i = (t.head - 1) % t.capacity
+            return tuple(v if v == v else None  # NaN -> None
+                         for v in (int(t.id[i]), t.timestamp[i], *(float(getattr(t, f)[i]) for f in FLOATS),
+                                   t.pump_status[i]))
+
+    def rows_since(self, since):
+        """(timestamp, soil_moisture, temperature, humidity) of hot rows with ts >= since, by ts.
+
+        Matches the sensor_data part of archive.sensor_rows_since().
+        """
+        self.catch_up()
+        if not self.ready:
+            return None
+        with self._lock:
+            if self.stale_ts is not None and since <= self.stale_ts:
+                return None
+            picked = []
+            for ring in self._devices.values():
+                o = ring.order()
+                slots = o[ring.ts[o] >= since]
+                if len(slots):
+                    picked.append((ring, slots))
+            if not picked:
+                return []
+            ids = np.concatenate([r.id[s] for r, s in picked])
+            ts = np.concatenate([r.ts[s] for r, s in picked])
+            rows = [row for r, s in picked for row in zip(*r.rows(s, ("timestamp", *FLOATS)))]
+        return [rows[i] for i in np.lexsort((ids, ts))]
+
+    def history(self, device_id, n):
+        """Newest `n` rows of one device (by ts, then id) as database.fetch_device_history() dicts."""
+        if not self.ready:
+            return None
+        if device_id is None:
+            rows = self.page(n)
+            if rows is None:
+                return None
+            return [dict(zip(("timestamp", *FLOATS), r[1:5])) for r in reversed(rows)]
+        self.catch_up()
+        if not self.ready:
+            return None
+        with self._lock:
+            ring = self._devices.get(device_id)
+            if ring is None:
+                return [] if self.stale_ts is None else None
+            o = ring.order()
+            ts = ring.ts[o]
+            pick = np.lexsort((ring.id[o], ts))[::-1][:n]
+            if ring.stale_ts is not None and (len(pick) < n or ts[pick[-1]] <= ring.stale_ts):
+                return None
+            cols = ring.rows(o[pick[::-1]], ("timestamp", *FLOATS))
+        return [dict(zip(("timestamp", *FLOATS), r)) for r in zip(*cols)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "devices": len(self._devices),
+                "rows": self.tail.size + sum(r.size for r in self._devices.values()),
+                "floor_id": self.floor_id,
+                "stale_ts": self.stale_ts,
+            }
+
+
+recent = RecentReadings()
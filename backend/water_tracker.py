@@ -0,0 +1,253 @@
+# backend/water_tracker.py
+# Event-based water accounting: one water_usage record per irrigation event
+# (pump ON -> OFF) instead of one row per ON tick.
+#
+# Liters = event duration x flow rate (the `flow_rate_lpm` setting, liters per
+# minute). The default of 2 L/min reproduces the old "2.0 L per ON tick" totals
+# for one-minute recordings such as data/sample_data.csv.
+#
+# An event that is still open is kept in memory and mirrored to the
+# irrigation_open table, so a restart doesn't lose it: load() closes recovered
+# events at the newest reading stored since they began. When several worker
+# processes share the table (cluster.py), sync() adopts the events another
+# worker opened before this one observes the same key.
+import calendar
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from database import (
+    WATER_EVENT_INSERT_SQL,
+    IRRIGATION_OPEN_SQL,
+    IRRIGATION_CLOSE_SQL,
+    execute_batches,
+    fetch_open_irrigation,
+    fetch_last_reading_time,
+    get_setting,
+)
+from events import publish
+
+DEFAULT_FLOW_LPM = 2.0
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+MANUAL_KEY = "manual"  # pump switched by hand: wall-clock timed
+
+
+def flow_rate():
+    """Configured pump flow in liters per minute."""
+    try:
+        return float(get_setting("flow_rate_lpm", str(DEFAULT_FLOW_LPM)) or DEFAULT_FLOW_LPM)
+    except (TypeError, ValueError):
+        return DEFAULT_FLOW_LPM
+
+
+def liters_for(duration_s, flow_lpm):
+    return max(duration_s, 0.0) * flow_lpm / 60.0
+
+
+def _epoch(timestamp):
+    """UTC epoch of a 'YYYY-mm-dd HH:MM:SS' string (same reading as SQL strftime('%s')), or None."""
+    if not timestamp:
+        return None
+    try:
+        return calendar.timegm(time.strptime(str(timestamp).replace("T", " ")[:19], TIME_FORMAT))
+    except ValueError:
+        return None
+
+
+def _event(key, device_id, started_at, started_ts, ended_at, ended_ts, flow_lpm):
+    duration = float(ended_ts - started_ts) if started_ts is not None and ended_ts is not None else 0.0
+    duration = max(duration, 0.0)
+    return {
+        "key": key,
+        "device_id": device_id,
+        "timestamp": started_at,
+        "ended_at": ended_at,
+        "duration_s": duration,
+        "liters_used": round(liters_for(duration, flow_lpm), 3),
+    }
+
+
+def event_params(ev):
+    """Map an event dict onto WATER_EVENT_INSERT_SQL parameters"""
+    return (ev["timestamp"], ev["liters_used"], ev["ended_at"], ev["duration_s"], ev["device_id"])
+
+
+class WaterTracker:
+    """Open irrigation events per key (a simulation session, a device, manual control).
+
+    observe() is called with every pump state seen for a key; it only
+    writes on transitions: ON opens an event, OFF closes it and stores one
+    water_usage row. Calls without a timestamp use the wall clock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = {}  # key -> {device_id, started_at, started_ts, last_at, last_ts, live}
+        self.shared = False  # set by cluster.enable(): other processes open/close events too
+
+    def sync(self, keys, live=False):
+        """Match the open events for `keys` to irrigation_open (no-op unless shared)."""
+        if not self.shared:
+            return
+        keys = list(keys)
+        stored = {row[0]: row for row in fetch_open_irrigation(keys)}
+        with self._lock:
+            for key in keys:
+                row = stored.get(key)
+                if row is None:
+                    self._open.pop(key, None)  # closed elsewhere
+                elif key not in self._open:
+                    _, device_id, started_at, started_ts = row
+                    self._open[key] = {
+                        "device_id": device_id, "started_at": started_at, "started_ts": started_ts,
+                        "last_at": started_at, "last_ts": started_ts, "live": live,
+                    }
+
+    def observe(self, key, on, timestamp=None, device_id=None):
+        """Feed one pump state; returns the closed event dict, if this closed one."""
+        live = not timestamp
+        if live:
+            timestamp = time.strftime(TIME_FORMAT, time.gmtime())
+        ts = _epoch(timestamp)
+        with self._lock:
+            ev = self._open.get(key)
+            if on:
+                if ev is not None:
+                    if ts is not None and (ev["last_ts"] is None or ts >= ev["last_ts"]):
+                        ev["last_at"], ev["last_ts"] = timestamp, ts
+                    return None
+                self._open[key] = {
+                    "device_id": device_id, "started_at": timestamp, "started_ts": ts,
+                    "last_at": timestamp, "last_ts": ts, "live": live,
+                }
+            elif ev is None:
+                return None
+            else:
+                del self._open[key]
+        if on:
+            execute_batches([(IRRIGATION_OPEN_SQL, [(key, device_id, timestamp, ts)])])
+            return None
+        return self._store(_event(key, ev["device_id"], ev["started_at"], ev["started_ts"],
+                                  timestamp, ts, flow_rate()))
+
+    def close(self, key, timestamp=None):
+        """Close an open event (e.g. its session stopped); defaults to the last time it was seen ON."""
+        with self._lock:
+            ev = self._open.pop(key, None)
+        if ev is None:
+            return None
+        if timestamp is None:
+            if ev["live"]:
+                timestamp = time.strftime(TIME_FORMAT, time.gmtime())
+                ts = _epoch(timestamp)
+            else:
+                timestamp, ts = ev["last_at"], ev["last_ts"]
+        else:
+            ts = _epoch(timestamp)
+        return self._store(_event(key, ev["device_id"], ev["started_at"], ev["started_ts"],
+                                  timestamp, ts, flow_rate()))
+
+    def _store(self, event):
+        execute_batches([
+            (WATER_EVENT_INSERT_SQL, [event_params(event)]),
+            (IRRIGATION_CLOSE_SQL, [(event["key"],)]),
+        ])
+        publish("water", event)
+        return event
+
+    def open_events(self):
+        """Open events with the liters accrued so far."""
+        flow = flow_rate()
+        now = calendar.timegm(time.gmtime())
+        with self._lock:
+            items = dict(self._open)
+        if self.shared:
+            for key, device_id, started_at, started_ts in fetch_open_irrigation():
+                if key not in items:  # opened by another worker
+                    items[key] = self._foreign(key, device_id, started_at, started_ts)
+        out = []
+        for key, ev in items.items():
+            end = now if ev["live"] else ev["last_ts"]
+            ev = _event(key, ev["device_id"], ev["started_at"], ev["started_ts"], None, end, flow)
+            out.append(ev)
+        return out
+
+    @staticmethod
+    def _foreign(key, device_id, started_at, started_ts):
+        live = key == MANUAL_KEY
+        last = None if live else fetch_last_reading_time(device_id, started_ts or 0)
+        last_at, last_ts = last if last else (started_at, started_ts)
+        return {"device_id": device_id, "started_at": started_at, "started_ts": started_ts,
+                "last_at": last_at, "last_ts": last_ts, "live": live}
+
+    def open_liters(self):
+        return sum(ev["liters_used"] for ev in self.open_events())
+
+    def load(self):
+        """Close events left open by a previous process; returns how many were recovered."""
+        recovered = fetch_open_irrigation()
+        flow = flow_rate()
+        for key, device_id, started_at, started_ts in recovered:
+            last = fetch_last_reading_time(device_id, started_ts or 0)
+            ended_at, ended_ts = last if last else (started_at, started_ts)
+            self._store(_event(key, device_id, started_at, started_ts, ended_at, ended_ts, flow))
+        return len(recovered)
+
+
+tracker = WaterTracker()
+
+
+# --- Vectorized events for bulk replays (simulation.fast_forward) ---
+def epochs(timestamps):
+    """Float UTC epochs of a timestamp Series (NaN where unparseable)."""
+    dt = pd.to_datetime(timestamps, format="ISO8601", errors="coerce")
+    return ((dt - pd.Timestamp(0)).dt.total_seconds()).to_numpy(dtype=float, na_value=np.nan)
+
+
+class ChunkedEvents:
+    """Irrigation events over consecutive chunks of pump states, without a per-row loop.
+
+    feed() returns the events that closed inside the chunk; an event still
+    ON at the end of a chunk carries into the next one, and finish() closes
+    it at the last row seen.
+    """
+
+    def __init__(self, flow_lpm, device_id=None):
+        self.flow = flow_lpm
+        self.device_id = device_id
+        self._open = None   # (started_at, started_ts) of an event spanning chunks
+        self._last = None   # (timestamp, ts) of the last row fed
+
+    def _make(self, start, end):
+        (s_at, s_ts), (e_at, e_ts) = start, end
+        ok = not (np.isnan(s_ts) or np.isnan(e_ts))
+        return _event(None, self.device_id, s_at, s_ts if ok else None, e_at, e_ts if ok else None, self.flow)
+
+    def feed(self, on, texts, ts):
+        if not len(on):
+            return []
+        edges = np.diff(np.concatenate(([self._open is not None], on, [False])).astype(np.int8))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)  # first OFF row of each run (len(on) if still ON)
+        events = []
+        if self._open is not None:
+            end, ends = ends[0], ends[1:]
+            if end < len(on):
+                events.append(self._make(self._open, (texts[end], ts[end])))
+                self._open = None
+        for s, e in zip(starts, ends):
+            if e < len(on):
+                events.append(self._make((texts[s], ts[s]), (texts[e], ts[e])))
+            else:
+                self._open = (texts[s], ts[s])
+        self._last = (texts[-1], ts[-1])
+        return events
+
+    def finish(self):
+        if self._open is None:
+            return []
+        events = [self._make(self._open, self._last)]
+        self._open = None
+        return events
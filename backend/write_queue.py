@@ -0,0 +1,164 @@
+# backend/write_queue.py
+# Write-behind ingestion: callers enqueue rows and a single background thread
+# flushes them to SQLite in batched executemany transactions (group commit).
+import queue
+import sqlite3
+import threading
+import time
+
+from database import (
+    SENSOR_INSERT_SQL,
+    WATER_INSERT_SQL,
+    NOTIFICATION_INSERT_SQL,
+    sensor_params,
+    execute_batches,
+    _utc_now,
+)
+
+_STOP = object()
+RETRY_DELAYS = (0.1, 0.5, 2.0)  # backoff between attempts when the database is locked/busy
+
+
+def _transient(error):
+    """True for errors a later attempt can get past (another writer holds the lock)."""
+    text = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in text or "busy" in text)
+
+
+class WriteBehindQueue:
+    """Bounded in-memory queue of (sql, params) drained by one writer thread.
+
+    A batch is committed when `max_batch` rows are pending or `flush_interval`
+    seconds have passed since the first pending row, whichever comes first.
+    `put` blocks when `maxsize` rows are waiting (backpressure).
+    """
+
+    def __init__(self, max_batch=1000, flush_interval=0.25, maxsize=20000):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._q = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.batches_written = 0
+        self.errors = 0        # batches (or parts of one) dropped
+        self.rows_dropped = 0
+        self.retries = 0
+
+    # --- lifecycle ---
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Flush everything still queued and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None or not thread.is_alive():
+            return
+        self._q.put(_STOP)
+        thread.join(timeout)
+
+    def flush(self):
+        """Block until every row queued so far has been committed."""
+        if self._thread is None:
+            self.start()
+        self._q.join()
+
+    @property
+    def pending(self):
+        return self._q.qsize()
+
+    # --- producers ---
+    def put(self, sql, params, timeout=None):
+        """Queue one row; blocks (or raises queue.Full after `timeout`) when full."""
+        if self._thread is None:
+            self.start()
+        self._q.put((sql, params), timeout=timeout)
+
+    # --- writer thread ---
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._q.get()
+            if item is _STOP:
+                self._q.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._q.task_done()
+                    stopping = True
+                    # drain whatever is left behind the sentinel
+                    while True:
+                        try:
+                            batch.append(self._q.get_nowait())
+                        except queue.Empty:
+                            break
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in batch:
+                self._q.task_done()
+
+    def _write(self, batch):
+        """Commit `batch`; a locked database is retried with backoff, and a batch
+        that fails otherwise is split until only the failing rows are dropped."""
+        error = self._commit(batch)
+        if error is None:
+            return
+        if len(batch) > 1 and not _transient(error):
+            half = len(batch) // 2
+            self._write(batch[:half])
+            self._write(batch[half:])
+            return
+        self.errors += 1
+        self.rows_dropped += len(batch)
+        print(f"[write-behind] dropped {len(batch)} row(s): {error}")
+
+    def _commit(self, batch):
+        """One transaction for `batch` (retried while the DB is locked); returns the error or None."""
+        # Group by statement, keeping first-seen order so related rows commit together
+        groups = {}
+        for sql, params in batch:
+            groups.setdefault(sql, []).append(params)
+        for delay in (0,) + RETRY_DELAYS:
+            if delay:
+                self.retries += 1
+                time.sleep(delay)
+            try:
+                execute_batches(groups.items())
+            except Exception as e:
+                error = e
+                if not _transient(e):
+                    return e
+                continue
+            self.rows_written += len(batch)
+            self.batches_written += 1
+            return None
+        return error
+
+
+# Shared process-wide writer
+writer = WriteBehindQueue()
+
+
+def queue_sensor_row(row):
+    writer.put(SENSOR_INSERT_SQL, sensor_params(row))
+
+
+def queue_water_usage(timestamp, liters):
+    writer.put(WATER_INSERT_SQL, (timestamp, liters))
+
+
+def queue_notification(message: str, type_: str = "info", timestamp: str = None):
+    writer.put(NOTIFICATION_INSERT_SQL, (timestamp or _utc_now(), message, type_))
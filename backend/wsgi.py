@@ -0,0 +1,18 @@
+# backend/wsgi.py
+# Production entry point: several worker processes sharing one database.
+#
+#   cd backend && gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Each worker imports this module; gunicorn.conf.py has already migrated the
+# database and closed leftover irrigation events once, in the master process.
+# Workers run clustered (see cluster.py): one of them is elected to run the
+# simulation scheduler and the background jobs.
+import os
+
+os.environ.setdefault("IRRIGATION_CLUSTER", "1")
+
+from app import app, start_services  # noqa: E402
+from database import init_db  # noqa: E402
+
+init_db()  # no-op migrations; loads this process's caches
+start_services()
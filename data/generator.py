@@ -1,23 +1,281 @@
-import csv
-import random
-from datetime import datetime, timedelta
+# data/generator.py
+# Synthetic sensor recordings for replay, load tests and demos.
+#
+# Vectorized with NumPy: rows are produced a time-chunk at a time for all
+# zones at once, so millions of rows take seconds and memory stays flat.
+# Each zone gets diurnal temperature/humidity, moisture that dries faster in
+# the heat of the day and recovers during irrigation when it falls below the
+# zone's threshold. With the same --seed and --start the output is identical
+# run to run.
+#
+#   python data/generator.py                                   # 100 rows -> data/sample_data.csv
+#   python data/generator.py --rows 5000000 --devices 50 --out data/big.csv
+#   python data/generator.py --rows 5000000 --format columnar --out data/big_cols
+#   python data/generator.py --rows 1000000 --devices 20 --format db   # bulk-load backend/irrigation.db
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
 
-# Config
-rows = 100
-filename = "data/sample_data.csv"
+import numpy as np
+import pandas as pd
 
-start_time = datetime.now()
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(DATA_DIR, "..", "backend")
 
-with open(filename, mode="w", newline="") as file:
-    writer = csv.writer(file)
-    writer.writerow(["timestamp", "soil_moisture", "temperature", "humidity"])
+CHUNK_ROWS = 500_000        # rows generated (and written) per chunk
+COLUMNS = ["timestamp", "soil_moisture", "temperature", "humidity", "device_id"]
 
-    for i in range(rows):
-        ts = start_time + timedelta(minutes=i)
-        soil_moisture = random.randint(200, 800)
-        temperature = random.uniform(20, 35)
-        humidity = random.uniform(40, 90)
 
-        writer.writerow([ts.strftime("%Y-%m-%d %H:%M:%S"), soil_moisture, round(temperature, 2), round(humidity, 2)])
+class Zone:
+    """Per-zone parameters plus the moisture state carried across chunks."""
 
-print(f"✅ Sample data generated in {filename}")
+    def __init__(self, name, rng, interval):
+        self.name = name
+        self.full = rng.uniform(680, 780)            # level right after irrigation
+        self.threshold = rng.uniform(330, 420)       # irrigation starts below this
+        self.dry_rate = rng.uniform(0.25, 0.6)       # moisture lost per minute at mean temperature
+        self.irrigation_minutes = rng.uniform(15, 40)
+        self.temp_mean = rng.uniform(20, 28)
+        self.temp_amp = rng.uniform(4, 8)
+        self.humidity_mean = rng.uniform(55, 75)
+        self.interval = interval
+        self.level = rng.uniform(self.threshold, self.full)
+        self.irrigating = 0                          # steps of irrigation still to run
+
+    def irrigation_steps(self, rng):
+        return max(1, int(round(self.irrigation_minutes * 60 / self.interval * rng.uniform(0.8, 1.2))))
+
+
+def _moisture(zone, decay, rng):
+    """Clean moisture track and pump flags for one zone over one chunk.
+
+    Drying is `level - cumsum(decay)` until the first reading below the
+    threshold, then a linear ramp back to `full` while the pump runs. The
+    loop is per irrigation cycle, not per row: each drying phase's end is
+    found with one searchsorted on the cumulative decay.
+    """
+    n = len(decay)
+    out = np.empty(n)
+    pump = np.zeros(n, dtype=bool)
+    consumed = np.concatenate(([0.0], np.cumsum(decay)))
+    i = 0
+    while i < n:
+        if zone.irrigating:
+            k = min(zone.irrigating, n - i)
+            step = (zone.full - zone.level) / zone.irrigating
+            out[i:i + k] = zone.level + step * np.arange(1, k + 1)
+            pump[i:i + k] = True
+            zone.level = out[i + k - 1]
+            zone.irrigating -= k
+            i += k
+            continue
+        budget = zone.level - zone.threshold
+        if budget < 0:
+            zone.irrigating = zone.irrigation_steps(rng)
+            continue
+        # first step t >= i whose reading falls below the threshold
+        t = int(np.searchsorted(consumed, consumed[i] + budget, side="right")) - 1
+        j = min(t + 1, n)
+        out[i:j] = zone.level - (consumed[i + 1:j + 1] - consumed[i])
+        zone.level = out[j - 1]
+        if t < n:
+            pump[t] = True  # the controller switches on at the first dry reading
+            zone.irrigating = zone.irrigation_steps(rng)
+        i = j
+    return out, pump
+
+
+def generate(rows, devices=1, interval=60, start=None, seed=0, missing=0.0, chunk_rows=CHUNK_ROWS):
+    """Yield DataFrames (COLUMNS + pump_status, ts) of at most ~chunk_rows rows, ordered by time then zone."""
+    rng = np.random.default_rng(seed)
+    steps = -(-rows // devices)
+    if start is None:
+        now = int(time.time()) // interval * interval
+        start = now - (steps - 1) * interval
+    zones = [Zone(f"zone-{k + 1}", rng, interval) for k in range(devices)]
+    full = np.array([z.full for z in zones])
+    temp_mean = np.array([z.temp_mean for z in zones])
+    temp_amp = np.array([z.temp_amp for z in zones])
+    hum_mean = np.array([z.humidity_mean for z in zones])
+    dry_rate = np.array([z.dry_rate for z in zones]) * interval / 60.0
+    names = np.array([z.name for z in zones], dtype=object)
+
+    chunk_steps = max(1, chunk_rows // devices)
+    emitted = 0
+    for s0 in range(0, steps, chunk_steps):
+        n = min(chunk_steps, steps - s0)
+        epoch = start + (s0 + np.arange(n)) * interval                 # (n,)
+        hour = (epoch % 86400) / 3600.0
+        diurnal = np.sin(2 * np.pi * (hour - 9) / 24)[:, None]          # peaks mid-afternoon
+        temp = temp_mean + temp_amp * diurnal + rng.normal(0, 0.6, (n, devices))
+        humidity = np.clip(hum_mean - 2.2 * (temp - temp_mean) + rng.normal(0, 3, (n, devices)), 15, 100)
+        # evapotranspiration: faster when hot and dry
+        factor = np.clip(1 + 0.08 * (temp - temp_mean) - 0.01 * (humidity - hum_mean), 0.2, None)
+        decay = dry_rate * factor * rng.uniform(0.7, 1.3, (n, devices))
+
+        moisture = np.empty((n, devices))
+        pump = np.empty((n, devices), dtype=bool)
+        for k, zone in enumerate(zones):
+            moisture[:, k], pump[:, k] = _moisture(zone, decay[:, k], rng)
+        moisture = np.clip(moisture + rng.normal(0, 4, (n, devices)), 0, full.max() + 50)
+
+        if missing:
+            moisture[rng.random((n, devices)) < missing] = np.nan
+
+        take = min(n * devices, rows - emitted)
+        stamps = np.char.replace(np.datetime_as_string(epoch.astype("datetime64[s]"), unit="s"), "T", " ")
+        frame = pd.DataFrame({
+            "timestamp": np.repeat(stamps, devices)[:take],
+            "soil_moisture": moisture.ravel()[:take].round(1),
+            "temperature": temp.ravel()[:take].round(2),
+            "humidity": humidity.ravel()[:take].round(2),
+            "device_id": np.tile(names, n)[:take],
+            "pump_status": np.where(pump.ravel()[:take], "ON", "OFF"),
+            "ts": np.repeat(epoch, devices)[:take],
+        })
+        emitted += take
+        yield frame
+
+
+# --- Writers ---
+def write_csv(chunks, path):
+    rows = 0
+    for i, frame in enumerate(chunks):
+        frame[COLUMNS].to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+        rows += len(frame)
+    return rows
+
+
+def write_columnar(chunks, path):
+    """One raw little-endian file per column plus meta.json; read back with load_columnar()."""
+    os.makedirs(path, exist_ok=True)
+    files = {
+        "ts": ("<i8", open(os.path.join(path, "ts.bin"), "wb")),
+        "soil_moisture": ("<f4", open(os.path.join(path, "soil_moisture.bin"), "wb")),
+        "temperature": ("<f4", open(os.path.join(path, "temperature.bin"), "wb")),
+        "humidity": ("<f4", open(os.path.join(path, "humidity.bin"), "wb")),
+        "device": ("<i4", open(os.path.join(path, "device.bin"), "wb")),
+        "pump": ("u1", open(os.path.join(path, "pump.bin"), "wb")),
+    }
+    devices = {}
+    rows = 0
+    try:
+        for frame in chunks:
+            for name in frame["device_id"].unique():
+                devices.setdefault(name, len(devices))
+            codes = frame["device_id"].map(devices)
+            values = {
+                "ts": frame["ts"],
+                "soil_moisture": frame["soil_moisture"],
+                "temperature": frame["temperature"],
+                "humidity": frame["humidity"],
+                "device": codes,
+                "pump": frame["pump_status"] == "ON",
+            }
+            for name, (dtype, f) in files.items():
+                f.write(np.asarray(values[name]).astype(dtype).tobytes())
+            rows += len(frame)
+    finally:
+        for _, f in files.values():
+            f.close()
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({
+            "rows": rows,
+            "columns": {name: dtype for name, (dtype, _) in files.items()},
+            "devices": sorted(devices, key=devices.get),
+        }, f, indent=2)
+    return rows
+
+
+def load_columnar(path):
+    """Memory-mapped columns of a write_columnar() directory, plus its metadata."""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    columns = {
+        name: np.memmap(os.path.join(path, f"{name}.bin"), dtype=dtype, mode="r", shape=(meta["rows"],))
+        for name, dtype in meta["columns"].items()
+    }
+    return columns, meta
+
+
+def load_db(chunks, db=None):
+    """Bulk-insert into the app's SQLite DB (sensor rows plus one water_usage row per irrigation event)."""
+    sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+    import database
+    if db:
+        database.DB_PATH = os.path.abspath(db)
+    database.init_db()
+    import rollups
+    import water_tracker
+
+    flow = water_tracker.flow_rate()
+    spans = {}
+    rows = 0
+    for frame in chunks:
+        sensor = list(zip(
+            frame["timestamp"].tolist(),
+            *(frame[c].astype(object).where(frame[c].notna(), None).tolist()
+              for c in ("soil_moisture", "temperature", "humidity")),
+            frame["pump_status"].tolist(),
+            frame["device_id"].tolist(),
+        ))
+        events = []
+        for device, part in frame.groupby("device_id", sort=False):
+            tracker = spans.setdefault(device, water_tracker.ChunkedEvents(flow, device))
+            events += tracker.feed((part["pump_status"] == "ON").to_numpy(),
+                                   part["timestamp"].to_numpy(dtype=object),
+                                   water_tracker.epochs(part["timestamp"]))
+        database.execute_batches([
+            (database.SENSOR_INSERT_SQL, sensor),
+            (database.WATER_EVENT_INSERT_SQL, [water_tracker.event_params(e) for e in events]),
+        ])
+        rows += len(frame)
+    tail = [e for tracker in spans.values() for e in tracker.finish()]
+    database.execute_batches([(database.WATER_EVENT_INSERT_SQL, [water_tracker.event_params(e) for e in tail])])
+    while rollups.compact_rollups():
+        pass
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic irrigation sensor data.")
+    parser.add_argument("--rows", type=int, default=100, help="total rows across all zones")
+    parser.add_argument("--devices", type=int, default=1, help="number of zones (device_id zone-1..N)")
+    parser.add_argument("--interval", type=int, default=60, help="seconds between readings of a zone")
+    parser.add_argument("--start", default=None,
+                        help="first timestamp 'YYYY-mm-dd HH:MM:SS' UTC (default: so the data ends now)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (same seed, same values)")
+    parser.add_argument("--missing", type=float, default=0.0, help="fraction of moisture readings left empty")
+    parser.add_argument("--format", choices=["csv", "columnar", "db"], default="csv")
+    parser.add_argument("--out", default=os.path.join(DATA_DIR, "sample_data.csv"),
+                        help="CSV file, columnar directory, or (with --format db) SQLite file "
+                             "(default for db: backend/irrigation.db)")
+    args = parser.parse_args(argv)
+    if args.rows < 1 or args.devices < 1 or args.interval < 1:
+        parser.error("--rows, --devices and --interval must be positive")
+
+    start = None
+    if args.start:
+        start = int(datetime.datetime.fromisoformat(args.start).replace(tzinfo=datetime.timezone.utc).timestamp())
+    chunks = generate(args.rows, args.devices, args.interval, start, args.seed, args.missing)
+
+    started = time.perf_counter()
+    if args.format == "csv":
+        rows = write_csv(chunks, args.out)
+        target = args.out
+    elif args.format == "columnar":
+        rows = write_columnar(chunks, args.out)
+        target = args.out
+    else:
+        db = None if args.out == parser.get_default("out") else args.out
+        rows = load_db(chunks, db)
+        target = db or "backend/irrigation.db"
+    elapsed = time.perf_counter() - started
+    print(f"✅ {rows:,} rows ({args.devices} zones) written to {target} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
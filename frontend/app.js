@@ -1,5 +1,7 @@
 let simulationRunning = false;
 let simulationInterval;
+let dashboardCursor = null; // /api/dashboard cursor: only rows added since are sent back
+let dashboardPolling = false;
 let waterUsed = 0;
 let pumpStatus = "OFF";
 let autoMode = false; // Automatic pump toggle
@@ -30,59 +32,118 @@ function updateWaterUsage(amount) {
 }
 
 /* ------------------- Simulation Logic ------------------- */
-async function fetchSimulationData() {
-  try {
-    const response = await fetch("/api/simulation/data");
-    const data = await response.json();
+// countWater: add 2 L per pump-on row locally (polling mode); with the event
+// stream, water comes from separate 'water' events instead.
+function appendTableRow(data) {
+  const row = document.createElement("tr");
+  row.innerHTML = `
+    <td>${data.timestamp}</td>
+    <td>${data.soil_moisture}</td>
+    <td>${data.temperature}</td>
+    <td>${data.humidity}</td>
+  `;
+  tableBody.appendChild(row);
+  return row;
+}
 
-    // Handle simulation status responses
-    if (data.status === "stopped") {
-      statusEl.textContent = "Simulation stopped.";
-      clearInterval(simulationInterval);
-      simulationRunning = false;
-      return;
-    }
-    if (data.status === "completed") {
-      statusEl.textContent = "Simulation completed.";
-      clearInterval(simulationInterval);
-      simulationRunning = false;
-      return;
+function renderSimulationRow(data, countWater) {
+  // Insert row into table
+  if (tableBody) {
+    const row = appendTableRow(data);
+    if (!autoScrollToggle || autoScrollToggle.checked) {
+      row.scrollIntoView({ behavior: "smooth", block: "end" });
     }
-    if (data.status === "starting") {
-      statusEl.textContent = "Simulation starting...";
-      return;
+  }
+
+  // Pump control
+  if (autoMode) {
+    if (data.pump_status === 1 || data.soil_moisture < 400) {
+      updatePumpStatus("ON");
+      if (countWater) updateWaterUsage(2);
+    } else {
+      updatePumpStatus("OFF");
     }
+  } else {
+    // Respect backend pump_status when not in auto mode
+    updatePumpStatus(data.pump_status === 1 ? "ON" : "OFF");
+    if (countWater && data.pump_status === 1) updateWaterUsage(2);
+  }
+}
 
-    // Insert row into table
-    if (tableBody) {
-      const row = document.createElement("tr");
-      row.innerHTML = `
-        <td>${data.timestamp}</td>
-        <td>${data.soil_moisture}</td>
-        <td>${data.temperature}</td>
-        <td>${data.humidity}</td>
-      `;
-      tableBody.appendChild(row);
-      if (!autoScrollToggle || autoScrollToggle.checked) {
-        row.scrollIntoView({ behavior: "smooth", block: "end" });
-      }
+/* ------------------- Live Event Stream (SSE) ------------------- */
+// One push connection replaces the 1 s simulation poll and the 5 s status poll.
+let eventSource = null;
+
+function connectEvents() {
+  if (!window.EventSource) return false;
+  eventSource = new EventSource("/api/events");
+  eventSource.addEventListener("sensor", (e) => {
+    const data = JSON.parse(e.data);
+    if (data.device_id) return; // hardware readings are not part of the simulation table
+    if (simulationRunning) {
+      statusEl && (statusEl.textContent = "Simulation running...");
+      renderSimulationRow(data, false);
+    }
+  });
+  eventSource.addEventListener("water", (e) => {
+    updateWaterUsage(Number(JSON.parse(e.data).liters_used || 0));
+  });
+  eventSource.addEventListener("pump", (e) => {
+    updatePumpStatus((JSON.parse(e.data).pump_status || "OFF").toUpperCase());
+  });
+  eventSource.addEventListener("simulation", (e) => {
+    const s = JSON.parse(e.data);
+    if (s.status === "started") {
+      simulationRunning = true;
+    } else {
+      simulationRunning = false;
+      statusEl && (statusEl.textContent = s.status === "completed" ? "Simulation completed." : "Simulation stopped.");
     }
+  });
+  return true;
+}
 
-    // Pump control
-    if (autoMode) {
-      if (data.pump_status === 1 || data.soil_moisture < 400) {
-        updatePumpStatus("ON");
-        updateWaterUsage(2);
-      } else {
-        updatePumpStatus("OFF");
-      }
+function startSimulationUpdates() {
+  if (simulationInterval) clearInterval(simulationInterval);
+  if (eventSource) return; // rows arrive as 'sensor' events
+  simulationInterval = setInterval(pollDashboard, 1000);
+}
+
+/* ------------------- Dashboard Deltas ------------------- */
+// One request per poll: status plus only the sensor rows added since the last
+// one (the first call returns the newest 50 rows).
+function applyStatus(st) {
+  if (st && st.pump_status) updatePumpStatus((st.pump_status || "OFF").toUpperCase());
+  if (waterUsageEl && st && typeof st.water_used === "number") {
+    waterUsed = 0;
+    updateWaterUsage(Number(st.water_used || 0));
+  }
+}
+
+async function pollDashboard() {
+  if (dashboardPolling) return;
+  dashboardPolling = true;
+  try {
+    const first = dashboardCursor === null;
+    const res = await fetch(first ? "/api/dashboard?limit=50" : `/api/dashboard?cursor=${dashboardCursor}`);
+    const d = await res.json();
+    dashboardCursor = d.cursor;
+    if (first && tableBody) {
+      tableBody.innerHTML = "";
+      d.sensor.forEach(appendTableRow);
     } else {
-      // Respect backend pump_status when not in auto mode
-      updatePumpStatus(data.pump_status === 1 ? "ON" : "OFF");
-      if (data.pump_status === 1) updateWaterUsage(2);
+      d.sensor.forEach(r => renderSimulationRow(r, false));
+    }
+    applyStatus(d.status);
+    if (simulationRunning && !d.status.simulation_running) {
+      simulationRunning = false;
+      clearInterval(simulationInterval);
+      statusEl && (statusEl.textContent = "Simulation stopped.");
     }
   } catch (error) {
-    console.error("Error fetching simulation data:", error);
+    console.error("Error fetching dashboard data:", error);
+  } finally {
+    dashboardPolling = false;
   }
 }
 
@@ -98,7 +159,7 @@ if (startBtn) {
         waterUsed = 0;
         updateWaterUsage(0);
         if (tableBody) tableBody.innerHTML = "";
-        simulationInterval = setInterval(fetchSimulationData, 1000);
+        startSimulationUpdates();
       }
     } catch (error) {
       statusEl.textContent = "Failed to start simulation.";
@@ -135,52 +196,9 @@ if (autoScrollToggle) {
 }
 
 /* ------------------- Initialization on Load ------------------- */
+// Status, the recent rows for the table and the water total in one request
 async function initializeFromBackend() {
-  try {
-    // Cross-page status
-    try {
-      const st = await fetch('/api/status');
-      const sj = await st.json();
-      if (sj && sj.pump_status) {
-        updatePumpStatus((sj.pump_status || 'OFF').toUpperCase());
-      }
-      if (waterUsageEl && typeof sj.water_used === 'number') {
-        waterUsed = 0;
-        updateWaterUsage(Number(sj.water_used || 0));
-      }
-    } catch {}
-    // Initialize table with recent data if exists
-    if (tableBody) {
-      const res = await fetch("/api/data/recent?limit=50");
-      const rows = await res.json();
-      tableBody.innerHTML = "";
-      rows.reverse().forEach(r => {
-        const tr = document.createElement("tr");
-        tr.innerHTML = `
-          <td>${r.timestamp}</td>
-          <td>${r.soil_moisture}</td>
-          <td>${r.temperature}</td>
-          <td>${r.humidity}</td>
-        `;
-        tableBody.appendChild(tr);
-      });
-      if (rows.length > 0) {
-        const last = rows[0];
-        updatePumpStatus(last.pump_status === 1 || last.pump_status === "ON" ? "ON" : "OFF");
-      }
-    }
-
-    // Initialize water total from water usage logs
-    if (waterUsageEl) {
-      const usageRes = await fetch("/api/water/usage");
-      const usageData = await usageRes.json();
-      const total = usageData.reduce((sum, r) => sum + Number(r.liters_used || 0), 0);
-      waterUsed = 0; // reset internal counter
-      updateWaterUsage(total);
-    }
-  } catch (e) {
-    console.error("Failed to initialize dashboard:", e);
-  }
+  await pollDashboard();
 }
 
 async function resumeIfRunning() {
@@ -190,8 +208,7 @@ async function resumeIfRunning() {
     if (s.running) {
       simulationRunning = true;
       statusEl && (statusEl.textContent = "Simulation running...");
-      if (simulationInterval) clearInterval(simulationInterval);
-      simulationInterval = setInterval(fetchSimulationData, 1000);
+      startSimulationUpdates();
     }
   } catch (e) {
     // ignore
@@ -199,10 +216,10 @@ async function resumeIfRunning() {
 }
 
 document.addEventListener("DOMContentLoaded", () => {
+  const live = connectEvents();
   initializeFromBackend();
   resumeIfRunning();
+  if (live) return; // pump/water changes are pushed
   // keep status in sync across pages
-  setInterval(async ()=>{
-    try { const r = await fetch('/api/status'); const j = await r.json(); if (j && j.pump_status) updatePumpStatus((j.pump_status||'OFF').toUpperCase()); if (waterUsageEl && typeof j.water_used==='number') { waterUsed = 0; updateWaterUsage(Number(j.water_used||0)); } } catch {}
-  }, 5000);
+  setInterval(pollDashboard, 5000);
 });